@@ -0,0 +1,42 @@
+from pathlib import Path
+import argparse
+import sys
+import time
+import tracemalloc
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from src.config import VERTICAL_DATA_DIR
+from src.stats_pipeline import load_files, run_stat_analysis
+from src.plotting.frequency import get_max_values
+
+
+def measure(files, dtype):
+    """Runs the pipeline once and returns (retained MB, peak MB, seconds), where
+    retained is the memory still held by the trial traces and peak values."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    lateral_velocity, forward_velocity, body_angles, angular_velocity, summary = run_stat_analysis(files, dtype=dtype)
+    max_values = get_max_values(lateral_velocity, forward_velocity, body_angles, angular_velocity)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return retained / 1e6, peak / 1e6, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of the analysis pipeline per float dtype.")
+    parser.add_argument("data_dir", nargs="?", default=VERTICAL_DATA_DIR, type=Path)
+    args = parser.parse_args()
+
+    files = load_files(args.data_dir)
+    print(f"{len(files)} files in {args.data_dir}")
+
+    for dtype in ("float64", "float32"):
+        retained, peak, elapsed = measure(files, dtype)
+        print(f"{dtype}: retained {retained:.2f} MB, peak {peak:.1f} MB, {elapsed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
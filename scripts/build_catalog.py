@@ -0,0 +1,28 @@
+from pathlib import Path
+import argparse
+import sys
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(PROJECT_ROOT))
+
+from src.config import DATA_RAW, CATALOG_DB
+from src.catalog import build_catalog, query, stim_table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scans the raw recordings into the SQLite catalog.")
+    parser.add_argument("root", nargs="?", default=DATA_RAW, type=Path)
+    parser.add_argument("--db", default=CATALOG_DB, type=Path)
+    parser.add_argument("--workers", default=None, type=int)
+    args = parser.parse_args()
+
+    n_scanned = build_catalog(args.root, args.db, max_workers=args.workers)
+    print(f"Scanned {n_scanned} new or modified files into {args.db}")
+
+    print(query("SELECT cohort, COUNT(*) AS n_files, MIN(fps) AS min_fps, MAX(nan_fraction) AS max_nan_fraction "
+                "FROM files GROUP BY cohort ORDER BY cohort", db=args.db).to_string(index=False))
+    print(stim_table(args.db).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,15 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).resolve().parents[1] 
 sys.path.append(str(PROJECT_ROOT))
 
-from src.config import VERTICAL_DATA_DIR, FREQUENCIES, C0_DIRECTORY, C3_DIRECTORY, C4_DIRECTORY, C9_DIRECTORY, C10_DIRECTORY
-from src.stats_pipeline import load_files, run_stat_analysis
+from src.config import VERTICAL_DATA_DIR, FREQUENCIES, CATALOG_DB, COHORT_PATTERN, COHORT_MANIFEST
+from src.stats_pipeline import load_files
+from src.cohorts import discover_cohorts, run_batch
+from src.catalog import build_catalog, select_files, select_cohorts
+from src.circular import circular_summary
+from src.alignment import trial_times
+from src.dose_response import fit_dose_response
+from src.plotting.figures import figure_batch
+from src.plotting.polar_plots import heading_polar_plot, mean_vector_plot
 from src.plotting.time_series import (
     antenna_time_plot,
     antenna_time_plot_single,
@@ -26,94 +33,108 @@ from src.plotting.frequency import (
 )
 
 
+# Cohorts without elytra (cerci) stimulation data
+NO_CERCI_DATA = ["C0"]
+
+
 def main():
-    files = load_files(VERTICAL_DATA_DIR)
-    
-    lateral_velocity, forward_velocity, body_angles, angular_velocity, summary = run_stat_analysis(files)
-
-    print(body_angles)
-
-    # print("Number of Turning trials is: ", summary["turning_succ_no"])
-    # print("Success Turning is: ", summary["turning_succ_no"] / (summary["turning_succ_no"] + summary["turning_fail_no"]))
-
-    # print("Number of forward trials is: ", summary["elytra_succ_no"])
-    # print("Success Forward is: ", summary["elytra_succ_no"] / (summary["elytra_succ_no"] + summary["elytra_fail_no"]))
-
-    antenna_trials_plot(body_angles, FREQUENCIES, "Trials", save=True)
-
-    # Save max values (your existing JSON writes)
-    outputs_dir = Path("outputs/json")
-    outputs_dir.mkdir(parents=True, exist_ok=True)
-
-    lateral_max_all, fwd_max_all, angles_max_all, ang_vel_max = get_max_values(
-        lateral_velocity, forward_velocity, body_angles, angular_velocity
-    )
-
-    files_C0 = load_files(C0_DIRECTORY)
-    files_C3 = load_files(C3_DIRECTORY)
-    files_C4 = load_files(C4_DIRECTORY)
-    files_C9 = load_files(C9_DIRECTORY)
-    files_C10 = load_files(C10_DIRECTORY)
-
-    individual_roaches = [files_C0, files_C3, files_C4, 
-                          files_C9, files_C10]
-    
-    roach_ids = ["C0", "C3", "C4", "C9", "C10"]
-
-    results = {}
-    for roach_id, roach_file in zip(roach_ids, individual_roaches): 
-        lateral_velocity, forward_velocity, body_angles, angular_velocity, summary = run_stat_analysis(roach_file)
-        lateral_max, fwd_max, angles_max, ang_vel_max = get_max_values(lateral_velocity, forward_velocity, 
-                                                                       body_angles, angular_velocity)
-        results[roach_id] = { 
-            "lateral_max": lateral_max, 
-            "fwd_max": fwd_max, 
-            "angles_max": angles_max 
-        }   
-
-    all_roach_mean_std_plot(
-    angles_dict_all=angles_max_all,
-    results=results,
-    frequencies=FREQUENCIES,
-    direction="Right",
-    title="Turning Angle (degs)",
-    save=True,
-    suffix="_Right",
-    )
-
-    all_roach_mean_std_plot(
-    angles_dict_all=angles_max_all,
-    results=results,
-    frequencies=FREQUENCIES,
-    direction="Left",
-    title="Turning Angle (degs)",
-    save=True,
-    suffix="_Left",
-    )
-
-    individual_roaches = [files_C10, files_C3, files_C4, 
-                          files_C9]
-    
-    roach_ids = ["C10", "C3", "C4", "C9"]
-
-    results = {}
-    for roach_id, roach_file in zip(roach_ids, individual_roaches): 
-        lateral_velocity, forward_velocity, body_angles, angular_velocity, summary = run_stat_analysis(roach_file)
-        lateral_max, fwd_max, angles_max, ang_vel_max = get_max_values(lateral_velocity, forward_velocity, 
-                                                                       body_angles, angular_velocity)
-        results[roach_id] = { 
-            "lateral_max": lateral_max, 
-            "fwd_max": fwd_max, 
-            "angles_max": angles_max 
-        }   
-    all_roach_cerci_plot(
-    fwd_max_all,
-    results=results,
-    frequencies=FREQUENCIES,
-    direction="Both", 
-    title="Forward Velocity (mm / s)",
-    save=True,
-    suffix="",
-    )
+    # The pooled data set and every individual roach share one worker pool
+    # Inputs come from the catalog once it is built (scripts/build_catalog.py),
+    # rescanned first so recordings added since are not left out (cheap when
+    # unchanged). A cohort manifest defines the roaches in both cases.
+    if CATALOG_DB.exists():
+        build_catalog()
+        roaches = discover_cohorts() if COHORT_MANIFEST.exists() else select_cohorts(COHORT_PATTERN)
+        cohorts = {"all": select_files(cohort=VERTICAL_DATA_DIR.name), **roaches}
+    else:
+        cohorts = {"all": load_files(VERTICAL_DATA_DIR), **discover_cohorts()}
+    cohort_results, _ = run_batch(cohorts)
+
+    # Figures are reused per layout and released at the end of the plotting pass
+    with figure_batch(track_memory=True) as figures:
+        # Heading statistics of every (side, freq, cohort) in one pass
+        headings = circular_summary(cohort_results)
+        heading_polar_plot(headings, FREQUENCIES, cohort="all", save=True)
+        for direction in ("Right", "Left"):
+            mean_vector_plot({key: stats for key, stats in headings.items() if key[2] != "all"},
+                             FREQUENCIES, direction, save=True)
+
+        lateral_velocity, forward_velocity, body_angles, angular_velocity, summary = cohort_results.pop("all")
+
+        print(body_angles)
+
+        # print("Number of Turning trials is: ", summary["turning_succ_no"])
+        # print("Success Turning is: ", summary["turning_succ_no"] / (summary["turning_succ_no"] + summary["turning_fail_no"]))
+
+        # print("Number of forward trials is: ", summary["elytra_succ_no"])
+        # print("Success Forward is: ", summary["elytra_succ_no"] / (summary["elytra_succ_no"] + summary["elytra_fail_no"]))
+
+        antenna_trials_plot(body_angles, FREQUENCIES, "Trials", save=True, times=trial_times(summary))
+
+        # Save max values (your existing JSON writes)
+        outputs_dir = Path("outputs/json")
+        outputs_dir.mkdir(parents=True, exist_ok=True)
+
+        lateral_max_all, fwd_max_all, angles_max_all, ang_vel_max = get_max_values(
+            lateral_velocity, forward_velocity, body_angles, angular_velocity
+        )
+
+        results = {}
+        for roach_id, roach_result in cohort_results.items(): 
+            lateral_velocity, forward_velocity, body_angles, angular_velocity, summary = roach_result
+            lateral_max, fwd_max, angles_max, ang_vel_max = get_max_values(lateral_velocity, forward_velocity, 
+                                                                           body_angles, angular_velocity)
+            results[roach_id] = { 
+                "lateral_max": lateral_max, 
+                "fwd_max": fwd_max, 
+                "angles_max": angles_max 
+            }   
+
+        # Dose-response parameters with confidence intervals of every roach and side
+        peaks = {"all": {"angles_max": angles_max_all, "fwd_max": fwd_max_all}, **results}
+        fits = fit_dose_response(peaks, models=("linear", "hill"))
+        # The cross-roach plots draw means of |peak|, their curves are fitted to the same
+        magnitude_fits = fit_dose_response(peaks, models=("hill",), magnitude=True)
+        tables_dir = outputs_dir.parent / "tables"
+        tables_dir.mkdir(parents=True, exist_ok=True)
+        fits.to_csv(tables_dir / "dose_response.csv", index=False)
+
+        all_roach_mean_std_plot(
+        angles_dict_all=angles_max_all,
+        results=results,
+        frequencies=FREQUENCIES,
+        direction="Right",
+        title="Turning Angle (degs)",
+        save=True,
+        suffix="_Right",
+        fits=magnitude_fits,
+        )
+
+        all_roach_mean_std_plot(
+        angles_dict_all=angles_max_all,
+        results=results,
+        frequencies=FREQUENCIES,
+        direction="Left",
+        title="Turning Angle (degs)",
+        save=True,
+        suffix="_Left",
+        fits=magnitude_fits,
+        )
+
+        cerci_results = {roach_id: result for roach_id, result in results.items()
+                         if roach_id not in NO_CERCI_DATA}
+        all_roach_cerci_plot(
+        fwd_max_all,
+        results=cerci_results,
+        frequencies=FREQUENCIES,
+        direction="Both", 
+        title="Forward Velocity (mm / s)",
+        save=True,
+        suffix="",
+        fits=magnitude_fits,
+        )
+    print("Plotting:", figures.report())
+
+
 if __name__ == "__main__":
     main()
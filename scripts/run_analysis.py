@@ -6,9 +6,15 @@ from pathlib import Path
 PROJECT_ROOT = Path(__file__).resolve().parents[1] 
 sys.path.append(str(PROJECT_ROOT))
 
-from src.config import VERTICAL_DATA_DIR, FREQUENCIES
+from src.config import VERTICAL_DATA_DIR, FREQUENCIES, CATALOG_DB
 from src.config import VERTICAL_DATA_DIR, FREQUENCIES
 from src.stats_pipeline import load_files, run_stat_analysis
+from src.catalog import build_catalog, select_files
+from src.export import export_results
+from src.aggregates import build_aggregates, save_aggregates
+from src.alignment import trial_times
+from src.spectral import stim_power
+from src.anomaly import flag_anomalies, drop_anomalies
 from src.plotting.time_series import (
     antenna_time_plot,
     antenna_time_plot_single,
@@ -17,6 +23,7 @@ from src.plotting.time_series import (
     antenna_trials_plot,
     elytra_trials_plot,
 )
+from src.plotting.figures import figure_batch
 from src.plotting.frequency import (
     get_max_values,
     frequency_plot,
@@ -25,8 +32,19 @@ from src.plotting.frequency import (
 
 
 def main():
-    files = load_files(VERTICAL_DATA_DIR)
-    lateral_velocity, forward_velocity, body_angles, angular_velocity, summary = run_stat_analysis(files)
+    # Inputs come from the catalog once it is built (scripts/build_catalog.py),
+    # rescanned first so recordings added since are not left out (cheap when unchanged)
+    if CATALOG_DB.exists():
+        build_catalog()
+        files = select_files(cohort=VERTICAL_DATA_DIR.name)
+    else:
+        files = load_files(VERTICAL_DATA_DIR)
+    result = run_stat_analysis(files)
+
+    # Odd-shaped trials per condition are rejected before any statistics or figure
+    flag_anomalies(result)
+    print("Anomalous trials: ", result[4]["anomaly_reject_no"])
+    lateral_velocity, forward_velocity, body_angles, angular_velocity, summary = drop_anomalies(result)
 
     # Save max values (your existing JSON writes)
     outputs_dir = Path("outputs/json")
@@ -50,17 +68,39 @@ def main():
     with open(outputs_dir / "fwd_max_vert_Acrylic.json", "w") as f:
         json.dump({str(k): v for k, v in fwd_max.items()}, f)
 
-    # Antenna plots
-    antenna_time_plot_single(body_angles, 20, "Angular Deviation (degrees)", save=True)
-    antenna_time_plot(body_angles, FREQUENCIES, "Angular Deviation (degrees)", save=True)
-    antenna_trials_plot(body_angles, FREQUENCIES, "Angular Deviation (degrees)", save=True)
-    frequency_plot(angles_max, FREQUENCIES, "Angular Deviation (degrees)", save=True)
-
-    # Elytra plots
-    elytra_time_plot_single(forward_velocity, 20, "Forward Velocity (mm/s)", save=True)
-    elytra_time_plot(forward_velocity, FREQUENCIES, "Forward Velocity (mm/s)", save=True)
-    elytra_trials_plot(forward_velocity, FREQUENCIES, "Forward Velocity (mm/s)", save=True)
-    frequency_plot_elytra(fwd_max, FREQUENCIES, "Forward Velocity (mm/s)", save=True)
-    
+    # Full traces, peaks and success rates for downstream notebooks
+    export_results(
+        {"vert_Acrylic": (lateral_velocity, forward_velocity, body_angles, angular_velocity, summary)},
+        outputs_dir.parent / "tables",
+        prefix="vert_Acrylic_",
+    )
+
+    # Response power at the stimulation frequency and its harmonics, per trial
+    stim_power((lateral_velocity, forward_velocity, body_angles, angular_velocity, summary)).to_csv(
+        outputs_dir.parent / "tables" / "vert_Acrylic_stim_power.csv", index=False)
+
+    # Curves and boxplot statistics, to redraw the figures without re-analysis
+    save_aggregates(
+        build_aggregates((lateral_velocity, forward_velocity, body_angles, angular_velocity, summary)),
+        "vert_Acrylic",
+    )
+
+    # Figures are reused per layout and released at the end of the plotting pass
+    # Trials are drawn on their window timestamps, as the saved aggregates are
+    times = trial_times(summary)
+    with figure_batch(track_memory=True) as figures:
+        # Antenna plots
+        antenna_time_plot_single(body_angles, 20, "Angular Deviation (degrees)", save=True, times=times)
+        antenna_time_plot(body_angles, FREQUENCIES, "Angular Deviation (degrees)", save=True, times=times)
+        antenna_trials_plot(body_angles, FREQUENCIES, "Angular Deviation (degrees)", save=True, times=times)
+        frequency_plot(angles_max, FREQUENCIES, "Angular Deviation (degrees)", save=True)
+
+        # Elytra plots
+        elytra_time_plot_single(forward_velocity, 20, "Forward Velocity (mm/s)", save=True, times=times)
+        elytra_time_plot(forward_velocity, FREQUENCIES, "Forward Velocity (mm/s)", save=True, times=times)
+        elytra_trials_plot(forward_velocity, FREQUENCIES, "Forward Velocity (mm/s)", save=True, times=times)
+        frequency_plot_elytra(fwd_max, FREQUENCIES, "Forward Velocity (mm/s)", save=True)
+    print("Plotting:", figures.report())
+
 if __name__ == "__main__":
     main()
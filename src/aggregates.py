@@ -0,0 +1,127 @@
+import warnings
+from pathlib import Path
+
+import numpy as np
+from matplotlib import cbook
+
+from .alignment import trial_matrix, trial_times
+from .config import DATA_PROCESSED
+from .plotting.frequency import get_max_values
+from .windows import WINDOW
+
+AGGREGATES_DIR = DATA_PROCESSED / "aggregates"
+
+CURVE_MEASURES = ("lateral_velocity", "forward_velocity", "body_angle", "angular_velocity")
+PEAK_MEASURES = ("lateral_max", "fwd_max", "angles_max", "ang_vel_max")
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+# Scalar statistics of matplotlib's boxplot_stats
+BOX_STATS = ("mean", "iqr", "cilo", "cihi", "whishi", "whislo", "q1", "med", "q3")
+
+
+def curve_aggregates(data_dict, times=None, quantiles=QUANTILES, grid=None, window=WINDOW):
+    """Mean, std and quantile bands of every key's trials on a common grid.
+
+    Args:
+        data_dict (dict): {(side, freq): [trial traces]}.
+        times (dict): Optional window timestamps per key (alignment.trial_times),
+            to aggregate on a time grid instead of stretching by index.
+        quantiles (tuple): Quantiles to store, as "q05", "q25", ...
+        grid (np.ndarray): Fixed time grid relative to the stimulation, used
+            with times (defaults to the one of alignment.align_trials).
+        window (WindowSpec): Trial window the x axis spans.
+
+    Returns:
+        dict: {(side, freq): {"x", "mean", "std", "n", "q..."}}, x being the
+        plot time axis used by the time-series plots.
+    """
+    aggregates = {}
+    for key, traces in data_dict.items():
+        if len(traces) == 0:
+            continue
+        x, matrix = trial_matrix(traces, None if times is None else times.get(key), grid, window)
+        with warnings.catch_warnings():
+            # Grid points outside every trial are all-NaN columns
+            warnings.simplefilter("ignore", RuntimeWarning)
+            curve = {
+                "x": x,
+                "mean": np.nanmean(matrix, axis=0),
+                "std": np.nanstd(matrix, axis=0),
+                "n": np.sum(~np.isnan(matrix), axis=0),
+            }
+            for q, band in zip(quantiles, np.nanquantile(matrix, quantiles, axis=0)):
+                curve[f"q{round(q * 100):02d}"] = band
+        aggregates[key] = curve
+    return aggregates
+
+
+def peak_aggregates(peaks_dict):
+    """Boxplot statistics (matplotlib's bxp format) of every key's peak values."""
+    return {key: cbook.boxplot_stats(np.asarray(values, dtype=float))[0]
+            for key, values in peaks_dict.items() if len(values) > 0}
+
+
+def build_aggregates(result, window=WINDOW):
+    """Aggregates of one run_stat_analysis output (analysed with window).
+
+    Returns:
+        dict: {"curves": {measure: curve_aggregates}, "peaks": {measure: peak_aggregates}}
+        with the measures of CURVE_MEASURES and PEAK_MEASURES.
+    """
+    traces = result[:4]
+    times = trial_times(result[4]) or None
+    peaks = get_max_values(*traces, window=window)
+    return {
+        "curves": {name: curve_aggregates(dct, times, window=window) for name, dct in zip(CURVE_MEASURES, traces)},
+        "peaks": {name: peak_aggregates(dct) for name, dct in zip(PEAK_MEASURES, peaks)},
+    }
+
+
+def save_aggregates(aggregates, cohort, out_dir=AGGREGATES_DIR):
+    """Saves one cohort's aggregates to <out_dir>/<cohort>.npz and returns the path.
+
+    Each curve is stored as a single (stats, grid) array and each boxplot as one
+    array of its scalar statistics plus its fliers, so loading stays cheap."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    arrays = {}
+    for measure, keys in aggregates["curves"].items():
+        for (side, freq), curve in keys.items():
+            arrays[f"curves/{measure}/{side}/{freq}"] = np.vstack(list(curve.values())).astype(np.float64)
+            arrays["curve_stats"] = np.array(list(curve))
+    for measure, keys in aggregates["peaks"].items():
+        for (side, freq), stats in keys.items():
+            arrays[f"peaks/{measure}/{side}/{freq}"] = np.array([stats[stat] for stat in BOX_STATS], dtype=np.float64)
+            arrays[f"fliers/{measure}/{side}/{freq}"] = np.asarray(stats["fliers"], dtype=np.float64)
+
+    path = out_dir / f"{cohort}.npz"
+    np.savez(path, **arrays)
+    return path
+
+
+def load_aggregates(path_or_cohort, out_dir=AGGREGATES_DIR):
+    """Loads saved aggregates (a path or a cohort name) back into the structure of
+    build_aggregates. The curves can be passed straight to the time-series plots
+    and the peaks to the frequency boxplots, e.g.
+    antenna_time_plot(agg["curves"]["body_angle"], ...)."""
+    path = Path(path_or_cohort)
+    if path.suffix != ".npz":
+        path = Path(out_dir) / f"{path_or_cohort}.npz"
+
+    aggregates = {"curves": {}, "peaks": {}}
+    with np.load(path) as data:
+        curve_stats = data["curve_stats"].tolist() if "curve_stats" in data.files else []
+        for name in data.files:
+            if name == "curve_stats":
+                continue
+            kind, measure, side, freq = name.split("/")
+            key = (side, int(freq))
+            value = data[name]
+            if kind == "curves":
+                aggregates["curves"].setdefault(measure, {})[key] = dict(zip(curve_stats, value))
+            elif kind == "peaks":
+                stats = aggregates["peaks"].setdefault(measure, {}).setdefault(key, {})
+                stats.update(zip(BOX_STATS, value.tolist()))
+            else:
+                aggregates["peaks"].setdefault(measure, {}).setdefault(key, {})["fliers"] = value
+    return aggregates
@@ -0,0 +1,203 @@
+import warnings
+
+import numpy as np
+from scipy import fft
+
+from .config import REALIGN_MAX_LAG_S
+from .windows import WINDOW
+
+
+def time_grid(fps, window=WINDOW):
+    """Shared time grid (seconds relative to the stimulation) from -window.pre to
+    window.post sampled at fps."""
+    frames = window.frames(fps)
+    return np.arange(-frames.pre, frames.post) / fps
+
+
+def trial_times(summary):
+    """{key: [window timestamps]} from the per-trial records of run_stat_analysis,
+    aligned with its trace lists."""
+    return {key: [record["time"] for record in records] for key, records in summary.get("trials", {}).items()}
+
+
+def pad_trials(arrays, fill=np.nan):
+    """Stacks variable length 1D trials into one (n_trials, max_len) matrix.
+
+    Returns:
+        tuple: (matrix padded with fill, (n_trials,) lengths).
+    """
+    lengths = np.array([len(a) for a in arrays])
+    padded = np.full((len(arrays), lengths.max(initial=0)), fill, dtype=np.float64)
+    mask = np.arange(padded.shape[1]) < lengths[:, None]
+    padded[mask] = np.concatenate([np.asarray(a, dtype=np.float64) for a in arrays]) if len(arrays) else []
+    return padded, lengths
+
+
+
+def batch_interp(grid, times, values):
+    """Linear interpolation of many trials onto one grid in a single vectorised pass.
+
+    Args:
+        grid (np.ndarray): (m,) increasing target times.
+        times (list): n increasing 1D timestamp arrays (lengths may differ).
+        values (list): n 1D arrays, each the same length as its timestamps.
+
+    Returns:
+        np.ndarray: (n, m) matrix, NaN where the grid lies outside a trial.
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    n, m = len(times), len(grid)
+    if n == 0:
+        return np.empty((0, m))
+
+    t, lengths = pad_trials(times)
+    v, _ = pad_trials(values)
+    valid = lengths > 0
+    last = np.maximum(lengths - 1, 0)
+    rows = np.arange(n)
+
+    # Padding repeats each trial's last sample so the rows stay sorted
+    pad = np.arange(t.shape[1]) > last[:, None]
+    t = np.where(pad, t[rows, last][:, None], t)
+    v = np.where(pad, v[rows, last][:, None], v)
+
+    # Shift every row into its own disjoint range so one searchsorted covers all trials
+    extent = np.nanmax(np.abs(t)) + np.abs(grid).max() + 1
+    offsets = rows[:, None] * 4 * extent
+    flat_t = (t + offsets).ravel()
+    idx = np.searchsorted(flat_t, (grid[None, :] + offsets).ravel()).reshape(n, m)
+
+    # Index of the upper neighbour within each row
+    width = t.shape[1]
+    idx = np.clip(idx - rows[:, None] * width, 1, max(width - 1, 1))
+    lo, hi = idx - 1, idx
+    t_lo, t_hi = t[rows[:, None], lo], t[rows[:, None], hi]
+    v_lo, v_hi = v[rows[:, None], lo], v[rows[:, None], hi]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(t_hi > t_lo, (grid - t_lo) / (t_hi - t_lo), 0.0)
+    out = v_lo + frac * (v_hi - v_lo)
+
+    # Outside a trial's recorded span there is no data
+    outside = (grid < t[:, :1]) | (grid > t[rows, last][:, None]) | ~valid[:, None]
+    out[outside] = np.nan
+    return out
+
+
+def align_trials(traces, times, grid=None, fps=None, window=WINDOW):
+    """Aligns trials of different lengths / frame rates on a shared time grid
+    relative to the stimulation onset.
+
+    Args:
+        traces (list): 1D trial traces.
+        times (list): Window timestamps relative to the stimulation, one per trace.
+            Derived traces (velocities) are shorter than their window, they are
+            matched with the last len(trace) timestamps.
+        grid (np.ndarray): Target grid, defaults to time_grid of window at fps
+            (or at the highest frame rate among the trials).
+
+    Returns:
+        tuple: (grid, (n_trials, len(grid)) matrix).
+    """
+    times = [np.asarray(t)[len(t) - len(trace):] for trace, t in zip(traces, times)]
+    if grid is None:
+        if fps is None:
+            fps = max((1 / np.median(np.diff(t)) for t in times if len(t) > 1), default=1)
+        grid = time_grid(fps, window)
+    return grid, batch_interp(grid, times, traces)
+
+
+def trial_matrix(traces, times=None, grid=None, window=WINDOW):
+    """Stacks trials of different lengths into one (n_trials, m) matrix.
+
+    With their window timestamps the trials are aligned on a time grid (see
+    align_trials), otherwise they are stretched by index to the longest trial,
+    as the plots always did. x is the plot time axis in seconds (0 to
+    window.duration), with the stimulation at window.pre. grid fixes the time
+    grid (see align_trials).
+
+    Returns:
+        tuple: (x, matrix)
+    """
+    if times is not None:
+        grid, matrix = align_trials(traces, times, grid, window=window)
+        return grid + window.pre, matrix
+
+    max_len = max(len(trace) for trace in traces)
+    index_times = [np.linspace(0, 1, len(trace)) for trace in traces]
+    matrix = batch_interp(np.linspace(0, 1, max_len), index_times, traces)
+    return np.linspace(0, window.duration, max_len), matrix
+
+
+def xcorr_lags(matrix, template=None, max_lag=None):
+    """Lag (frames) of every row of a matrix against a template, from their
+    cross-correlation computed for all rows in one batched FFT.
+
+    Args:
+        matrix (np.ndarray): (n_trials, m) trials on a common grid, NaN outside a trial.
+        template (np.ndarray): (m,) reference, defaults to the mean trial.
+        max_lag (int): Largest lag searched in either direction.
+
+    Returns:
+        np.ndarray: (n_trials,) lags; positive when the trial lags behind.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    n, m = matrix.shape
+    if n == 0 or m == 0:
+        return np.zeros(n, dtype=np.int64)
+    if template is None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            template = np.nanmean(matrix, axis=0)
+    max_lag = m - 1 if max_lag is None else min(int(max_lag), m - 1)
+
+    # Demeaned, with the samples outside a trial contributing nothing
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        rows = np.nan_to_num(matrix - np.nanmean(matrix, axis=1, keepdims=True))
+        template = np.nan_to_num(template - np.nanmean(template))
+
+    size = fft.next_fast_len(2 * m - 1, real=True)
+    cc = fft.irfft(fft.rfft(rows, size, axis=1) * np.conj(fft.rfft(template, size)), size, axis=1)
+    # Circular lags -max_lag..max_lag
+    lags = np.arange(-max_lag, max_lag + 1)
+    return lags[np.argmax(cc[:, lags % size], axis=1)]
+
+
+def shift_rows(matrix, lags):
+    """Shifts every row of a matrix back by its lag (frames), NaN where the
+    shifted trial has no data."""
+    matrix = np.asarray(matrix, dtype=np.float64)
+    index = np.arange(matrix.shape[1]) + np.asarray(lags)[:, None]
+    inside = (index >= 0) & (index < matrix.shape[1])
+    shifted = np.take_along_axis(matrix, np.clip(index, 0, matrix.shape[1] - 1), axis=1)
+    return np.where(inside, shifted, np.nan)
+
+
+def realign_trials(matrix, dx, max_lag=REALIGN_MAX_LAG_S, iterations=3):
+    """Realigns a condition's trials on their mean to remove onset jitter
+    (e.g. between the Arduino marker and the camera).
+
+    The mean of jittered trials is smeared, so the template is rebuilt from the
+    realigned trials and the lags re-estimated, iterations times. The lags are
+    centred on their median, so the condition's timing stays on the marker,
+    and then clipped to max_lag.
+
+    Args:
+        matrix (np.ndarray): (n_trials, m) trials on a common grid (see trial_matrix).
+        dx (float): Grid spacing in seconds.
+        max_lag (float): Largest shift in seconds.
+        iterations (int): Template refinements.
+
+    Returns:
+        tuple: (realigned matrix, (n_trials,) lags in seconds).
+    """
+    max_lag = int(round(max_lag / dx)) if dx > 0 else 0
+    lags = np.zeros(len(matrix), dtype=np.int64)
+    for _ in range(max(iterations, 1)):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            template = np.nanmean(shift_rows(matrix, lags), axis=0)
+        lags = xcorr_lags(matrix, template, max_lag)
+        if len(lags):
+            lags = np.clip(lags - int(np.median(lags)), -max_lag, max_lag)
+    return shift_rows(matrix, lags), lags * dx
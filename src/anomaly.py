@@ -0,0 +1,198 @@
+import warnings
+
+import numpy as np
+from scipy import stats
+
+from .alignment import align_trials, time_grid
+from .config import ANOMALY_COMPONENTS, ANOMALY_ALPHA
+from .windows import WINDOW
+
+# Traces of a run_stat_analysis output the trials are compared on, with their
+# position in it
+ANOMALY_MEASURES = {"body_angle": 2, "forward_velocity": 1}
+
+
+def condition_matrix(result, key, grid, measures=tuple(ANOMALY_MEASURES)):
+    """Aligned (n_trials, len(measures) * len(grid)) matrix of one condition's
+    trials, the measures side by side, NaN where a trial has no data."""
+    times = [record["time"] for record in result[4].get("trials", {}).get(key, [])]
+    blocks = [align_trials(result[ANOMALY_MEASURES[measure]][key], times, grid)[1] for measure in measures]
+    return np.hstack(blocks) if blocks else np.empty((0, 0))
+
+
+def _features(model, matrix):
+    # Standardised features with the samples outside a trial imputed by the mean
+    z = (np.asarray(matrix, dtype=np.float64) - model["mean"]) / model["scale"]
+    return np.nan_to_num(z)
+
+
+def _scores(model, z):
+    # Hotelling T^2 in component space and squared reconstruction error (Q)
+    components, variance = model["components"], model["variance"]
+    projected = z @ components.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t2 = np.sum(np.where(variance > 0, projected ** 2 / variance, 0), axis=1)
+    q = np.sum((z - projected @ components) ** 2, axis=1)
+    return t2, q
+
+
+def update_model(model, matrix, n_components=ANOMALY_COMPONENTS, grid=None):
+    """Fits (model None) or updates a condition's PCA model with new trials.
+
+    The update is an incremental SVD: the current components scaled by their
+    singular values, the new centred trials and a mean-shift row are
+    decomposed together, so earlier trials are never revisited.
+
+    Args:
+        model (dict): Model from a previous call, or None.
+        matrix (np.ndarray): (n_trials, features) aligned trials (condition_matrix).
+        n_components (int): Components kept (at most the trial count).
+        grid (np.ndarray): Time grid of the features, stored with a new model.
+
+    Returns:
+        dict: The model: grid, feature mean and scale (raw units), components,
+        singular values, component variances, trial count and the moments of
+        the training Q scores used for its rejection limit.
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    if model is None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            mean = np.nan_to_num(np.nanmean(matrix, axis=0))
+            scale = np.nanstd(matrix, axis=0)
+        model = {
+            "grid": grid,
+            "mean": mean,
+            "scale": np.where(scale > 0, scale, 1.0),
+            "components": np.empty((0, matrix.shape[1])),
+            "singular": np.empty(0),
+            "n": 0,
+            "q_sum": 0.0,
+            "q_sq": 0.0,
+        }
+    if len(matrix) == 0:
+        return model
+
+    # Everything is centred on the first fit's mean, the running mean of the
+    # standardised features is tracked as "shift"
+    z = _features(model, matrix)
+    n_old, n_new = model["n"], len(z)
+    n = n_old + n_new
+    old_shift = model.get("shift", np.zeros(z.shape[1]))
+    batch_mean = z.mean(axis=0)
+    shift = (n_old * old_shift + n_new * batch_mean) / n
+
+    stack = [model["singular"][:, None] * model["components"], z - batch_mean]
+    if n_old:
+        stack.append(np.sqrt(n_old * n_new / n) * (old_shift - batch_mean)[None, :])
+    _, singular, vt = np.linalg.svd(np.vstack(stack), full_matrices=False)
+    k = min(n_components, n - 1, len(singular))
+
+    model = {**model, "components": vt[:k], "singular": singular[:k], "n": n, "shift": shift}
+    model["variance"] = singular[:k] ** 2 / max(n - 1, 1)
+
+    _, q = _scores(model, z - shift)
+    model["q_sum"] += float(q.sum())
+    model["q_sq"] += float((q ** 2).sum())
+    return model
+
+
+def score_trials(model, matrix, alpha=ANOMALY_ALPHA):
+    """Scores trials against a condition's model.
+
+    Returns:
+        dict: (n_trials,) arrays "t2" (Mahalanobis distance squared in
+        component space), "q" (squared reconstruction error) and "reject",
+        True where either exceeds its 1 - alpha limit: chi-square for T^2 and
+        Box's scaled chi-square, from the moments of the training Q, for Q.
+        Models fitted on too few trials reject nothing.
+    """
+    k = len(model["singular"])
+    t2, q = _scores(model, _features(model, matrix) - model.get("shift", 0))
+    reject = np.zeros(len(t2), dtype=bool)
+    if k and model["n"] > k + 1:
+        q_mean = model["q_sum"] / model["n"]
+        q_var = model["q_sq"] / model["n"] - q_mean ** 2
+        t2_limit = stats.chi2.ppf(1 - alpha, k)
+        if q_mean > 0 and q_var > 0:
+            q_limit = q_var / (2 * q_mean) * stats.chi2.ppf(1 - alpha, 2 * q_mean ** 2 / q_var)
+        else:
+            q_limit = np.inf
+        reject = (t2 > t2_limit) | (q > q_limit)
+    return {"t2": t2, "q": q, "reject": reject}
+
+
+def flag_anomalies(result, models=None, n_components=ANOMALY_COMPONENTS, alpha=ANOMALY_ALPHA, window=WINDOW):
+    """Scores every accepted trial of a run_stat_analysis output against the
+    PCA model of its condition.
+
+    Without models one model per condition is fitted on the result's trials.
+    With the models of earlier files (e.g. as new files arrive) they are
+    updated with the new trials first, on their own time grid. The scores
+    are added to the trial records as "anomaly_t2", "anomaly_q" and
+    "anomaly_reject", and the number of rejected trials as
+    summary["anomaly_reject_no"], next to the fail counts.
+
+    Returns:
+        dict: {(side, freq): model}, to pass to the next call.
+    """
+    models = dict(models or {})
+    summary = result[4]
+    n_rejected = 0
+    for key, records in summary.get("trials", {}).items():
+        if not records:
+            continue
+        model = models.get(key)
+        grid = model["grid"] if model is not None else time_grid(max(record["fps"] for record in records), window)
+        matrix = condition_matrix(result, key, grid)
+        models[key] = update_model(model, matrix, n_components, grid)
+
+        scores = score_trials(models[key], matrix, alpha)
+        for record, t2, q, reject in zip(records, scores["t2"], scores["q"], scores["reject"]):
+            record["anomaly_t2"] = float(t2)
+            record["anomaly_q"] = float(q)
+            record["anomaly_reject"] = bool(reject)
+        n_rejected += int(scores["reject"].sum())
+
+    summary["anomaly_reject_no"] = n_rejected
+    return models
+
+
+def drop_anomalies(result):
+    """run_stat_analysis output without the trials flag_anomalies rejected.
+
+    Rejected trials are removed from the trace lists and trial records and no
+    longer count as successes, like the trials rejected as "outlier" (they
+    count neither as successes nor as failures).
+    """
+    traces = [dict(dct) for dct in result[:4]]
+    summary = {**result[4], "trials": dict(result[4].get("trials", {}))}
+    success_freq = {
+        stimulation: {freq: list(outcomes) for freq, outcomes in summary[f"{stimulation}_success_freq"].items()}
+        for stimulation in ("turning", "elytra")
+    }
+
+    for key, records in summary["trials"].items():
+        keep = [not record.get("anomaly_reject", False) for record in records]
+        if all(keep):
+            continue
+        for dct in traces:
+            dct[key] = [trace for trace, kept in zip(dct[key], keep) if kept]
+        summary["trials"][key] = [record for record, kept in zip(records, keep) if kept]
+
+        # Only the sides run_stat_analysis counts as successes
+        if key[0] == "Both":
+            stimulation = "elytra"
+        elif key[0] in ("Right", "Left"):
+            stimulation = "turning"
+        else:
+            continue
+        n_rejected = keep.count(False)
+        summary[f"{stimulation}_succ_no"] -= n_rejected
+        outcomes = success_freq[stimulation][key[1]]
+        for _ in range(n_rejected):
+            outcomes.remove(1)
+
+    for stimulation, freqs in success_freq.items():
+        summary[f"{stimulation}_success_freq"] = freqs
+    return (*traces, summary)
@@ -0,0 +1,225 @@
+import os
+import sqlite3
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .cohorts import _natural_key
+from .config import DATA_RAW, CATALOG_DB
+from .io_utils import file_read
+from .onsets import detect_onsets
+
+# Bumped when the schema or the scanned values change, older catalogs are rebuilt
+CATALOG_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    cohort TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    fps REAL,
+    n_frames INTEGER,
+    duration REAL,
+    nan_fraction REAL
+);
+CREATE TABLE IF NOT EXISTS stims (
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    side TEXT NOT NULL,
+    freq INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    duration REAL,
+    PRIMARY KEY (path, side, freq)
+);
+CREATE INDEX IF NOT EXISTS files_cohort ON files(cohort);
+CREATE INDEX IF NOT EXISTS files_fps ON files(fps);
+CREATE INDEX IF NOT EXISTS files_nan_fraction ON files(nan_fraction);
+CREATE INDEX IF NOT EXISTS stims_side_freq ON stims(side, freq);
+"""
+
+
+def connect(db=CATALOG_DB):
+    """Opens (and creates if needed) the catalog database."""
+    db = Path(db)
+    db.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(db)
+    con.execute("PRAGMA foreign_keys = ON")
+    if con.execute("PRAGMA user_version").fetchone()[0] != CATALOG_VERSION:
+        con.executescript("DROP TABLE IF EXISTS stims; DROP TABLE IF EXISTS files;")
+        con.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+    con.executescript(SCHEMA)
+    return con
+
+
+def scan_file(file):
+    """Metadata of one recording: fps, frame count, duration, fraction of frames
+    with a dropped pose point and the number of stimulations (onsets.detect_onsets)
+    and their mean measured duration per (side, freq).
+
+    Returns:
+        tuple: (files row dict, [(side, freq, n, duration)])
+    """
+    pose, stim_deets, stim_occur, fps, time = file_read(file, return_time=True)
+    stat = os.stat(file)
+    row = {
+        "path": str(file),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "fps": fps,
+        "n_frames": len(pose),
+        "duration": float(time[-1] - time[0]) if len(time) else 0.0,
+        "nan_fraction": float(np.isnan(pose).any(axis=1).mean()) if len(pose) else 1.0,
+    }
+    onsets = detect_onsets(stim_occur, stim_deets, fps, time)
+    counts = Counter(zip(onsets["side"], onsets["freq"]))
+    durations = Counter()
+    for side, freq, duration in zip(onsets["side"], onsets["freq"], onsets["duration"]):
+        durations[(side, freq)] += float(duration)
+    return row, [(side, int(freq), n, durations[(side, freq)] / n) for (side, freq), n in sorted(counts.items())]
+
+
+def _raw_files(root):
+    # {csv file: cohort}, the cohort being the first directory below root
+    root = Path(root)
+    return {str(path): path.relative_to(root).parts[0] if len(path.relative_to(root).parts) > 1 else ""
+            for path in sorted(root.rglob("*.csv"))}
+
+
+def build_catalog(root=DATA_RAW, db=CATALOG_DB, cohorts=None, max_workers=None):
+    """Scans every csv file below root (or of the given cohorts) in parallel and
+    stores their metadata in the SQLite catalog.
+
+    Files whose size and modification time did not change since the last scan
+    are skipped, files that no longer exist are removed.
+
+    Args:
+        root (Path): Directory scanned recursively, the first sub-directory of
+            each file is its cohort.
+        db (Path): Catalog database (defaults to config.CATALOG_DB).
+        cohorts (dict): {cohort_id: [csv files]} to catalog instead of root,
+            e.g. from cohorts.discover_cohorts.
+        max_workers (int): Number of worker processes (defaults to the cpu count).
+
+    Returns:
+        int: Number of files (re)scanned.
+    """
+    if cohorts is None:
+        files = _raw_files(root)
+    else:
+        files = {str(file): cohort_id for cohort_id, cohort_files in cohorts.items() for file in cohort_files}
+
+    con = connect(db)
+    try:
+        known = {path: (size, mtime) for path, size, mtime in con.execute("SELECT path, size, mtime FROM files")}
+        stale = []
+        for file in files:
+            stat = os.stat(file)
+            if known.get(file) != (stat.st_size, stat.st_mtime):
+                stale.append(file)
+        # Largest files first keeps the pool balanced
+        stale.sort(key=os.path.getsize, reverse=True)
+
+        scanned = []
+        if stale:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                scanned = list(pool.map(scan_file, stale))
+
+        with con:
+            if cohorts is None:
+                gone = [(path,) for path in known if path not in files]
+                con.executemany("DELETE FROM files WHERE path = ?", gone)
+            for row, stims in scanned:
+                row["cohort"] = files[row["path"]]
+                con.execute("DELETE FROM files WHERE path = ?", (row["path"],))
+                con.execute("INSERT INTO files (path, cohort, size, mtime, fps, n_frames, duration, nan_fraction) "
+                            "VALUES (:path, :cohort, :size, :mtime, :fps, :n_frames, :duration, :nan_fraction)",
+                            row)
+                con.executemany("INSERT INTO stims (path, side, freq, n, duration) VALUES (?, ?, ?, ?, ?)",
+                                [(row["path"], *stim) for stim in stims])
+    finally:
+        con.close()
+    return len(scanned)
+
+
+def _where(cohort=None, side=None, freq=None, min_fps=None, max_nan_fraction=None, min_stims=1):
+    # SQL conditions and parameters shared by the query helpers
+    conditions, params = [], []
+    if cohort is not None:
+        conditions.append("f.cohort GLOB ?")
+        params.append(cohort)
+    if min_fps is not None:
+        conditions.append("f.fps >= ?")
+        params.append(min_fps)
+    if max_nan_fraction is not None:
+        conditions.append("f.nan_fraction <= ?")
+        params.append(max_nan_fraction)
+    if side is not None or freq is not None:
+        stim = ["s.path = f.path"]
+        if side is not None:
+            stim.append("s.side = ?")
+            params.append(side)
+        if freq is not None:
+            stim.append("s.freq = ?")
+            params.append(freq)
+        conditions.append(f"(SELECT COALESCE(SUM(s.n), 0) FROM stims s WHERE {' AND '.join(stim)}) >= ?")
+        params.append(min_stims)
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def select_files(cohort=None, side=None, freq=None, min_fps=None, max_nan_fraction=None, min_stims=1,
+                 db=CATALOG_DB):
+    """Files of the catalog matching every given condition, in path order.
+
+    Args:
+        cohort (str): Cohort id or glob pattern (e.g. "C*").
+        side (str): Only files with at least min_stims stimulations of this side...
+        freq (int): ...and / or of this frequency.
+        min_fps (float): Lowest accepted frame rate.
+        max_nan_fraction (float): Highest accepted fraction of frames with dropped pose points.
+
+    Returns:
+        list: csv file paths, to pass to run_stat_analysis.
+    """
+    where, params = _where(cohort, side, freq, min_fps, max_nan_fraction, min_stims)
+    con = connect(db)
+    try:
+        return [path for path, in con.execute(f"SELECT f.path FROM files f{where} ORDER BY f.path", params)]
+    finally:
+        con.close()
+
+
+def select_cohorts(cohort="*", db=CATALOG_DB, **conditions):
+    """{cohort_id: [csv files]} of the catalog, in the format of
+    cohorts.discover_cohorts, with the conditions of select_files."""
+    where, params = _where(cohort, **conditions)
+    con = connect(db)
+    try:
+        rows = con.execute(f"SELECT f.cohort, f.path FROM files f{where} ORDER BY f.cohort, f.path", params)
+        selected = {}
+        for cohort_id, path in rows:
+            selected.setdefault(cohort_id, []).append(path)
+    finally:
+        con.close()
+    return dict(sorted(selected.items(), key=lambda item: _natural_key(item[0])))
+
+
+def query(sql, params=(), db=CATALOG_DB):
+    """Runs any SQL query against the catalog (tables files and stims) and
+    returns the result as a DataFrame."""
+    con = connect(db)
+    try:
+        return pd.read_sql_query(sql, con, params=params)
+    finally:
+        con.close()
+
+
+def stim_table(db=CATALOG_DB):
+    """Number of stimulations per cohort, side and frequency, with their mean
+    measured duration (seconds)."""
+    return query("SELECT f.cohort, s.side, s.freq, SUM(s.n) AS n, COUNT(*) AS n_files, "
+                 "SUM(s.n * s.duration) / SUM(s.n) AS duration "
+                 "FROM stims s JOIN files f ON f.path = s.path "
+                 "GROUP BY f.cohort, s.side, s.freq ORDER BY f.cohort, s.side, s.freq", db=db)
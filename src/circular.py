@@ -0,0 +1,128 @@
+import numpy as np
+
+from .alignment import batch_interp, trial_times
+from .windows import WINDOW
+
+
+def histogram_edges(bins=36):
+    """Edges (degrees) of bins equal angular bins over [-180, 180)."""
+    return np.linspace(-180, 180, bins + 1)
+
+
+def rayleigh_test(R, n):
+    """Rayleigh test of uniformity for mean resultant lengths R of n angles.
+
+    Returns:
+        tuple: (z, p) with z = n R^2 and p the approximation of Zar (1999),
+        NaN where n is 0.
+    """
+    R, n = np.asarray(R, dtype=np.float64), np.asarray(n, dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = n * R ** 2
+        p = np.exp(np.sqrt(1 + 4 * n + 4 * (n ** 2 - (R * n) ** 2)) - (1 + 2 * n))
+    p = np.where(n > 0, np.clip(p, 0, 1), np.nan)
+    return np.where(n > 0, z, np.nan), p
+
+
+def circ_stats(angles, axis=-1):
+    """Circular mean (degrees, in [-180, 180)), mean resultant length R, number of
+    angles and Rayleigh z / p along an axis of an array of angles in degrees,
+    ignoring NaN.
+
+    Returns:
+        dict: {"mean", "R", "n", "z", "p"}, each with the axis reduced.
+    """
+    theta = np.radians(np.asarray(angles, dtype=np.float64))
+    valid = ~np.isnan(theta)
+    n = valid.sum(axis=axis)
+    C = np.where(valid, np.cos(theta), 0).sum(axis=axis)
+    S = np.where(valid, np.sin(theta), 0).sum(axis=axis)
+    return _stats(C, S, n)
+
+
+def _stats(C, S, n):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        R = np.where(n > 0, np.hypot(C, S) / n, np.nan)
+        mean = np.where(n > 0, _wrap(np.degrees(np.arctan2(S, C))), np.nan)
+    z, p = rayleigh_test(R, n)
+    return {"mean": mean, "R": R, "n": n, "z": z, "p": p}
+
+
+def _wrap(degrees):
+    # Angles wrapped to [-180, 180)
+    return (np.asarray(degrees) + 180) % 360 - 180
+
+
+def trial_headings(body_angles, times=None, at=None, window=WINDOW):
+    """Heading (degrees relative to the pre-stimulation heading) of every trial.
+
+    Args:
+        body_angles (dict): {(side, freq): [body angle traces]} (run_stat_analysis).
+        times (dict): Window timestamps per key (alignment.trial_times).
+        at (float): Seconds after the stimulation onset the heading is read at,
+            defaults to the end of each trial. Without timestamps the trials are
+            assumed to span window.
+
+    Returns:
+        dict: {(side, freq): (n_trials,) array of headings}
+    """
+    headings = {}
+    for key, traces in body_angles.items():
+        if len(traces) == 0:
+            headings[key] = np.empty(0)
+        elif at is None:
+            headings[key] = np.array([trace[-1] for trace in traces], dtype=np.float64)
+        elif times is not None and key in times:
+            key_times = [np.asarray(t)[len(t) - len(trace):] for trace, t in zip(traces, times[key])]
+            headings[key] = batch_interp(np.array([at]), key_times, traces)[:, 0]
+        else:
+            frac = (at + window.pre) / window.duration
+            headings[key] = np.array([trace[int(round(frac * (len(trace) - 1)))] for trace in traces],
+                                     dtype=np.float64)
+    return headings
+
+
+def circular_summary(cohort_results, bins=36, at=None):
+    """Circular statistics and angular histograms of the trial headings of every
+    (side, freq, cohort), all groups computed together in one pass.
+
+    Args:
+        cohort_results (dict): {cohort_id: run_stat_analysis output}, e.g. from
+            cohorts.run_batch.
+        bins (int): Number of histogram bins over [-180, 180).
+        at (float): Time the headings are read at, see trial_headings.
+
+    Returns:
+        dict: {(side, freq, cohort): {"mean", "R", "n", "z", "p", "counts",
+        "edges"}}, counts being the histogram over edges (histogram_edges).
+    """
+    groups, angles, group_ids = [], [], []
+    for cohort_id, result in cohort_results.items():
+        times = trial_times(result[4]) or None
+        for (side, freq), headings in trial_headings(result[2], times, at).items():
+            group_ids.append(np.full(len(headings), len(groups)))
+            groups.append((side, freq, cohort_id))
+            angles.append(headings)
+    if not groups:
+        return {}
+
+    theta = np.concatenate(angles)
+    group = np.concatenate(group_ids)
+    keep = ~np.isnan(theta)
+    theta, group = theta[keep], group[keep]
+    n_groups = len(groups)
+
+    rad = np.radians(theta)
+    C = np.bincount(group, np.cos(rad), minlength=n_groups)
+    S = np.bincount(group, np.sin(rad), minlength=n_groups)
+    n = np.bincount(group, minlength=n_groups)
+    stats = _stats(C, S, n)
+
+    edges = histogram_edges(bins)
+    bin_idx = np.minimum(((_wrap(theta) + 180) / 360 * bins).astype(np.int64), bins - 1)
+    counts = np.bincount(group * bins + bin_idx, minlength=n_groups * bins).reshape(n_groups, bins)
+
+    return {
+        key: {**{name: values[i].item() for name, values in stats.items()}, "counts": counts[i], "edges": edges}
+        for i, key in enumerate(groups)
+    }
@@ -0,0 +1,79 @@
+import json
+import os
+import re
+from pathlib import Path
+
+from .config import DATA_RAW, COHORT_PATTERN, COHORT_MANIFEST
+from .pipeline import run_pipeline
+from .stats_pipeline import load_files, merge_results
+
+
+def _natural_key(name):
+    # Sort C3 before C10
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+
+def read_manifest(manifest):
+    """Reads a cohort manifest: a json object mapping each cohort id to either a
+    directory of csv files or a list of csv files, relative to the manifest."""
+    manifest = Path(manifest)
+    with open(manifest) as f:
+        entries = json.load(f)
+
+    cohorts = {}
+    for cohort_id, entry in entries.items():
+        if isinstance(entry, str):
+            cohorts[cohort_id] = load_files(manifest.parent / entry)
+        else:
+            cohorts[cohort_id] = [str(manifest.parent / fn) for fn in entry]
+    return cohorts
+
+
+def discover_cohorts(root=DATA_RAW, pattern=COHORT_PATTERN, manifest=None):
+    """Returns {cohort_id: [csv files]} for every cohort (individual animal).
+
+    If a manifest is given (or config.COHORT_MANIFEST exists) the cohorts are
+    read from it, otherwise every sub-directory of root matching pattern that
+    contains csv files is a cohort named after the directory."""
+    if manifest is None and root == DATA_RAW and COHORT_MANIFEST.exists():
+        manifest = COHORT_MANIFEST
+    if manifest is not None:
+        return read_manifest(manifest)
+
+    cohorts = {}
+    for directory in sorted(Path(root).glob(pattern), key=lambda p: _natural_key(p.name)):
+        if directory.is_dir():
+            files = sorted(load_files(directory))
+            if files:
+                cohorts[directory.name] = files
+    return cohorts
+
+
+def run_batch(cohorts, max_workers=None, dtype=None):
+    """Analyses every file of every cohort in one shared process pool, fed by
+    reader threads that prefetch the files (see pipeline.run_pipeline).
+
+    Files are submitted largest first, so the pool stays balanced and the total
+    runtime approaches that of the largest file rather than the sum of all
+    cohorts. A file listed in several cohorts is analysed once, and counted
+    once in the pooled output.
+
+    Args:
+        cohorts (dict): {cohort_id: [csv files]}, e.g. from discover_cohorts.
+        max_workers (int): Number of worker processes (defaults to the cpu count).
+        dtype: Float dtype of the trial arrays (defaults to config.FLOAT_DTYPE).
+
+    Returns:
+        tuple: ({cohort_id: run_stat_analysis output}, pooled run_stat_analysis output)
+    """
+    files = sorted({file for files in cohorts.values() for file in files}, key=os.path.getsize, reverse=True)
+    per_file = dict(run_pipeline(files, max_workers=max_workers, dtype=dtype))
+
+    # Merge back in file order so the results do not depend on scheduling
+    results = {
+        cohort_id: merge_results(per_file[file] for file in cohort_files)
+        for cohort_id, cohort_files in cohorts.items()
+    }
+    # Pooled over the unique files, so a file shared by cohorts counts once
+    pooled = merge_results(per_file[file] for file in sorted(per_file))
+    return results, pooled
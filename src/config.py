@@ -6,16 +6,70 @@ DATA_PROCESSED = PROJECT_ROOT / "data" / "processed"
 
 VERTICAL_DATA_DIR = DATA_RAW / "AllAcrylic"
 
-C0_DIRECTORY = DATA_RAW / "C0"
+# Individual animals (cohorts) are discovered as the sub-directories of DATA_RAW
+# matching COHORT_PATTERN, unless a manifest file lists them explicitly as
+# {"cohort_id": "directory" or ["file.csv", ...]} (paths relative to the manifest).
+COHORT_PATTERN = "C*"
+COHORT_MANIFEST = DATA_RAW / "cohorts.json"
 
-C3_DIRECTORY = DATA_RAW / "C3"
+# SQLite catalog of the recordings under DATA_RAW (see catalog.build_catalog)
+CATALOG_DB = DATA_PROCESSED / "catalog.sqlite"
 
-C4_DIRECTORY = DATA_RAW / "C4"
+# Ingestion pipeline (see pipeline.run_pipeline): threads reading files ahead of
+# the process workers, and the number of files they may hold in memory
+IO_THREADS = 4
+PREFETCH_DEPTH = 8
 
-C9_DIRECTORY = DATA_RAW / "C9"
 
-C10_DIRECTORY = DATA_RAW / "C10"
+# Number of Frequencies 
+FREQUENCIES = [10, 20, 30, 40, 50]
 
+# Extraction window around each stimulation (seconds before and after onset) and
+# the duration of the stimulation within it, see windows.WindowSpec
+STIM_PRE_S = 0.15
+STIM_POST_S = 1.25
+STIM_S = 0.5
 
-# Number of Frequencies 
-FREQUENCIES = [10, 20, 30, 40, 50]
\ No newline at end of file
+# Decimals the measured frame rate of a recording (1 / mean frame interval) is
+# rounded to, giving its nominal rate: recordings at the same nominal rate share
+# their spectral batch and cached filter and window designs
+FPS_DECIMALS = 0
+
+# Onset detection (see onsets.detect_onsets): marked frames of one condition
+# less than STIM_DEBOUNCE_S apart are one stimulation, and onsets less than
+# STIM_REFRACTORY_S after the previous one are re-triggers of it
+STIM_DEBOUNCE_S = 0.05
+STIM_REFRACTORY_S = 0.5
+
+# Response latency (see latency.response_timing): first crossing of this many
+# standard deviations of the pre-stimulation baseline after the onset
+LATENCY_THRESHOLD_SD = 3.0
+
+# Largest shift (seconds) of a trial against its condition's template when the
+# time plots realign trials for marker / camera jitter (see alignment.realign_trials)
+REALIGN_MAX_LAG_S = 0.1
+
+# Trial anomaly detection (see anomaly.flag_anomalies): principal components of
+# each condition's aligned trials and the false rejection rate of its limits
+ANOMALY_COMPONENTS = 5
+ANOMALY_ALPHA = 0.01
+
+# Spectral analysis (see spectral.stim_power): Welch segment length (seconds,
+# 0.2 s gives 5 Hz bins, on the stimulation frequencies) and the number of
+# multiples of the stimulation frequency reported
+WELCH_SEGMENT_S = 0.2
+SPECTRAL_HARMONICS = 3
+
+# Floating point precision for trial arrays carried through the pipeline
+# ("float64" or "float32" - float32 halves the memory of every trace).
+FLOAT_DTYPE = "float64"
+
+# Smoothing filter of each pipeline stage (see filters.apply_filter). "ewma" is
+# the exponential moving average, "filtfilt" a zero-phase Butterworth low-pass
+# ("cutoff" in Hz, "order"), "savgol" and "median" take a "window" in seconds.
+# The phase lag of "ewma" delays the response, prefer the others for latencies.
+FILTERS = {
+    "position": {"method": "ewma", "alpha": 0.2},
+    "angle": {"method": "ewma", "alpha": 0.2},
+    "velocity": {"method": "ewma", "alpha": 0.25},
+}
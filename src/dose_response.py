@@ -0,0 +1,230 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import optimize, stats
+
+from .config import FREQUENCIES
+
+PEAK_MEASURES = ("angles_max", "fwd_max")
+# Fewer groups are fitted in process, a pool costs more to start than they take
+MIN_PARALLEL_GROUPS = 64
+
+
+def _linear(f, intercept, slope):
+    return intercept + slope * f
+
+
+def _hill(f, top, ec50, hill):
+    # Saturating response through the origin (no stimulation, no response)
+    fh = np.power(f, hill)
+    return top * fh / (np.power(ec50, hill) + fh)
+
+
+def _logistic(f, bottom, top, f50, width):
+    return bottom + (top - bottom) / (1 + np.exp(-(f - f50) / width))
+
+
+# Model function and parameter names of every dose-response model
+MODELS = {
+    "linear": (_linear, ("intercept", "slope")),
+    "hill": (_hill, ("top", "ec50", "hill")),
+    "logistic": (_logistic, ("bottom", "top", "f50", "width")),
+}
+
+
+def group_table(results, measures=PEAK_MEASURES, frequencies=FREQUENCIES, sides=None, magnitude=False):
+    """Per-frequency sufficient statistics of every (roach, side, measure) group.
+
+    Args:
+        results (dict): {roach_id: {measure: {(side, freq): [peak values]}}}, as
+            built from get_max_values for the cross-roach plots.
+        magnitude (bool): Use the absolute values (e.g. to describe the means
+            of |peak| the cross-roach plots draw).
+
+    Returns:
+        tuple: (groups, freqs, n, s1, s2): the (roach, side, measure) of each row,
+        the (F,) frequencies and (G, F) count, sum and sum of squares of the
+        finite values of each group at each frequency.
+    """
+    freqs = np.asarray(frequencies, dtype=np.float64)
+    col = {freq: i for i, freq in enumerate(frequencies)}
+    groups, rows, cols, values = [], [], [], []
+    for roach_id, measures_dict in results.items():
+        for measure in measures:
+            by_side = {}
+            for (side, freq), vals in measures_dict.get(measure, {}).items():
+                if freq in col and (sides is None or side in sides):
+                    by_side.setdefault(side, []).append((freq, vals))
+            for side, entries in sorted(by_side.items()):
+                g = len(groups)
+                groups.append((roach_id, side, measure))
+                for freq, vals in entries:
+                    vals = np.asarray(vals, dtype=np.float64)
+                    vals = vals[np.isfinite(vals)]
+                    if magnitude:
+                        vals = np.abs(vals)
+                    rows.append(np.full(len(vals), g))
+                    cols.append(np.full(len(vals), col[freq]))
+                    values.append(vals)
+
+    shape = (len(groups), len(freqs))
+    if not groups:
+        return groups, freqs, np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    flat = np.concatenate(rows).astype(np.int64) * len(freqs) + np.concatenate(cols).astype(np.int64)
+    y = np.concatenate(values)
+    size = shape[0] * shape[1]
+    n = np.bincount(flat, minlength=size).reshape(shape).astype(np.float64)
+    s1 = np.bincount(flat, y, minlength=size).reshape(shape)
+    s2 = np.bincount(flat, y ** 2, minlength=size).reshape(shape)
+    return groups, freqs, n, s1, s2
+
+
+def fit_linear(freqs, n, s1, s2, alpha=0.05):
+    """Least squares lines y = intercept + slope * freq of all groups at once.
+
+    All groups share the (F, 2) design matrix of the frequencies, weighted by
+    their counts, so the trial-level fits reduce to one batched 2x2 solve.
+
+    Returns:
+        dict: (G, 2) "params", "se", "ci_low", "ci_high" and (G,) "n", "r2".
+    """
+    X = np.column_stack((np.ones_like(freqs), freqs))
+    xtwx = np.einsum("gf,fi,fj->gij", n, X, X)
+    xtwy = s1 @ X
+    N = n.sum(axis=1)
+
+    # Groups with fewer than two frequencies have no line
+    ok = (np.count_nonzero(n, axis=1) >= 2) & (N > 2)
+    xtwx[~ok] = np.eye(2)
+    inv = np.linalg.inv(xtwx)
+    params = np.einsum("gij,gj->gi", inv, xtwy)
+
+    fitted = params @ X.T
+    ss_res = (s2 - 2 * fitted * s1 + n * fitted ** 2).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dof = N - 2
+        sigma2 = np.maximum(ss_res, 0) / dof
+        se = np.sqrt(sigma2[:, None] * np.diagonal(inv, axis1=1, axis2=2))
+        ss_tot = s2.sum(axis=1) - s1.sum(axis=1) ** 2 / N
+        r2 = np.where(ss_tot > 0, 1 - ss_res / ss_tot, np.nan)
+        t_crit = stats.t.ppf(1 - alpha / 2, np.where(ok, dof, 1))[:, None]
+
+    params[~ok], se[~ok], r2[~ok] = np.nan, np.nan, np.nan
+    return {"params": params, "se": se, "ci_low": params - t_crit * se, "ci_high": params + t_crit * se,
+            "n": N, "r2": r2}
+
+
+def _initial_guess(model, f, y):
+    # Starting values and bounds of the nonlinear models
+    top = y[np.argmax(np.abs(y))]
+    f_mid = np.median(f)
+    if model == "hill":
+        return [top, f_mid, 2.0], ([-np.inf, 1e-3, 0.1], [np.inf, 10 * f.max(), 10.0])
+    width = max((f.max() - f.min()) / 4, 1e-3)
+    return [y[0], y[-1], f_mid, width], ([-np.inf, -np.inf, f.min() - np.ptp(f), 1e-3],
+                                         [np.inf, np.inf, f.max() + np.ptp(f), 10 * np.ptp(f) + 1])
+
+
+def _fit_group(job):
+    # Weighted fit of one group on its per-frequency means, with the covariance
+    # scaled by the trial-level residual variance
+    model, freqs, n, s1, s2, alpha = job
+    func, names = MODELS[model]
+    n_params = len(names)
+    nan = np.full(n_params, np.nan)
+    used = n > 0
+    N = n.sum()
+    if used.sum() < n_params or N <= n_params:
+        return nan, nan, nan, nan, np.nan
+
+    f, w = freqs[used], n[used]
+    mean = s1[used] / w
+    p0, bounds = _initial_guess(model, f, mean)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            params, pcov = optimize.curve_fit(func, f, mean, p0=p0, sigma=1 / np.sqrt(w), absolute_sigma=True,
+                                              bounds=bounds, maxfev=10000)
+    except (RuntimeError, ValueError):
+        return nan, nan, nan, nan, np.nan
+
+    fitted = func(f, *params)
+    ss_res = (s2[used] - 2 * fitted * s1[used] + w * fitted ** 2).sum()
+    ss_tot = s2.sum() - s1.sum() ** 2 / N
+    se = np.sqrt(np.diag(pcov) * max(ss_res, 0) / (N - n_params))
+    t_crit = stats.t.ppf(1 - alpha / 2, N - n_params)
+    r2 = 1 - ss_res / ss_tot if ss_tot > 0 else np.nan
+    return params, se, params - t_crit * se, params + t_crit * se, r2
+
+
+def fit_nonlinear(model, freqs, n, s1, s2, alpha=0.05, max_workers=None):
+    """Fits a saturating model ("hill" or "logistic") to every group, the groups
+    spread over a process pool (max_workers=1, or fewer than
+    MIN_PARALLEL_GROUPS groups, fits them in this process).
+
+    Returns:
+        dict: as fit_linear, with one column per model parameter.
+    """
+    jobs = [(model, freqs, n[g], s1[g], s2[g], alpha) for g in range(len(n))]
+    if max_workers == 1 or len(jobs) < MIN_PARALLEL_GROUPS:
+        fits = list(map(_fit_group, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            fits = list(pool.map(_fit_group, jobs, chunksize=max(len(jobs) // 32, 1)))
+
+    n_params = len(MODELS[model][1])
+    columns = list(zip(*fits)) if fits else [[]] * 5
+    out = {name: np.array(values).reshape(len(fits), n_params)
+           for name, values in zip(("params", "se", "ci_low", "ci_high"), columns[:4])}
+    out["r2"] = np.array(columns[4], dtype=np.float64)
+    out["n"] = n.sum(axis=1)
+    return out
+
+
+def fit_dose_response(results, measures=PEAK_MEASURES, models=("linear", "hill"), frequencies=FREQUENCIES,
+                      alpha=0.05, max_workers=None, magnitude=False):
+    """Dose-response fits of the peak metrics of every (roach, side, measure).
+
+    Args:
+        results (dict): {roach_id: {measure: {(side, freq): [peak values]}}}
+            (e.g. the per-roach results of scripts/indivdual_roach.py, plus the
+            pooled data under its own id).
+        models (tuple): Any of MODELS.
+        alpha (float): 1 - confidence level of the intervals.
+        magnitude (bool): Fit the absolute peak values (see group_table).
+
+    Returns:
+        pd.DataFrame: One row per group, model and parameter with its estimate,
+        standard error, confidence interval, number of trials and the fit's R^2.
+    """
+    groups, freqs, n, s1, s2 = group_table(results, measures, frequencies, magnitude=magnitude)
+    rows = []
+    for model in models:
+        if model == "linear":
+            fit = fit_linear(freqs, n, s1, s2, alpha)
+        else:
+            fit = fit_nonlinear(model, freqs, n, s1, s2, alpha, max_workers)
+        for g, (roach_id, side, measure) in enumerate(groups):
+            for p, param in enumerate(MODELS[model][1]):
+                rows.append({
+                    "roach": roach_id, "side": side, "measure": measure, "model": model, "param": param,
+                    "estimate": fit["params"][g, p], "se": fit["se"][g, p],
+                    "ci_low": fit["ci_low"][g, p], "ci_high": fit["ci_high"][g, p],
+                    "n": int(fit["n"][g]), "r2": fit["r2"][g],
+                })
+    return pd.DataFrame(rows, columns=["roach", "side", "measure", "model", "param", "estimate", "se",
+                                       "ci_low", "ci_high", "n", "r2"])
+
+
+def predict(fits, roach, side, measure, model, x):
+    """Evaluates one fitted curve of a fit_dose_response table at frequencies x,
+    NaN if the group was not fitted."""
+    func, names = MODELS[model]
+    rows = fits[(fits["roach"] == roach) & (fits["side"] == side) & (fits["measure"] == measure)
+                & (fits["model"] == model)].set_index("param")["estimate"]
+    x = np.asarray(x, dtype=np.float64)
+    if len(rows) != len(names) or rows.isna().any():
+        return np.full(x.shape, np.nan)
+    return func(x, *rows[list(names)].to_numpy())
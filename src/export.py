@@ -0,0 +1,123 @@
+from pathlib import Path
+
+import numpy as np
+
+from .config import DATA_PROCESSED
+from .plotting.frequency import get_max_values
+
+TRACE_COLUMNS = ("lateral_velocity", "forward_velocity", "body_angle", "angular_velocity")
+PEAK_COLUMNS = ("lateral_max", "fwd_max", "angles_max", "ang_vel_max")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.ipc
+    except ImportError as err:
+        raise ImportError("Exporting to Parquet / Arrow requires pyarrow (pip install pyarrow)") from err
+    return pyarrow
+
+
+def trials_table(cohort_results):
+    """Builds one Arrow table with a row per accepted trial.
+
+    Args:
+        cohort_results (dict): {cohort_id: run_stat_analysis output}.
+
+    Returns:
+        pyarrow.Table with the provenance columns (cohort, file, stim_frame, fps, time),
+        the stimulation (side, freq), every per-trial record in summary["trials"],
+        the four traces as list columns and the four peak metrics.
+    """
+    pa = _pyarrow()
+    rows = []
+    for cohort_id, result in cohort_results.items():
+        traces = result[:4]
+        peaks = get_max_values(*traces)
+        trials = result[4].get("trials", {})
+
+        for key, records in trials.items():
+            for i, record in enumerate(records):
+                row = {"cohort": cohort_id, "side": key[0], "freq": key[1], **record}
+                for name, dct in zip(TRACE_COLUMNS, traces):
+                    row[name] = dct[key][i]
+                for name, dct in zip(PEAK_COLUMNS, peaks):
+                    row[name] = dct[key][i]
+                rows.append(row)
+
+    # Union of the row keys, in first-seen order
+    names = list(dict.fromkeys(name for row in rows for name in row))
+    arrays = {}
+    for name in names:
+        values = [row.get(name) for row in rows]
+        if name in TRACE_COLUMNS or isinstance(values[0], np.ndarray):
+            # Variable length traces as one flat buffer plus offsets
+            offsets = np.concatenate(([0], np.cumsum([len(v) for v in values]))).astype(np.int32)
+            arrays[name] = pa.ListArray.from_arrays(pa.array(offsets), pa.array(np.concatenate(values)))
+        else:
+            arrays[name] = pa.array(values)
+    return pa.table(arrays)
+
+
+def summary_table(cohort_results):
+    """Builds an Arrow table of success counts and rates per cohort, stimulation
+    type (turning / elytra) and frequency."""
+    pa = _pyarrow()
+    rows = {"cohort": [], "stimulation": [], "freq": [], "n_trials": [], "n_success": [], "success_rate": []}
+    for cohort_id, result in cohort_results.items():
+        summary = result[4]
+        for stimulation in ("turning", "elytra"):
+            for freq, outcomes in sorted(summary[f"{stimulation}_success_freq"].items()):
+                rows["cohort"].append(cohort_id)
+                rows["stimulation"].append(stimulation)
+                rows["freq"].append(freq)
+                rows["n_trials"].append(len(outcomes))
+                rows["n_success"].append(int(sum(outcomes)))
+                rows["success_rate"].append(sum(outcomes) / len(outcomes))
+    return pa.table(rows)
+
+
+def export_results(cohort_results, out_dir=DATA_PROCESSED, fmt="parquet", prefix=""):
+    """Writes trials and summary tables of the given cohorts to out_dir.
+
+    Args:
+        cohort_results (dict): {cohort_id: run_stat_analysis output}.
+        out_dir (Path): Output directory.
+        fmt (str): "parquet" or "arrow" (uncompressed Arrow IPC, zero-copy when memory-mapped).
+        prefix (str): Prepended to the file names.
+
+    Returns:
+        tuple: Paths of the trials and summary files.
+    """
+    pa = _pyarrow()
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    paths = []
+    for name, table in (("trials", trials_table(cohort_results)), ("summary", summary_table(cohort_results))):
+        if fmt == "parquet":
+            path = out_dir / f"{prefix}{name}.parquet"
+            pa.parquet.write_table(table, path)
+        elif fmt == "arrow":
+            path = out_dir / f"{prefix}{name}.arrow"
+            with pa.ipc.new_file(path, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            raise ValueError(f"Unknown export format: {fmt}")
+        paths.append(path)
+    return tuple(paths)
+
+
+def read_table(path, columns=None, filters=None):
+    """Reads an exported table memory-mapped, loading only the given columns.
+
+    filters (parquet only) are row filters in pyarrow's format, e.g.
+    [("side", "=", "Left"), ("freq", "=", 30)]."""
+    pa = _pyarrow()
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pa.parquet.read_table(path, columns=columns, filters=filters, memory_map=True)
+
+    table = pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+    return table if columns is None else table.select(columns)
@@ -0,0 +1,103 @@
+from functools import lru_cache
+
+import numpy as np
+from scipy import ndimage, signal
+
+from .windows import nominal_fps
+
+
+def _odd_frames(seconds, fps, minimum=3):
+    """Window length in frames (odd, at least minimum) for a duration in seconds."""
+    frames = max(int(round(seconds * fps)), minimum)
+    return frames if frames % 2 else frames + 1
+
+
+@lru_cache(maxsize=64)
+def design_filter(method, fps, params):
+    """Designs (and caches) the coefficients of a filter.
+
+    Args:
+        method (str): "ewma", "filtfilt", "savgol" or "median".
+        fps (float): Nominal frames per second of the data to filter
+            (windows.nominal_fps, so recordings at the same rate share a design).
+        params (tuple): Sorted (name, value) pairs of the filter parameters.
+
+    Returns:
+        The coefficients used by apply_filter for that method.
+    """
+    params = dict(params)
+    if method == "ewma":
+        # y[t] = alpha * x[t] + (1 - alpha) * y[t-1]
+        alpha = params["alpha"]
+        return np.array([alpha]), np.array([1.0, alpha - 1.0])
+    if method == "filtfilt":
+        # Butterworth low-pass, applied forward and backward (zero phase)
+        return signal.butter(params.get("order", 2), params["cutoff"], fs=fps, output="sos")
+    if method == "savgol":
+        window = _odd_frames(params["window"], fps, params.get("polyorder", 2) + 2)
+        return signal.savgol_coeffs(window, params.get("polyorder", 2))
+    if method == "median":
+        return _odd_frames(params["window"], fps)
+    raise ValueError(f"Unknown filter method: {method}")
+
+
+def apply_filter(data, spec, fps=None, axis=0):
+    """Filters data along its time axis in one call.
+
+    data can be a single trace (frames,), a trace of points (frames, 2) or a
+    whole trial tensor such as (n_trials, frames, ...) with axis=1.
+
+    Args:
+        data (np.ndarray): Data to filter, without NaNs.
+        spec (dict): {"method": ..., **params}, e.g. {"method": "ewma", "alpha": 0.2},
+            {"method": "filtfilt", "cutoff": 10, "order": 2},
+            {"method": "savgol", "window": 0.1, "polyorder": 2} or
+            {"method": "median", "window": 0.05} (windows in seconds).
+        fps (float): Frames per second (not needed for "ewma").
+        axis (int): Time axis.
+
+    Returns:
+        np.ndarray: Filtered data of the same shape and dtype.
+    """
+    data = np.asarray(data)
+    if data.shape[axis] == 0:
+        return data.copy()
+
+    method = spec["method"]
+    params = tuple(sorted((k, v) for k, v in spec.items() if k != "method"))
+    coeffs = design_filter(method, None if method == "ewma" else nominal_fps(fps), params)
+
+    if method == "ewma":
+        # Start from the first sample, as pandas' ewm(adjust=False)
+        b, a = coeffs
+        zi = -a[1] * np.take(data, [0], axis=axis)
+        filtered, _ = signal.lfilter(b, a, data, axis=axis, zi=zi)
+    elif method == "filtfilt":
+        padlen = min(3 * (2 * len(coeffs) + 1), data.shape[axis] - 1)
+        filtered = signal.sosfiltfilt(coeffs, data, axis=axis, padlen=padlen)
+    elif method == "savgol":
+        filtered = ndimage.convolve1d(data, coeffs, axis=axis, mode="nearest")
+    else:
+        size = [1] * data.ndim
+        size[axis] = coeffs
+        filtered = ndimage.median_filter(data, size=size, mode="nearest")
+
+    return filtered.astype(data.dtype, copy=False)
+
+
+def ewma_multi(data, alphas, axis=0):
+    """EWMA of the same data for several alphas in one pass over time.
+
+    Returns:
+        np.ndarray: (len(alphas), *data.shape), one smoothed copy per alpha,
+        identical to apply_filter with {"method": "ewma", "alpha": alpha}.
+    """
+    data = np.moveaxis(np.asarray(data), axis, 0)
+    alphas = np.asarray(alphas, dtype=np.float64).reshape((-1,) + (1,) * (data.ndim - 1))
+
+    smoothed = np.empty((len(alphas),) + data.shape, dtype=np.result_type(data.dtype, np.float64))
+    if len(data):
+        smoothed[:, 0] = data[0]
+    for t in range(1, len(data)):
+        smoothed[:, t] = alphas * data[t] + (1 - alphas) * smoothed[:, t - 1]
+    return np.moveaxis(smoothed, 1, axis + 1).astype(data.dtype, copy=False)
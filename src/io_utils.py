@@ -1,66 +1,99 @@
 from os import listdir
-import ast 
-import pandas as pd 
+import numpy as np
+import pandas as pd
+
+from .preprocessing import resolve_dtype
 
 def find_csv_filenames(path_to_dir, suffix=".csv"):
     filenames = listdir(path_to_dir)
     return [filename for filename in filenames if filename.endswith(suffix)]
 
 
-def file_read(file):
-    """Reads in a single csv file, with 3 columns: time, pose (position of the insect, structured as 
-    [top, middle, bottom]), and finally arduino data (stimulation side, frequency 
-    of the stimulation and duration of the stimulation) """
-
+def parse_pose_column(pose_raw, dtype=None):
+    """Parses the string pose column (e.g. "[x, y, angle]", with None for dropped
+    points) into a single (frames, values) float array, missing values become NaN."""
+    values = pose_raw.astype(str).str.strip().str.strip("[]").str.split(",", expand=True)
+    values = values.apply(lambda col: pd.to_numeric(col.str.strip(), errors="coerce"))
+    return values.to_numpy(dtype=resolve_dtype(dtype))
 
-    df = pd.read_csv(file)
-    # Read in time, pose and arduino data. 
-    time = df.get('time')
-    differences = time.diff()
-    fps = 1/differences.mean()
 
+def parse_keypoints(pose_raw, dtype=None):
+    """Parses a multi-keypoint pose column (e.g. "[[x0, y0], [x1, y1], ...]" or the
+    flat "[x0, y0, x1, y1, ...]", with None for dropped points) into one
+    (frames, keypoints, 2) float array, missing values become NaN."""
+    values = pose_raw.astype(str).str.replace(r"[\[\]\s]", "", regex=True).str.split(",", expand=True)
+    values = values.apply(lambda col: pd.to_numeric(col, errors="coerce"))
+    if values.shape[1] % 2:
+        raise ValueError(f"Keypoint pose needs x, y pairs, got {values.shape[1]} values per frame")
+    return values.to_numpy(dtype=resolve_dtype(dtype)).reshape(len(values), -1, 2)
 
-    pose_raw = df.get('pose')
-    arduino_data = df.get('arduino_data')
-    stim_deets = []     # Will contain a list of lists: [stimulation side, frequency] 
-                        # or [None, None] if no stimulation has occured.
-    stim_occur = []     #Simply a binary list denoting whether a stimulation has occured at specific time j. 
 
-    pose = []
-    # We iterate through both pose and arduino data lists. 
-    for i, j in zip(pose_raw, arduino_data):
+def parse_arduino_column(arduino_data):
+    """Parses the arduino column into stimulation details and occurrences.
 
-        # Convert the string representation of a list into an actual list
-        i_list = ast.literal_eval(i)
+    Returns an object array of shape (frames, 2) holding [side, frequency]
+    (or [None, None]) and an int8 array flagging the frames with a stimulation."""
+    stim_deets = np.full((len(arduino_data), 2), None, dtype=object)
+    stim_occur = np.zeros(len(arduino_data), dtype=np.int8)
 
-        pose.append(i_list)
+    # Only the (few) non-empty entries need to be parsed
+    for i, j in enumerate(arduino_data):
         # Check if arduino data is NOT an empty entry
         if isinstance(j, str) and j.strip():
             # If not, then append the stimulation information
-            # print(file)
             try:
-                # direction = j[0]
-                # number = j[1:]
-                # if direction == 'E': 
-                #     direction = 'Both'
-                # elif direction == 'A': 
-                #     direction = 'Left'
-                # elif direction == 'B': 
-                #     direction ='Right'
                 direction, number = j.split(", ")
-                freq = int(number[:2])
                 freq = int(number)
-                stim_deets.append([direction, freq])
-                stim_occur.append(1)
-            except ValueError: 
-                # If empty, no stimulation: [None, None, None]
-                stim_deets.append([None, None])
-                stim_occur.append(0)
-        else: 
-            # If empty, no stimulation: [None, None, None]
-            stim_deets.append([None, None])
-            stim_occur.append(0)
-
-
-    # Return relevant lists. 
+            except ValueError:
+                # If unreadable, no stimulation: [None, None]
+                continue
+            stim_deets[i] = [direction, freq]
+            stim_occur[i] = 1
+
+    return stim_deets, stim_occur
+
+
+def file_read(file, dtype=None, return_time=False):
+    """Reads in a single csv file, with 3 columns: time, pose (position of the insect, structured as
+    [top, middle, bottom]), and finally arduino data (stimulation side, frequency
+    of the stimulation and duration of the stimulation).
+
+    Pose is returned as a contiguous (frames, 3) array of x, y and angle in the
+    configured float dtype (see config.FLOAT_DTYPE), with NaN for dropped points.
+    Exports with several keypoints per frame are read with keypoints_read.
+    If return_time, the per-frame timestamps (seconds, float64 array) are returned last. """
+
+
+    df = pd.read_csv(file)
+    # Read in time, pose and arduino data.
+    time = df.get('time')
+    differences = time.diff()
+    fps = float(1/differences.mean())
+
+    pose = parse_pose_column(df.get('pose'), dtype)
+
+    # stim_deets: [stimulation side, frequency] or [None, None] if no stimulation has occured.
+    # stim_occur: binary array denoting whether a stimulation has occured at frame j.
+    stim_deets, stim_occur = parse_arduino_column(df.get('arduino_data'))
+
+    # Return relevant arrays.
+    if return_time:
+        return pose, stim_deets, stim_occur, fps, time.to_numpy(dtype=np.float64)
     return pose, stim_deets, stim_occur, fps
+
+
+def keypoints_read(file, dtype=None, column="pose", return_time=False):
+    """Reads a csv file whose pose column holds several keypoints per frame.
+
+    Same as file_read, except that pose is returned as one (frames, keypoints, 2)
+    array of x, y (see parse_keypoints), which get_post_stim windows as is."""
+    df = pd.read_csv(file)
+    time = df.get('time')
+    fps = float(1/time.diff().mean())
+
+    keypoints = parse_keypoints(df.get(column), dtype)
+    stim_deets, stim_occur = parse_arduino_column(df.get('arduino_data'))
+
+    if return_time:
+        return keypoints, stim_deets, stim_occur, fps, time.to_numpy(dtype=np.float64)
+    return keypoints, stim_deets, stim_occur, fps
@@ -1,100 +1,200 @@
 import numpy as np
-import pandas as pd
 
+from .alignment import pad_trials
+from .config import FILTERS
+from .windows import WINDOW
+from .filters import apply_filter
 
-def body_vel(pos, angles, fps):
+
+PIXELS_PER_MM = 4.1033
+
+# Scalar path-shape metrics of trajectory_metrics (record columns)
+TRAJECTORY_METRICS = ("path_length", "net_displacement", "tortuosity", "turning_radius")
+
+
+def frame_intervals(fps, time=None):
+    """Time between consecutive frames: the true per-frame intervals when the
+    timestamps are known (falling back to 1/fps for repeated timestamps),
+    otherwise the uniform interval 1/fps."""
+    if time is None:
+        return 1 / fps
+    dt = np.diff(np.asarray(time, dtype=np.float64))
+    return np.where(dt > 0, dt, 1 / fps)
+
+
+def body_vel(pos, angles, fps, filter_spec=None, time=None, window=WINDOW):
     """Calculate the in-line and transverse velocities of the beetle.
     
     Args:
-        pos: position as [[x, y], [x1, y1], .....]
+        pos: (n, 2) array of positions [[x, y], [x1, y1], .....]
+        angles: (n,) array of body angles in degrees.
         fps (int): frames per second that the data has been recorded at. 
+        filter_spec (dict): smoothing filter of the velocities (defaults to config.FILTERS["velocity"]).
+        time: per-frame timestamps relative to the stimulation, if given velocities use the true frame intervals.
+        window (WindowSpec): Trial window, locating the onset when time is not given.
     
     Returns:
-        tuple: A tuple containing lists of in-line velocity and signed transverse velocity.
+        tuple: A tuple containing arrays of in-line velocity and signed transverse velocity.
                Transverse velocity is negative in one direction and positive in the opposite direction.
+               Both are referenced to the last velocity before the stimulation onset
+               (the step into the onset frame, as get_body_angles references the onset).
     """
+    pos = np.asarray(pos)
+    angles = np.asarray(angles)
+    dtype = pos.dtype
 
-    body_v_in_line = []
-    body_v_transverse = []
+    # Velocity vector of middle point
+    delta = np.diff(pos, axis=0)
 
-    for i in range(1, len(pos)):
-        # Velocity vector of middle point
-        delta = np.subtract(pos[i], pos[i-1])
+    # Body axis unit vector and its perpendicular (rotated 90 degrees CCW)
+    theta = np.radians(angles[1:])
+    cos, sin = np.cos(theta), np.sin(theta)
 
-        
-        fwd_vector = [np.cos(np.radians(angles[i])), np.sin(np.radians(angles[i]))]
-        norm = np.linalg.norm(fwd_vector)
-        body_axis_unit = fwd_vector / norm
+    # Calculate velocities
+    scale_factor = 1 / (frame_intervals(fps, time) * PIXELS_PER_MM)
+    body_v_in_line = (delta[:, 0] * cos + delta[:, 1] * sin) * scale_factor
+    body_v_transverse = (-delta[:, 0] * sin + delta[:, 1] * cos) * scale_factor
 
-        # Calculate perpendicular vector to body axis (rotated 90 degrees CCW)
-        perp_body_axis_unit = np.array([-body_axis_unit[1], body_axis_unit[0]])
+    # Smoothing of both velocities in one pass
+    if filter_spec is None:
+        filter_spec = FILTERS["velocity"]
+    body_v = np.column_stack((body_v_in_line, body_v_transverse)).astype(dtype)
+    body_v = np.round(apply_filter(body_v, filter_spec, fps), 5)
+    body_v_in_line = np.ascontiguousarray(body_v[:, 0])
+    body_v_transverse = np.ascontiguousarray(body_v[:, 1])
 
-        # Calculate velocities
-        in_line_velocity = np.dot(delta, body_axis_unit)
-        transverse_velocity = np.dot(delta, perp_body_axis_unit)
+    # Normalization (baseline subtraction): velocity i is the step into frame i + 1
+    onset = window.frames(fps).onset if time is None else int(np.searchsorted(time, 0))
+    ref_idx = min(max(onset - 1, 0), len(body_v_in_line) - 1)
 
-        pixels_per_mm = 4.1033
-        scale_factor = fps/pixels_per_mm
-        body_v_in_line.append(in_line_velocity * scale_factor)
-        body_v_transverse.append(transverse_velocity * scale_factor)
+    body_v_in_line = body_v_in_line - body_v_in_line[ref_idx]
+    body_v_transverse = body_v_transverse - body_v_transverse[ref_idx]
 
-        # Lateral velocity with sign using dot product with perpendicular axis
-        lateral_velocity_signed = np.dot(delta, perp_body_axis_unit) * scale_factor
-        body_v_transverse.append(lateral_velocity_signed)
+    return body_v_in_line, body_v_transverse
 
-    # Exponential smoothing
-    alpha = 0.25
-    body_v_in_line = pd.Series(body_v_in_line).ewm(alpha=alpha, adjust=False).mean()
-    body_v_in_line = round(body_v_in_line, 5).tolist()
-    
-    body_v_transverse = pd.Series(body_v_transverse).ewm(alpha=alpha, adjust=False).mean()
-    body_v_transverse = round(body_v_transverse, 5).tolist()
-    
-    # Normalization (baseline subtraction)
-    ref_idx = int(0.1 * fps)
-    if ref_idx >= len(body_v_in_line):
-        ref_idx = 0
+def keypoint_heading(keypoints, head=0, tail=-1):
+    """Heading (degrees, in (-180, 180]) of the axis from the tail to the head
+    keypoint, for a (..., keypoints, 2) array of any leading shape."""
+    keypoints = np.asarray(keypoints)
+    axis = keypoints[..., head, :] - keypoints[..., tail, :]
+    return np.degrees(np.arctan2(axis[..., 1], axis[..., 0]))
+
+
+def keypoint_center(keypoints, center=None):
+    """Position (..., 2) of a keypoint tensor: the given keypoint, or the mean of
+    all keypoints when center is None."""
+    keypoints = np.asarray(keypoints)
+    if center is None:
+        return keypoints.mean(axis=-2)
+    return keypoints[..., center, :]
+
+
+def get_body_angles(angles, fps, time=None, window=WINDOW):
+    """Unwraps a 1D array of angles (degrees) so that no step exceeds 180 degrees,
+    then references it to the angle at stimulation onset (window.pre into the
+    window, or time 0 when the timestamps relative to the stimulation are given)."""
+    angles = np.asarray(angles)
+
+    # Calculate the difference between consecutive angles and adjust for jumps
+    # greater than 180 degrees, so the smallest angle difference is always used
+    delta = np.diff(angles)
+    delta = (delta + 180) % 360 - 180
+
+    # Accumulate the adjusted deltas starting from the first angle
+    normalized_angles = np.cumsum(np.concatenate((angles[:1], delta)))
+
+    if time is None:
+        reference = normalized_angles[window.frames(fps).onset]
+    else:
+        reference = normalized_angles[min(np.searchsorted(time, 0), len(normalized_angles) - 1)]
+    # Return the array of normalized angles
+    return normalized_angles - reference
+
+def get_ang_vel(angles, fps, time=None):
+    """Calculate angular velocity (degs/s) from an array of angles over uniform time intervals (specify fps),
+    or over the true frame intervals when the per-frame timestamps are given."""
+    angles = np.asarray(angles)
+    if len(angles) < 2:
+        return angles[:0]  # Not enough data to calculate velocity
 
-    ref_in_line = body_v_in_line[ref_idx]
-    ref_transverse = body_v_transverse[ref_idx]
+    # Time interval between measurements in seconds
+    time_interval = frame_intervals(fps, time)
+    if time is not None:
+        time_interval = time_interval[1:]
 
-    body_v_in_line = [v - ref_in_line for v in body_v_in_line]
-    body_v_transverse = [v - ref_transverse for v in body_v_transverse]
+    # Angular velocity = delta_angle / delta_time, starting from the second difference
+    return (np.diff(angles)[1:] / time_interval).astype(angles.dtype, copy=False)
 
-    return body_v_in_line, body_v_transverse
 
-def get_body_angles(angles, fps):
-    # Initialize normalized angles list with the first angle
-    
-    normalized_angles = [angles[0]] 
-    
-    # Normalize subsequent angles to avoid large jumps
-    for i in range(1, len(angles)):
-        # Calculate the difference between current and previous angle
-        delta = angles[i] - angles[i - 1]
-        
-        # Adjust for jumps greater than 180 degrees
-        # This ensures the smallest angle difference is always used
-        delta = (delta + 180) % 360 - 180
-        
-        # Add the adjusted delta to the previous normalized angle
-        normalized_angles.append(normalized_angles[-1] + delta)
-
-    reference = reference = normalized_angles[int(0.15 * fps)]
-    # Return the list of normalized angles
-    return [angle - reference for angle in normalized_angles]
-
-def get_ang_vel(angles, fps):
-    """Calculate angular velocity (degs/s) from a list of angles over uniform time intervals (specify fps)."""
-    if len(angles) < 2:
-        return []  # Not enough data to calculate velocity
+def _gradient(values, t):
+    # Derivative along axis 1 of (n, frames, ...) values with (n, frames) timestamps:
+    # central differences inside, one-sided at both ends
+    t = t.reshape(t.shape + (1,) * (values.ndim - 2))
+    grad = np.empty_like(values)
+    grad[:, 1:-1] = (values[:, 2:] - values[:, :-2]) / (t[:, 2:] - t[:, :-2])
+    grad[:, 0] = (values[:, 1] - values[:, 0]) / (t[:, 1] - t[:, 0])
+    grad[:, -1] = (values[:, -1] - values[:, -2]) / (t[:, -1] - t[:, -2])
+    return grad
+
 
-    angular_velocities = []
-    time_interval = 1 / fps  # Time interval between measurements in seconds (100fps)
+def trajectory_metrics(positions, fps, times=None, min_speed=1.0, window=WINDOW):
+    """Path-shape metrics of many trials in one batched pass.
 
-    for i in range(2, len(angles)):
-        delta_angle = angles[i] - angles[i - 1]  # Change in angle
-        angular_velocity = delta_angle / time_interval  # Angular velocity = delta_angle / delta_time
-        angular_velocities.append(angular_velocity)
+    Path length, net displacement, tortuosity (path length / net displacement)
+    and turning radius (1 / median |curvature|) are measured from the
+    stimulation onset to the end of each window, in mm. The signed curvature
+    profile (1/mm, positive for counter-clockwise turns) covers the whole window
+    and is NaN where the speed is below min_speed (mm/s).
 
-    return angular_velocities
\ No newline at end of file
+    Args:
+        positions (list): (frames, 2) smoothed pixel positions, one per trial.
+        fps (float): Frames per second of the recordings.
+        times (list): Window timestamps relative to the stimulation, one per
+            trial (defaults to uniform frames with the onset at window.pre).
+
+    Returns:
+        dict: TRAJECTORY_METRICS as (n_trials,) arrays and "curvature", a list
+        of per-trial profiles.
+    """
+    n = len(positions)
+    if n == 0:
+        return {**{name: np.empty(0) for name in TRAJECTORY_METRICS}, "curvature": []}
+    if times is None:
+        onset = window.frames(fps).onset
+        times = [(np.arange(len(p)) - onset) / fps for p in positions]
+
+    t, lengths = pad_trials(times)
+    x, _ = pad_trials([p[:, 0] for p in positions])
+    y, _ = pad_trials([p[:, 1] for p in positions])
+    pos = np.stack((x, y), axis=2) / PIXELS_PER_MM
+    rows = np.arange(n)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        post = t >= 0
+        steps = np.hypot(*np.moveaxis(np.diff(pos, axis=1), 2, 0))
+        path_length = np.where(post[:, 1:] & post[:, :-1], steps, 0).sum(axis=1)
+
+        first = np.argmax(post, axis=1)
+        last = np.maximum(lengths - 1, 0)
+        net_displacement = np.hypot(*(pos[rows, last] - pos[rows, first]).T)
+        tortuosity = np.where(net_displacement > 0, path_length / net_displacement, np.nan)
+
+        velocity = _gradient(pos, t)
+        acceleration = _gradient(velocity, t)
+        speed = np.hypot(velocity[..., 0], velocity[..., 1])
+        curvature = (velocity[..., 0] * acceleration[..., 1] - velocity[..., 1] * acceleration[..., 0]) / speed ** 3
+        curvature[~(speed >= min_speed)] = np.nan
+
+        post_curvature = np.where(post, np.abs(curvature), np.nan)
+        has = (~np.isnan(post_curvature)).any(axis=1)
+        median = np.full(n, np.nan)
+        median[has] = np.nanmedian(post_curvature[has], axis=1)
+        turning_radius = 1 / median
+
+    return {
+        "path_length": path_length,
+        "net_displacement": net_displacement,
+        "tortuosity": tortuosity,
+        "turning_radius": turning_radius,
+        "curvature": [curvature[i, :length] for i, length in enumerate(lengths)],
+    }
@@ -0,0 +1,96 @@
+import numpy as np
+
+from .alignment import pad_trials
+from .config import LATENCY_THRESHOLD_SD
+from .windows import WINDOW
+
+# Scalar response-timing metrics of response_timing (seconds)
+TIMING_METRICS = ("latency", "time_to_peak", "rise_time", "decay_tau")
+# Traces of iter_trials timed, as record column prefix: position in its traces
+TIMING_TRACES = {"angle": 2, "fwd": 1}
+
+
+def _crossing(r, t, level, allowed, rising=True):
+    # Time at which each row first reaches level (or falls to it) within allowed,
+    # interpolated linearly from the previous sample; NaN when it never does
+    hit = allowed & ((r >= level[:, None]) if rising else (r <= level[:, None]))
+    rows = np.arange(len(r))
+    i = np.argmax(hit, axis=1)
+    j = np.maximum(i - 1, 0)
+    r0, r1, t0, t1 = r[rows, j], r[rows, i], t[rows, j], t[rows, i]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(i > 0, (level - r0) / (r1 - r0), 1.0)
+    frac = np.clip(np.nan_to_num(frac, nan=1.0, posinf=1.0, neginf=1.0), 0, 1)
+    return np.where(hit.any(axis=1), t0 + frac * (t1 - t0), np.nan)
+
+
+def response_timing(traces, fps, times=None, threshold_sd=LATENCY_THRESHOLD_SD, window=WINDOW):
+    """Response timing of many trials of one measure in one batched pass.
+
+    The response is the deviation from the pre-stimulation baseline mean,
+    signed so that its largest excursion during the stimulation (the peak) is
+    positive. Times are seconds from the stimulation onset:
+
+    - latency: first crossing of threshold_sd baseline standard deviations
+      after the onset, up to the peak.
+    - time_to_peak: time of the peak.
+    - rise_time: from 10 % to 90 % of the peak amplitude, before the peak.
+    - decay_tau: from the peak to the first fall below 1/e of its amplitude
+      (the time constant of an exponential return to baseline).
+
+    Args:
+        traces (list): 1D traces (e.g. body angle or forward velocity), one per trial.
+        fps (float): Frames per second of the recordings.
+        times (list): Window timestamps relative to the stimulation, one per
+            trial; shorter derived traces are matched with the last len(trace)
+            timestamps (see alignment.align_trials). Defaults to uniform frames
+            with the onset at window.pre.
+
+    Returns:
+        dict: TIMING_METRICS as (n_trials,) arrays, NaN where undefined.
+    """
+    n = len(traces)
+    if n == 0:
+        return {name: np.empty(0) for name in TIMING_METRICS}
+    if times is None:
+        onset = window.frames(fps).onset
+        times = [(np.arange(len(trace)) - onset) / fps for trace in traces]
+    else:
+        times = [np.asarray(t)[len(t) - len(trace):] for trace, t in zip(traces, times)]
+
+    t, _ = pad_trials(times)
+    x, _ = pad_trials(traces)
+    rows = np.arange(n)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        baseline = np.where(t < 0, x, np.nan)
+        has_baseline = (t < 0).any(axis=1)
+        mean = np.full(n, np.nan)
+        std = np.full(n, np.nan)
+        mean[has_baseline] = np.nanmean(baseline[has_baseline], axis=1)
+        std[has_baseline] = np.nanstd(baseline[has_baseline], axis=1)
+        deviation = x - mean[:, None]
+
+        # Peak: largest excursion during the stimulation
+        during = window.relative_mask(t) & ~np.isnan(deviation)
+        peak = np.argmax(np.where(during, np.abs(deviation), -np.inf), axis=1)
+        has_peak = during.any(axis=1)
+        response = deviation * np.sign(deviation[rows, peak])[:, None]
+        amplitude = np.where(has_peak, response[rows, peak], np.nan)
+        time_to_peak = np.where(has_peak, t[rows, peak], np.nan)
+
+        frame = np.arange(t.shape[1])
+        rising = (t >= 0) & (frame <= peak[:, None])
+        latency = _crossing(response, t, threshold_sd * std, rising)
+        latency = np.where(latency <= time_to_peak, np.maximum(latency, 0), np.nan)
+
+        responded = has_peak & (amplitude > 0)
+        rise_time = _crossing(response, t, 0.9 * amplitude, rising) - _crossing(response, t, 0.1 * amplitude, rising)
+        decay_tau = _crossing(response, t, amplitude / np.e, frame >= peak[:, None], rising=False) - time_to_peak
+
+    return {
+        "latency": latency,
+        "time_to_peak": time_to_peak,
+        "rise_time": np.where(responded, rise_time, np.nan),
+        "decay_tau": np.where(responded, decay_tau, np.nan),
+    }
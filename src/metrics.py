@@ -1,33 +1,49 @@
 import numpy as np 
 from scipy import stats 
 
+from .config import STIM_DEBOUNCE_S, STIM_REFRACTORY_S
+from .onsets import detect_onsets
+from .windows import WINDOW, WindowSpec
 
 
-def get_post_stim(pose, stim_deets, stim_occur, fps):
+def get_post_stim(pose, stim_deets, stim_occur, fps, return_frames=False, pre=WINDOW.pre, post=WINDOW.post, time=None,
+                  debounce=STIM_DEBOUNCE_S, refractory=STIM_REFRACTORY_S):
     """
     Extracts data occurring just before and after a stimulation.
     
     This function should be used BEFORE applying EWMA filters to extract moments of interest.
-    The post_frames and pre_frames variables can be adjusted to change the extraction window.
+    The pre and post durations (seconds, see windows.WINDOW) set the extraction window.
     
     Args:
-    pose (list): List containing x, y, angle details.
-    stim_deets (list): List containing stimulation details.
-    stim_occur (list): List indicating stimulation occurrences (1 for stimulation, 0 otherwise).
+    pose (np.ndarray): (frames, 3) array containing x, y, angle details.
+    stim_deets (np.ndarray): (frames, 2) array containing stimulation details.
+    stim_occur (np.ndarray): Array indicating stimulation occurrences (1 for stimulation, 0 otherwise).
     fps (int): Frames per second of the recording.
+    return_frames (bool): Also return the stimulation frame of every window.
+    pre (float): Seconds extracted before each stimulation.
+    post (float): Seconds extracted after each stimulation.
+    time (np.ndarray): Per-frame timestamps of the recording, if given the window
+        timestamps (relative to the stimulation) are returned too.
+    debounce, refractory (float): Onset detection, a window is extracted per
+        stimulation rather than per marked frame (see onsets.detect_onsets).
 
     Returns:
-    tuple: A tuple containing stimulation details and extracted body part coordinates.
+    dict: Maps (side, freq) to a list of extracted (window, 3) pose arrays.
+    If return_frames, a second dict maps (side, freq) to the matching stimulation frames.
+    If time is given, a last dict maps (side, freq) to the matching window timestamps.
     """
-    #Define the dictionary
+    #Define the dictionaries
     stim_dict = {}
+    frame_dict = {}
+    time_dict = {}
 
     # Define the extraction window
-    post_frames = int(fps * 1.25) 
-    pre_frames = int(fps * 0.15)   
+    frames = WindowSpec(pre=pre, post=post).frames(fps)
+    post_frames = frames.post
+    pre_frames = frames.pre
     
-    # Find indices where stimulation occurred
-    stim_index = [i for i, x in enumerate(stim_occur) if x == 1]
+    # Find the onset of every stimulation
+    stim_index = detect_onsets(stim_occur, stim_deets, fps, time, debounce, refractory)["onset"]
     
     
     # Extract data for the last stimulation
@@ -36,8 +52,9 @@ def get_post_stim(pose, stim_deets, stim_occur, fps):
         end = stim + post_frames
         if start < 0 or end > len(pose): 
             continue
-        # Extract body part coordinates within the defined window
-        pose_sect = pose[stim-pre_frames:stim+post_frames]
+        # Extract body part coordinates within the defined window. Copy so the
+        # window does not keep the whole recording alive.
+        pose_sect = pose[start:end].copy()
         
         
         # Get stimulation details
@@ -46,10 +63,20 @@ def get_post_stim(pose, stim_deets, stim_occur, fps):
 
         if (side, freq) not in stim_dict: 
             stim_dict[(side, freq)] = []
+            frame_dict[(side, freq)] = []
+            time_dict[(side, freq)] = []
 
         stim_dict[(side, freq)].append(pose_sect)
+        frame_dict[(side, freq)].append(int(stim))
+        if time is not None:
+            time_dict[(side, freq)].append(time[start:end] - time[stim])
 
-    return stim_dict
+    outputs = (stim_dict,)
+    if return_frames:
+        outputs += (frame_dict,)
+    if time is not None:
+        outputs += (time_dict,)
+    return outputs if len(outputs) > 1 else stim_dict
 
 
 def statistical_significance(data1, data2): 
@@ -72,30 +99,29 @@ def statistical_significance(data1, data2):
         print("Fail to reject the null hypothesis. There is no significant difference between the two groups.")
 
 
-def trial_is_outlier(angles, fwd_vel, key): 
-    for i in range(len(angles) - 5): 
-        if abs(angles[i] - angles[i+5]) > 40: 
-            return True 
+def trial_is_outlier(angles, fwd_vel, key, max_jump=40, jump_frames=5): 
+    angles = np.asarray(angles)
+    # Any jump of more than max_jump degrees over jump_frames frames
+    if (np.abs(angles[:-jump_frames] - angles[jump_frames:]) > max_jump).any(): 
+        return True 
         
     if np.isnan(angles).all(): 
         return True
 
-        
-
     return False
 
-def turning_fail(angles, key): 
-    duringstim = angles[int(0.15/1.25*len(angles)):int(0.65/1.25*len(angles))]
+def turning_fail(angles, key, window=WINDOW): 
+    duringstim = angles[window.stim_slice(len(angles))]
 
     if key[0] == "Right": 
-        if min(duringstim) > 0: 
+        if np.min(duringstim) > 0: 
             return True
         
         if angles[-1] > 0: 
             return True
 
     if key[0] == "Left": 
-        if max(duringstim) < 0:
+        if np.max(duringstim) < 0:
             return True
         
         if angles [-1] < 0: 
@@ -104,15 +130,15 @@ def turning_fail(angles, key):
     return False
 
 
-def elytra_fail(fwd_vel, key): 
-    fwd_vel = fwd_vel[int(0.15/1.25*len(fwd_vel)):int(0.65/1.25*len(fwd_vel))]
+def elytra_fail(fwd_vel, key, min_final=0, window=WINDOW): 
+    fwd_vel = fwd_vel[window.stim_slice(len(fwd_vel))]
     # if key[0] == "Both": 
     #     if max(fwd_vel) < 3: 
     #         return True 
         
         
     if key[0] == "Both": 
-        if fwd_vel[-1] < 0: 
+        if fwd_vel[-1] < min_final: 
             return True
         
     return False
\ No newline at end of file
@@ -0,0 +1,78 @@
+import numpy as np
+
+from .config import STIM_DEBOUNCE_S, STIM_REFRACTORY_S
+
+
+def marked_runs(stim_occur):
+    """Run-length encoding of the marked frames of a stimulation column.
+
+    Returns:
+        tuple: (starts, ends) frame arrays of the runs of consecutive marked
+        frames, ends exclusive.
+    """
+    marked = np.asarray(stim_occur) == 1
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], marked, [False])).astype(np.int8)))
+    return edges[::2], edges[1::2]
+
+
+def detect_onsets(stim_occur, stim_deets=None, fps=None, time=None, debounce=STIM_DEBOUNCE_S,
+                  refractory=STIM_REFRACTORY_S):
+    """True stimulation onsets of a recording, one per stimulation however many
+    frames the Arduino marked.
+
+    Runs of marked frames with the same side and frequency separated by less
+    than debounce seconds are one stimulation, and an onset less than
+    refractory seconds after the previous accepted onset is a re-trigger of
+    it and dropped.
+
+    Args:
+        stim_occur (np.ndarray): 1 on the frames marked with a stimulation.
+        stim_deets (np.ndarray): (frames, 2) [side, freq] of every frame (see
+            io_utils.parse_arduino_column); without it runs are not told apart
+            by condition.
+        fps (float): Frame rate, for the durations when there are no timestamps.
+        time (np.ndarray): Per-frame timestamps (seconds).
+        debounce (float): Longest gap (seconds) bridged within one stimulation.
+        refractory (float): Shortest interval (seconds) between two onsets.
+
+    Returns:
+        dict: "onset" and "offset" frames (offset exclusive), "duration"
+        (seconds) and the "side" and "freq" of every stimulation.
+    """
+    starts, ends = marked_runs(stim_occur)
+    if time is not None:
+        time = np.asarray(time, dtype=np.float64)
+        frame_time = lambda frames: time[np.minimum(frames, len(time) - 1)]
+        frame_period = float(np.nanmedian(np.diff(time))) if len(time) > 1 else 0.0
+    else:
+        period = 1 / fps if fps else 1.0
+        frame_time = lambda frames: np.asarray(frames, dtype=np.float64) * period
+        frame_period = period
+
+    if stim_deets is not None and len(starts):
+        sides = np.asarray(stim_deets)[starts, 0]
+        freqs = np.asarray(stim_deets)[starts, 1]
+    else:
+        sides = np.full(len(starts), None, dtype=object)
+        freqs = np.full(len(starts), None, dtype=object)
+
+    # Debounce: bridge short gaps between runs of the same condition
+    if len(starts) > 1:
+        gap = frame_time(starts[1:]) - frame_time(ends[:-1] - 1) - frame_period
+        same = (sides[1:] == sides[:-1]) & (freqs[1:] == freqs[:-1])
+        merge = (gap < debounce) & same
+        first = np.concatenate(([True], ~merge))
+        last = np.concatenate((~merge, [True]))
+        starts, ends, sides, freqs = starts[first], ends[last], sides[first], freqs[first]
+
+    # Refractory: each accepted onset masks the onsets that follow too closely
+    onset_time = frame_time(starts)
+    keep = np.zeros(len(starts), dtype=bool)
+    i = 0
+    while i < len(starts):
+        keep[i] = True
+        i = max(int(np.searchsorted(onset_time, onset_time[i] + refractory, side="left")), i + 1)
+
+    starts, ends = starts[keep], ends[keep]
+    duration = frame_time(ends - 1) - frame_time(starts) + frame_period
+    return {"onset": starts, "offset": ends, "duration": duration, "side": sides[keep], "freq": freqs[keep]}
@@ -0,0 +1,146 @@
+import os
+import queue
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker
+from pathlib import Path
+
+from . import shared
+from .config import IO_THREADS, PREFETCH_DEPTH
+from .stats_pipeline import run_stat_analysis
+
+# End of one reader thread's share of the files
+_DONE = object()
+
+
+def _put(q, item, stop):
+    # Blocking put that gives up once the consumer has stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def prefetch(files, io_threads=IO_THREADS, depth=PREFETCH_DEPTH):
+    """Reads files ahead on io_threads threads, roughly in the given order.
+
+    At most depth files are held in the bounded queue: once it is full the
+    readers wait for the consumer, so memory stays bounded however slow the
+    consumer is.
+
+    Yields:
+        tuple: (file, raw bytes) in the order the reads complete.
+
+    Raises:
+        OSError: The first failed read, once it reaches the consumer.
+    """
+    todo = queue.Queue()
+    for file in files:
+        todo.put(file)
+    ready = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def reader():
+        while not stop.is_set():
+            try:
+                file = todo.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                item = (file, Path(file).read_bytes())
+            except OSError as exc:
+                item = exc
+            _put(ready, item, stop)
+        _put(ready, _DONE, stop)
+
+    threads = [threading.Thread(target=reader, daemon=True) for _ in range(max(io_threads, 1))]
+    for thread in threads:
+        thread.start()
+    try:
+        remaining = len(threads)
+        while remaining:
+            item = ready.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, OSError):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def _analyse(file, data, dtype, keypoints, share):
+    result = run_stat_analysis([file], dtype, keypoints=keypoints, sources={file: data})
+    return file, shared.pack(result) if share else result
+
+
+def _collect(pending, share):
+    # Results of the next finished futures, unpacked from shared memory if they
+    # were packed. Futures stay in pending until collected, so that the
+    # segments of the others can be freed if one of them failed
+    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+    for future in done:
+        file, result = future.result()
+        pending.discard(future)
+        yield file, shared.unpack(result) if share else result
+
+
+def _discard(futures):
+    # Frees the segments of results that will not be collected
+    for future in futures:
+        if future.done() and not future.cancelled() and future.exception() is None:
+            shared.discard(future.result()[1])
+
+
+def run_pipeline(files, max_workers=None, io_threads=IO_THREADS, depth=PREFETCH_DEPTH, dtype=None, keypoints=None,
+                 share=True):
+    """Analyses files with disk reads overlapped with the computation.
+
+    Reader threads prefetch the raw csv bytes (see prefetch) while worker
+    processes parse them and run the windowing and kinematics. At most
+    max_workers files are in the workers at a time and depth more wait in
+    memory, so a slow disk or slow workers stall the other side instead of
+    piling up data.
+
+    With share, the workers return their trial arrays through shared memory
+    (see shared.pack) instead of pickling them: only a small descriptor comes
+    back and the results are assembled from views of the segments. Segments
+    of results that are not collected (a worker failed or the caller stopped
+    early) are freed.
+
+    Args:
+        files (list): csv files, read roughly in this order (largest first
+            balances the workers best).
+        max_workers (int): Number of worker processes (defaults to the cpu count).
+        io_threads (int): Number of reader threads.
+        depth (int): Files read ahead of the workers.
+        dtype: Float dtype of the trial arrays (defaults to config.FLOAT_DTYPE).
+        keypoints (dict): Multi-keypoint pose files, see stats_pipeline.iter_trials.
+        share (bool): Return the arrays through shared memory.
+
+    Yields:
+        tuple: (file, run_stat_analysis output of the file) as files complete.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    if share:
+        # Workers inherit this process's tracker, which then sees the segments
+        # they create unlinked here rather than leaked at exit
+        resource_tracker.ensure_running()
+    pending = set()
+    pool = ProcessPoolExecutor(max_workers=max_workers)
+    try:
+        for file, data in prefetch(files, io_threads, depth):
+            if len(pending) >= max_workers:
+                yield from _collect(pending, share)
+            pending.add(pool.submit(_analyse, file, data, dtype, keypoints, share))
+        while pending:
+            yield from _collect(pending, share)
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if share:
+            _discard(pending)
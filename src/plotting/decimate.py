@@ -0,0 +1,68 @@
+import numpy as np
+
+# Resolution the figures are saved at
+SAVE_DPI = 300
+# Buckets per pixel, margin for x limits narrowed after plotting
+OVERSAMPLE = 2
+
+
+def pixel_width(ax, dpi=SAVE_DPI):
+    """Width of an axes in pixels once saved at dpi."""
+    return max(int(np.ceil(ax.get_position().width * ax.figure.get_figwidth() * dpi)), 1)
+
+
+def n_buckets(ax, x, dpi=SAVE_DPI):
+    """Number of buckets for a trace with x values on ax: OVERSAMPLE per pixel of
+    the x range it covers (the axes width unless the x limits are already set)."""
+    width = pixel_width(ax, dpi)
+    if not ax.get_autoscalex_on() and len(x) > 1:
+        left, right = ax.get_xlim()
+        with np.errstate(invalid="ignore", divide="ignore"):
+            scale = (np.nanmax(x) - np.nanmin(x)) / abs(right - left)
+        if np.isfinite(scale):
+            width = int(np.ceil(width * max(scale, 1 / width)))
+    return max(width * OVERSAMPLE, 1)
+
+
+def _buckets(values, n_buckets):
+    # (n_buckets, size) view of values padded with NaN, size samples per bucket
+    size = int(np.ceil(len(values) / n_buckets))
+    padded = np.full(n_buckets * size, np.nan)
+    padded[:len(values)] = values
+    return padded.reshape(n_buckets, size), size
+
+
+def minmax_indices(y, n_buckets):
+    """Indices of the minimum and maximum of y in each of n_buckets equal index
+    buckets (plus both end points), in increasing order. Drawing only these
+    samples gives the same picture as the full trace at n_buckets pixels."""
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    buckets, size = _buckets(y, n_buckets)
+    nan = np.isnan(buckets)
+    offsets = np.arange(n_buckets) * size
+    lo = np.where(nan, np.inf, buckets).argmin(axis=1) + offsets
+    hi = np.where(nan, -np.inf, buckets).argmax(axis=1) + offsets
+    return np.unique(np.clip(np.concatenate(([0, n - 1], lo, hi)), 0, n - 1))
+
+
+def plot(ax, x, y, *args, dpi=SAVE_DPI, **kwargs):
+    """ax.plot of a trace decimated to the pixel width of ax (min/max bucketing,
+    see n_buckets). Short traces are drawn as is."""
+    x, y = np.asarray(x), np.asarray(y)
+    buckets = n_buckets(ax, x, dpi)
+    if len(y) > 2 * buckets:
+        idx = minmax_indices(y, buckets)
+        x, y = x[idx], y[idx]
+    return ax.plot(x, y, *args, **kwargs)
+
+
+def fill_between(ax, x, lower, upper, dpi=SAVE_DPI, **kwargs):
+    """ax.fill_between of a band decimated to the pixel width of ax, keeping the
+    min/max samples of both edges (see plot)."""
+    x, lower, upper = np.asarray(x), np.asarray(lower), np.asarray(upper)
+    buckets = n_buckets(ax, x, dpi)
+    if len(x) > 2 * buckets:
+        idx = np.union1d(minmax_indices(lower, buckets), minmax_indices(upper, buckets))
+        x, lower, upper = x[idx], lower[idx], upper[idx]
+    return ax.fill_between(x, lower, upper, **kwargs)
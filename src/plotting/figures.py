@@ -0,0 +1,93 @@
+import tracemalloc
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+# Managers of the enclosing figure_batch blocks, innermost last
+_active = []
+
+
+class FigureManager:
+    """Hands out figures for a batch of plots and releases them deterministically.
+
+    One figure is kept per layout (rows, columns, size, dpi). Asking for the same
+    layout again clears and reuses it: its axes are cleared in place (and put
+    back if the previous plot deleted some), unless the previous plot added
+    axes of its own (twin axes, colorbars), in which case they are re-created. close()
+    removes every figure from pyplot's registry, so memory no longer grows with
+    the number of plots in a batch.
+    """
+
+    def __init__(self, track_memory=False):
+        self._figures = {}
+        self.track_memory = track_memory
+        self.peak_mb = None
+        self.n_plots = 0
+        self.n_figures = 0
+
+    def subplots(self, nrows=1, ncols=1, figsize=None, dpi=None, subplot_kw=None):
+        """plt.subplots for the standard layouts, reusing the figure of the layout."""
+        key = (nrows, ncols, tuple(figsize) if figsize is not None else None, dpi,
+               tuple(sorted((subplot_kw or {}).items())))
+        self.n_plots += 1
+        if key in self._figures:
+            fig, axes = self._figures[key]
+            plt.figure(fig.number)
+            flat = list(np.atleast_1d(axes).flat)
+            if all(ax in flat for ax in fig.axes) and not fig.legends and not fig.texts:
+                for ax in flat:
+                    if ax not in fig.axes:
+                        fig.add_axes(ax)
+                    ax.clear()
+                return fig, axes
+            fig.clf()
+        else:
+            fig = plt.figure(figsize=figsize, dpi=dpi)
+            self.n_figures += 1
+        axes = fig.subplots(nrows, ncols, subplot_kw=subplot_kw)
+        self._figures[key] = (fig, axes)
+        return fig, axes
+
+    def close(self):
+        for fig, _ in self._figures.values():
+            plt.close(fig)
+        self._figures.clear()
+
+    def __enter__(self):
+        if self.track_memory:
+            tracemalloc.start()
+        _active.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _active.remove(self)
+        self.close()
+        if self.track_memory:
+            self.peak_mb = tracemalloc.get_traced_memory()[1] / 1e6
+            tracemalloc.stop()
+        return False
+
+    def report(self):
+        """One line summary of the batch: plots drawn, figures used and peak memory."""
+        peak = f", peak memory {self.peak_mb:.1f} MB" if self.peak_mb is not None else ""
+        return f"{self.n_plots} plots on {self.n_figures} figures{peak}"
+
+
+def figure_batch(track_memory=False):
+    """Context in which the plotting functions reuse one figure per layout, all
+    closed on exit. track_memory traces the peak memory of the block (tracemalloc,
+    which slows it down), e.g.
+
+        with figure_batch(track_memory=True) as figures:
+            antenna_time_plot(...)
+            elytra_time_plot(...)
+        print(figures.report())
+    """
+    return FigureManager(track_memory)
+
+
+def subplots(nrows=1, ncols=1, figsize=None, dpi=None, subplot_kw=None):
+    """plt.subplots, served by the innermost figure_batch when there is one."""
+    if _active:
+        return _active[-1].subplots(nrows, ncols, figsize=figsize, dpi=dpi, subplot_kw=subplot_kw)
+    return plt.subplots(nrows, ncols, figsize=figsize, dpi=dpi, subplot_kw=subplot_kw)
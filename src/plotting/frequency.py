@@ -3,11 +3,16 @@ import numpy as np
 from pathlib import Path 
 from scipy import stats
 
+from . import decimate
+from .figures import subplots
+from ..dose_response import fit_linear, group_table, predict
+from ..windows import WINDOW
+
 FIG_DIR = Path(__file__).resolve().parents[2] / "outputs" / "figures"
 FIG_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def get_max_values(lateral_vel, fwd_vel, body_angle, ang_vel):
+def get_max_values(lateral_vel, fwd_vel, body_angle, ang_vel, window=WINDOW):
 
 
     #fig, axes = plt.subplots(len(4), 1, figsize=(12, 25), sharex=True)
@@ -25,25 +30,33 @@ def get_max_values(lateral_vel, fwd_vel, body_angle, ang_vel):
     for unit, dict in zip(all_measures, max_induced_dicts): 
         for key, value in unit.items():
             for list in value: 
-                during_stim = list[int(0.15/1.15*len(list)):int(0.65/1.15*len(list))]
+                during_stim = list[window.stim_slice(len(list))]
                 if key not in dict: 
                     dict[key]  = []
+                # Peaks are stored as plain floats so they serialise directly
                 if key[0] == "Right":           
-                    dict[key].append(min(during_stim)) 
+                    dict[key].append(float(np.min(during_stim))) 
                 elif key[0] == "Left": 
-                    dict[key].append(max(during_stim))
+                    dict[key].append(float(np.max(during_stim)))
                 elif key[0] == "Both":
                     if dict is fwd_vel_max:
-                        dict[key].append(abs(max(during_stim)))
+                        dict[key].append(float(abs(np.max(during_stim))))
                     else:
-                        dict[key].append(max(during_stim, key=abs))
+                        dict[key].append(float(during_stim[np.argmax(np.abs(during_stim))]))
 
     return lateral_max, fwd_vel_max, body_angle_max, ang_vel_max
 
 
+def _boxplot(ax, box_data, positions, widths):
+    # Boxes from raw values, or from precomputed boxplot statistics (see aggregates)
+    if all(isinstance(data, dict) for data in box_data):
+        return ax.bxp(box_data, positions=positions, patch_artist=True, widths=widths)
+    return ax.boxplot(box_data, positions=positions, patch_artist=True, widths=widths)
+
+
 def frequency_plot(data_dict, frequencies, title, save=False, suffix=""):
     # Create a single figure for the boxplot
-    fig, ax = plt.subplots(figsize=(12, 8))
+    fig, ax = subplots(figsize=(12, 8))
 
     # Prepare data for boxplots
     box_data = []       # Combined data for all frequencies
@@ -66,7 +79,7 @@ def frequency_plot(data_dict, frequencies, title, save=False, suffix=""):
             colors.append("green")   # Color for "Left"
 
     # Plot the boxplots
-    boxplots = ax.boxplot(box_data, positions=positions, patch_artist=True, widths = 3.5)
+    boxplots = _boxplot(ax, box_data, positions, widths=3.5)
     ax.axhline(y = 0, color = 'black', linestyle = '--', linewidth = 2)
     # Customize boxplot colors
     for patch, color in zip(boxplots['boxes'], colors):
@@ -103,7 +116,7 @@ def frequency_plot(data_dict, frequencies, title, save=False, suffix=""):
 
 
 def frequency_plot_elytra(data_dict, frequencies, title, save=False, suffix=""):
-    fig, ax = plt.subplots(figsize=(12, 8))
+    fig, ax = subplots(figsize=(12, 8))
 
     box_data = []
     positions = []
@@ -122,7 +135,7 @@ def frequency_plot_elytra(data_dict, frequencies, title, save=False, suffix=""):
         return
 
     # Plot boxplots
-    boxplots = ax.boxplot(box_data, positions=positions, patch_artist=True, widths=5)
+    boxplots = _boxplot(ax, box_data, positions, widths=5)
 
     # Customize colors
     for patch, color in zip(boxplots['boxes'], colors):
@@ -159,10 +172,8 @@ def frequency_scatter_regression(data_dict, frequencies, title):
     import matplotlib.pyplot as plt
     import numpy as np
 
-    fig, ax = plt.subplots(figsize=(12, 8))
+    fig, ax = subplots(figsize=(12, 8))
     color_map = {'Right': 'red', 'Left': 'green'}
-    side_data = {'Right': {'freqs': [], 'vals': []},
-                 'Left': {'freqs': [], 'vals': []}}
     
     for freq in frequencies:
         for side in ("Right", "Left"):
@@ -172,25 +183,19 @@ def frequency_scatter_regression(data_dict, frequencies, title):
                 jitter = np.random.normal(0, 0.6, size=len(vals))
                 jittered = [freq+j for j in jitter]
                 ax.scatter(jittered, vals, color=color_map[side], alpha=0.7, s=60, edgecolor='k', label=side if freq==frequencies[0] else "")
-                side_data[side]['freqs'].extend([freq]*len(vals))
-                side_data[side]['vals'].extend(vals)
     
-    # Regression per side, with equation and R^2 printouts
+    # Regression of both sides in one batched fit, with equation and R^2 printouts
+    groups, freqs, n, s1, s2 = group_table({"all": {"values": data_dict}}, ("values",), frequencies,
+                                           sides=("Right", "Left"))
+    fit = fit_linear(freqs, n, s1, s2)
+    rows = {side: g for g, (_, side, _) in enumerate(groups)}
     for side in ("Right", "Left"):
-        xs = np.array(side_data[side]['freqs'])
-        ys = np.array(side_data[side]['vals'])
-        if len(xs) > 1:
-            coeffs = np.polyfit(xs, ys, 1)
-            y_pred = np.polyval(coeffs, xs)
-            # R^2 calculation
-            ss_res = np.sum((ys - y_pred) ** 2)
-            ss_tot = np.sum((ys - np.mean(ys)) ** 2)
-            r2 = 1 - ss_res / ss_tot if ss_tot > 0 else float('nan')
-            # Print equation and R^2
-            print(f"{side} Regression: y = {coeffs[0]:.4f}x + {coeffs[1]:.4f}, R^2 = {r2:.4f}")
-            reg_x = np.linspace(min(frequencies), max(frequencies), 100)
-            reg_y = np.polyval(coeffs, reg_x)
-            ax.plot(reg_x, reg_y, color=color_map[side], lw=3, label=f"{side} Regression")
+        if side not in rows or np.isnan(fit["params"][rows[side], 1]):
+            continue
+        intercept, slope = fit["params"][rows[side]]
+        print(f"{side} Regression: y = {slope:.4f}x + {intercept:.4f}, R^2 = {fit['r2'][rows[side]]:.4f}")
+        reg_x = np.linspace(min(frequencies), max(frequencies), 100)
+        decimate.plot(ax, reg_x, intercept + slope * reg_x, color=color_map[side], lw=3, label=f"{side} Regression")
         
     ax.set_xticks(frequencies)
     ax.set_xticklabels(frequencies, fontsize=14)
@@ -216,14 +221,19 @@ def all_roach_mean_std_plot(
     title="Average angular velocity (deg/s)",
     save=False,
     suffix="",
+    fits=None,
+    model="hill",
 ):
     """
     angles_dict_all: dict[(direction, freq)] -> sequence of values, pooled across roaches
     results: dict[roach_id]["angles_max"] with same key structure
     frequencies: iterable of frequencies
+    fits: dose_response.fit_dose_response table fitted with magnitude=True (the
+          means are of |values|); each roach's fitted model curve is drawn
+          (dotted) next to its means
     """
 
-    fig, ax = plt.subplots(figsize=(9, 6), dpi=300)
+    fig, ax = subplots(figsize=(9, 6), dpi=300)
 
     directions = ["Right", "Left"]
     dir_colors = {"Right": "black", "Left": "black"}
@@ -298,7 +308,8 @@ def all_roach_mean_std_plot(
         x = np.array(x)
         means = np.array(means)
 
-        ax.plot(
+        decimate.plot(
+            ax,
             x,
             means,
             "--",
@@ -307,6 +318,12 @@ def all_roach_mean_std_plot(
             label=f"{roach_id} {direction}",
         )
 
+        if fits is not None:
+            grid = np.linspace(min(freqs), max(freqs), 100)
+            curve = predict(fits, roach_id, direction, "angles_max", model, grid)
+            if np.isfinite(curve).any():
+                decimate.plot(ax, grid, curve, ":", color=r_color, linewidth=1.5)
+
     # ---------- 3) AXIS / STYLING ----------
     # ax.axhline(y=0, color="black", linestyle="--", linewidth=2)
 
@@ -349,14 +366,19 @@ def all_roach_cerci_plot(
     title="Average angular velocity (deg/s)",
     save=False,
     suffix="",
+    fits=None,
+    model="hill",
     ):
     """
     angles_dict_all: dict[(direction, freq)] -> sequence of values, pooled across roaches
-    results: dict[roach_id]["angles_max"] with same key structure
+    results: dict[roach_id]["fwd_max"] with same key structure
     frequencies: iterable of frequencies
+    fits: dose_response.fit_dose_response table fitted with magnitude=True (the
+          means are of |values|); each roach's fitted model curve is drawn
+          (dotted) next to its means
     """
 
-    fig, ax = plt.subplots(figsize=(9, 6))
+    fig, ax = subplots(figsize=(9, 6))
 
     directions = ["Both"]
     dir_colors = {"Both": "black"}
@@ -431,7 +453,8 @@ def all_roach_cerci_plot(
         x = np.array(x)
         means = np.array(means)
 
-        ax.plot(
+        decimate.plot(
+            ax,
             x,
             means,
             "--",
@@ -440,6 +463,12 @@ def all_roach_cerci_plot(
             label=f"{roach_id} {direction}",
         )
 
+        if fits is not None:
+            grid = np.linspace(min(freqs), max(freqs), 100)
+            curve = predict(fits, roach_id, direction, "fwd_max", model, grid)
+            if np.isfinite(curve).any():
+                decimate.plot(ax, grid, curve, ":", color=r_color, linewidth=1.5)
+
     # ---------- 3) AXIS / STYLING ----------
     # ax.axhline(y=0, color="black", linestyle="--", linewidth=2)
 
@@ -0,0 +1,96 @@
+import matplotlib.pyplot as plt
+import numpy as np
+from pathlib import Path
+
+from .figures import subplots
+
+FIG_DIR = Path(__file__).resolve().parents[2] / "outputs" / "figures"
+FIG_DIR.mkdir(parents=True, exist_ok=True)
+
+SIDE_COLORS = {"Right": "red", "Left": "green", "Both": "blue"}
+
+
+def _polar_axes(ax):
+    # Straight ahead at the top, positive (left) turns counter-clockwise
+    ax.set_theta_zero_location("N")
+    ax.set_theta_direction(1)
+    ax.set_thetagrids(range(0, 360, 45), ["0°", "45°", "90°", "135°", "±180°", "-135°", "-90°", "-45°"])
+
+
+def polar_histogram(ax, stats, color, label=None, density=True):
+    """Draws one precomputed angular histogram (an entry of
+    circular.circular_summary) as a single bar call on a polar axes, with its
+    mean resultant vector scaled to the tallest bar."""
+    counts = np.asarray(stats["counts"], dtype=np.float64)
+    if density and counts.sum() > 0:
+        counts = counts / counts.sum()
+    edges = np.radians(stats["edges"])
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align="edge", color=color, alpha=0.35,
+           edgecolor=color, linewidth=0.5, label=label)
+    if stats["n"] > 0:
+        ax.annotate("", xy=(np.radians(stats["mean"]), stats["R"] * counts.max()), xytext=(0, 0),
+                    arrowprops=dict(arrowstyle="->", color=color, linewidth=2))
+
+
+def heading_polar_plot(summary, frequencies, cohort="all", sides=("Right", "Left"), save=False, suffix=""):
+    """Heading histograms of one cohort per frequency (2x3 grid of polar axes),
+    the sides overlaid with their mean vectors. summary is the output of
+    circular.circular_summary."""
+    fig, axes = subplots(2, 3, figsize=(12, 8), subplot_kw={"projection": "polar"})
+    axes_flat = axes.flatten()
+
+    for idx, freq in enumerate(frequencies):
+        ax = axes_flat[idx]
+        _polar_axes(ax)
+        lines = []
+        for side in sides:
+            stats = summary.get((side, freq, cohort))
+            if stats is None or stats["n"] == 0:
+                continue
+            polar_histogram(ax, stats, SIDE_COLORS.get(side, "grey"), label=f"{side} Stimulation")
+            lines.append(f"{side}: R={stats['R']:.2f}, p={stats['p']:.2g}")
+
+        if not lines:
+            ax.set_title(f'Freq: {freq} Hz (No Data)', fontsize=18)
+            continue
+        ax.set_title(f'Freq: {freq} Hz', fontsize=18)
+        ax.set_xlabel("\n".join(lines), fontsize=11)
+        ax.set_yticklabels([])
+        if freq == 10:
+            ax.legend(fontsize=10, loc="upper right", bbox_to_anchor=(1.35, 1.15))
+
+    if len(frequencies) < len(axes_flat):
+        for i in range(len(frequencies), len(axes_flat)):
+            fig.delaxes(axes_flat[i])
+
+    plt.tight_layout(h_pad=0.35)
+    if save:
+        fname = f"heading_polar_plot_{cohort}{suffix}.png"
+        fig.savefig(FIG_DIR / fname, dpi=300, bbox_inches="tight")
+
+
+def mean_vector_plot(summary, frequencies, side, save=False, suffix=""):
+    """Mean heading vector (direction and resultant length R) of every cohort at
+    every frequency for one stimulation side, on a single polar axes."""
+    fig, ax = subplots(figsize=(8, 8), subplot_kw={"projection": "polar"})
+    _polar_axes(ax)
+
+    cmap = plt.get_cmap("viridis", len(frequencies))
+    for idx, freq in enumerate(frequencies):
+        entries = [stats for (s, f, _), stats in summary.items() if s == side and f == freq and stats["n"] > 0]
+        if not entries:
+            continue
+        theta = np.radians([stats["mean"] for stats in entries])
+        R = np.array([stats["R"] for stats in entries])
+        # One segment per cohort from the origin, drawn in a single call
+        ax.plot(np.column_stack((theta, theta)).T, np.column_stack((np.zeros_like(R), R)).T,
+                color=cmap(idx), linewidth=1.5)
+        ax.scatter(theta, R, color=cmap(idx), s=25, label=f"{freq} Hz")
+
+    ax.set_ylim(0, 1)
+    ax.set_title(f"Mean heading per cohort - {side} Stimulation", fontsize=16)
+    ax.legend(fontsize=11, loc="upper right", bbox_to_anchor=(1.2, 1.1))
+    plt.tight_layout()
+    if save:
+        fname = f"mean_vector_plot_{side}{suffix}.png"
+        fig.savefig(FIG_DIR / fname, dpi=300, bbox_inches="tight")
@@ -1,41 +1,155 @@
+import warnings
+
 import matplotlib.pyplot as plt
 import numpy as np 
 from pathlib import Path 
 
+from ..alignment import trial_matrix, realign_trials
+from ..windows import WINDOW
+from . import decimate
+from .figures import subplots
+
 FIG_DIR = Path(__file__).resolve().parents[2] / "outputs" / "figures"
 FIG_DIR.mkdir(parents=True, exist_ok=True)
 
 
-def resample_1d_list(original_list, new_len):
-    # Remove invalid (non-float) entries
-    filtered = [x for x in original_list if isinstance(x, (float, int, np.float32, np.float64))]
-    old_len = len(filtered)
-    if old_len == 0:
-        # Return a list of np.nan if no valid numbers remain
-        return [np.nan] * new_len
-    if old_len == 1:
-        return [filtered] * new_len
-    old_idx = np.linspace(0, 1, old_len)
-    new_idx = np.linspace(0, 1, new_len)
-    return np.interp(new_idx, old_idx, filtered).tolist()
+def _key_times(times, key):
+    # Timestamps of one key's trials, or None to stretch by index
+    return None if times is None else times.get(key)
+
 
+def _trial_x(trial, times, key, i, window=WINDOW):
+    # x positions of one trial: its timestamps if known, otherwise stretched over the window
+    if times is None or key not in times:
+        return np.linspace(0, window.duration, len(trial))
+    t = np.asarray(times[key][i])
+    return t[len(t) - len(trial):] + window.pre
 
-def antenna_time_plot(data_dict, frequencies, title, save = False, suffix = ""):
 
-    fig, axes = plt.subplots(2, 3, figsize=(12, 8))
+def process_list(data, times=None, window=WINDOW, realign=False):
+    """Mean and +/- one std band of a list of trials.
 
-    def process_list(data):
-        data = np.array(data, dtype=object)
-        max_len = max(len(sublist) for sublist in data)
+    Without timestamps the trials are stretched to the longest trial over the
+    window (0 - window.duration s). With their window timestamps (relative to
+    the stimulation, see alignment.trial_times) they are interpolated onto a
+    shared time grid, so dropped frames and different frame rates line up.
+    If realign, every trial is shifted onto the mean trial by cross-correlation
+    first (see alignment.realign_trials). data can also be a precomputed
+    aggregate curve (see aggregates), which is used as is.
 
-        resampled_data = np.array([
-        resample_1d_list(sublist, max_len) for sublist in data
-            ], dtype=float)
+    Returns:
+        tuple: (x, means, lower, upper)
+    """
+    if isinstance(data, dict):
+        return data["x"], data["mean"], data["mean"] - data["std"], data["mean"] + data["std"]
+
+    x, resampled_data = trial_matrix(data, times, window=window)
+    if realign and len(x) > 1:
+        resampled_data, _ = realign_trials(resampled_data, x[1] - x[0])
+    with warnings.catch_warnings():
+        # Grid points outside every trial are all-NaN columns
+        warnings.simplefilter("ignore", RuntimeWarning)
         means = np.nanmean(resampled_data, axis=0)
         stds = np.nanstd(resampled_data, axis=0)
-        lower = means - stds     # One std dev below the mean
-        upper = means + stds     # One std dev above the mean
-        return max_len, means, lower, upper
+    lower = means - stds     # One std dev below the mean
+    upper = means + stds     # One std dev above the mean
+    return x, means, lower, upper
+
+
+def _raster_trials_plot(data_dict, frequencies, title, groups, times=None, window=WINDOW):
+    # Draws every panel of a trials plot as one sorted heatmap (rows are trials,
+    # grouped per side and sorted by their mean during the stimulation window)
+    # with the mean of each group overlaid on a twin axis, so the cost per panel
+    # does not depend on the number of trials. groups: [(side, color, label)].
+    panels = {}
+    for freq in frequencies:
+        keys = [(side, freq) for side, _, _ in groups]
+        lists = [data_dict.get(key, []) for key in keys]
+        if not any(len(lst) > 0 for lst in lists):
+            continue
+        traces = [trace for lst in lists for trace in lst]
+        key_times = [_key_times(times, key) for key, lst in zip(keys, lists) if len(lst) > 0]
+        trace_times = None if any(t is None for t in key_times) else [t for kt in key_times for t in kt]
+        x, matrix = trial_matrix(traces, trace_times, window=window)
+        panels[freq] = (x, np.split(matrix, np.cumsum([len(lst) for lst in lists])[:-1]))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        # One symmetric color scale for all panels
+        values = [np.abs(matrix) for _, blocks in panels.values() for matrix in blocks if len(matrix)]
+        vlim = np.nanpercentile(np.concatenate([v.ravel() for v in values]), 99) if values else 1.0
+
+    cmap = plt.get_cmap("coolwarm").copy()
+    cmap.set_bad("white")
+
+    fig, axes = subplots(2, 3, figsize=(12, 8))
+    axes_flat = axes.flatten()
+    image = None
+    for idx, freq in enumerate(frequencies):
+        ax = axes_flat[idx]
+        ax.set_xlim(0, 1.05)
+        ax.spines['top'].set_visible(False)
+        if freq not in panels:
+            ax.set_title(f'Freq: {freq} Hz (No Data)', fontsize=18)
+            ax.set_ylabel(title, fontsize=16)
+            continue
+
+        x, blocks = panels[freq]
+        in_window = window.stim_mask(x)
+        rows = []
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            for block in blocks:
+                rows.append(block[np.argsort(np.nanmean(block[:, in_window], axis=1))])
+        matrix = np.vstack(rows)
+
+        dx = (x[-1] - x[0]) / max(len(x) - 1, 1)
+        image = ax.imshow(matrix, aspect="auto", origin="lower", interpolation="nearest", cmap=cmap,
+                          vmin=-vlim, vmax=vlim, extent=(x[0] - dx / 2, x[-1] + dx / 2, 0, len(matrix)))
+
+        # Group boundaries and the mean of each group on the measure's scale
+        twin = ax.twinx()
+        start = 0
+        for block, (side, color, label) in zip(blocks, groups):
+            if len(block) == 0:
+                continue
+            if start:
+                ax.axhline(y=start, color='black', linewidth=1)
+            start += len(block)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                decimate.plot(twin, x, np.nanmean(block, axis=0), color=color, linewidth=2, label=label)
+        # Same scale as the colorbar, which carries the label
+        twin.set_ylim(-vlim, vlim)
+
+        ax.set_title(f'Freq: {freq} Hz', fontsize=18)
+        ax.set_ylabel('Trial', fontsize=16)
+        ax.set_xlim(0, 1.05)
+        if freq == 10:
+            twin.legend(fontsize=12)
+
+    if len(frequencies) < len(axes_flat):
+        for i in range(len(frequencies), len(axes_flat)):
+            fig.delaxes(axes_flat[i])
+
+    for i in range(len(axes_flat)):
+        if i >= len(axes_flat) - 3:
+            axes_flat[i].set_xlabel('Time (s)', fontsize=20)
+            xtick_positions = np.arange(0, 1.05, 0.2)
+            axes_flat[i].set_xticks(xtick_positions)
+            axes_flat[i].set_xticklabels([f"{tick:.1f}" for tick in xtick_positions])
+
+    plt.tight_layout(h_pad=0.35)
+    if image is not None:
+        fig.colorbar(image, ax=[ax for ax in axes_flat if ax in fig.axes], shrink=0.6, label=title)
+    return fig
+
+
+def antenna_time_plot(data_dict, frequencies, title, save = False, suffix = "", times=None, window=WINDOW,
+                      realign=False):
+
+    fig, axes = subplots(2, 3, figsize=(12, 8))
+
 
     axes_flat = axes.flatten()
 
@@ -59,22 +173,20 @@ def antenna_time_plot(data_dict, frequencies, title, save = False, suffix = ""):
     
         # Only process and plot if data exists
         if len(list1) > 0:
-            max_len1, medians1, lower_quartiles1, upper_quartiles1 = process_list(list1)
-            x1 = np.linspace(0, 1.25, max_len1)
-            mask1 = (x1 >= 0.15) & (x1 <= 0.65)
-            ax.fill_between(x1, lower_quartiles1, upper_quartiles1, color='lightgrey', alpha=0.3)
-            ax.plot(x1, medians1, color='black', linewidth=2)
-            ax.fill_between(x1[mask1], lower_quartiles1[mask1], upper_quartiles1[mask1], color='lightcoral', alpha=0.3)
-            ax.plot(x1[mask1], medians1[mask1], color='red', linewidth=2, label='Right Stimulation')
+            x1, medians1, lower_quartiles1, upper_quartiles1 = process_list(list1, _key_times(times, ("Right", freq)), window, realign)
+            mask1 = window.stim_mask(x1)
+            decimate.fill_between(ax, x1, lower_quartiles1, upper_quartiles1, color='lightgrey', alpha=0.3)
+            decimate.plot(ax, x1, medians1, color='black', linewidth=2)
+            decimate.fill_between(ax, x1[mask1], lower_quartiles1[mask1], upper_quartiles1[mask1], color='lightcoral', alpha=0.3)
+            decimate.plot(ax, x1[mask1], medians1[mask1], color='red', linewidth=2, label='Right Stimulation')
 
         if len(list2) > 0:
-            max_len2, medians2, lower_quartiles2, upper_quartiles2 = process_list(list2)
-            x2 = np.linspace(0, 1.25, max_len2)
-            mask2 = (x2 >= 0.15) & (x2 <= 0.65)
-            ax.fill_between(x2, lower_quartiles2, upper_quartiles2, color='lightgrey', alpha=0.3)
-            ax.plot(x2, medians2, color='black', linewidth=2)
-            ax.fill_between(x2[mask2], lower_quartiles2[mask2], upper_quartiles2[mask2], color='lightgreen', alpha=0.3)
-            ax.plot(x2[mask2], medians2[mask2], color='green', linewidth=2, label='Left Stimulation')
+            x2, medians2, lower_quartiles2, upper_quartiles2 = process_list(list2, _key_times(times, ("Left", freq)), window, realign)
+            mask2 = window.stim_mask(x2)
+            decimate.fill_between(ax, x2, lower_quartiles2, upper_quartiles2, color='lightgrey', alpha=0.3)
+            decimate.plot(ax, x2, medians2, color='black', linewidth=2)
+            decimate.fill_between(ax, x2[mask2], lower_quartiles2[mask2], upper_quartiles2[mask2], color='lightgreen', alpha=0.3)
+            decimate.plot(ax, x2[mask2], medians2[mask2], color='green', linewidth=2, label='Left Stimulation')
 
             
 
@@ -113,22 +225,10 @@ def antenna_time_plot(data_dict, frequencies, title, save = False, suffix = ""):
 
 
 
-def elytra_time_plot(data_dict, frequencies, title, save=False, suffix=""):
-
-    fig, axes = plt.subplots(2, 3, figsize=(12, 8))
+def elytra_time_plot(data_dict, frequencies, title, save=False, suffix="", times=None, window=WINDOW, realign=False):
 
-    def process_list(data):
-            data = np.array(data, dtype=object)
-            max_len = max(len(sublist) for sublist in data)
+    fig, axes = subplots(2, 3, figsize=(12, 8))
 
-            resampled_data = np.array([
-            resample_1d_list(sublist, max_len) for sublist in data
-                ], dtype=float)
-            means = np.nanmean(resampled_data, axis=0)
-            stds = np.nanstd(resampled_data, axis=0)
-            lower = means - stds     # One std dev below the mean
-            upper = means + stds     # One std dev above the mean
-            return max_len, means, lower, upper
 
     axes_flat = axes.flatten()
     for idx, freq in enumerate(frequencies):
@@ -148,18 +248,17 @@ def elytra_time_plot(data_dict, frequencies, title, save=False, suffix=""):
             continue
 
         if len(list1) > 0: 
-            max_len1, medians1, lower_quartiles1, upper_quartiles1 = process_list(list1)
+            x, medians1, lower_quartiles1, upper_quartiles1 = process_list(list1, _key_times(times, ("Both", freq)), window, realign)
 
-            x = np.linspace(0, 1.25, max_len1)
-            mask = (x >= 0.1) & (x <= 0.6)
+            mask = window.stim_mask(x)
 
             # Right stimulation plot
-            ax.fill_between(x[:len(medians1)], lower_quartiles1, upper_quartiles1,
+            decimate.fill_between(ax, x[:len(medians1)], lower_quartiles1, upper_quartiles1,
                             color='lightgrey', alpha=0.3)
-            ax.plot(x[:len(medians1)], medians1, color='black', linewidth=2)
-            ax.fill_between(x[:len(medians1)][mask], lower_quartiles1[mask], upper_quartiles1[mask],
+            decimate.plot(ax, x[:len(medians1)], medians1, color='black', linewidth=2)
+            decimate.fill_between(ax, x[:len(medians1)][mask], lower_quartiles1[mask], upper_quartiles1[mask],
                             color='lightcoral', alpha=0.3)
-            ax.plot(x[:len(medians1)][mask], medians1[mask],
+            decimate.plot(ax, x[:len(medians1)][mask], medians1[mask],
                     color='red', linewidth=2, label='Both Elytra Stimulation')
 
         # Formatting subplot
@@ -192,21 +291,9 @@ def elytra_time_plot(data_dict, frequencies, title, save=False, suffix=""):
         fig.savefig(FIG_DIR / fname, dpi=300, bbox_inches="tight")
 
 
-def antenna_time_plot_single(data_dict, frequency, title, save=False, suffix=""):
-    fig, ax = plt.subplots(figsize=(9, 6), dpi=100)
+def antenna_time_plot_single(data_dict, frequency, title, save=False, suffix="", times=None, window=WINDOW):
+    fig, ax = subplots(figsize=(9, 6), dpi=100)
 
-    def process_list(data):
-        data = np.array(data, dtype=object)
-        max_len = max(len(sublist) for sublist in data)
-
-        resampled_data = np.array([
-        resample_1d_list(sublist, max_len) for sublist in data
-            ], dtype=float)
-        means = np.nanmean(resampled_data, axis=0)
-        stds = np.nanstd(resampled_data, axis=0)
-        lower = means - stds     # One std dev below the mean
-        upper = means + stds     # One std dev above the mean
-        return max_len, means, lower, upper
 
     
     # Use .get() with default empty list if key not found
@@ -222,30 +309,30 @@ def antenna_time_plot_single(data_dict, frequency, title, save=False, suffix="")
         plt.show()
         return
 
-    max_len1, medians1, lower_quartiles1, upper_quartiles1 = process_list(list1)
-    max_len2, medians2, lower_quartiles2, upper_quartiles2 = process_list(list2)
+    x1, medians1, lower_quartiles1, upper_quartiles1 = process_list(list1, _key_times(times, ("Right", frequency)), window)
+    x2, medians2, lower_quartiles2, upper_quartiles2 = process_list(list2, _key_times(times, ("Left", frequency)), window)
 
-    x = np.linspace(0, 1.25, max(max_len1, max_len2))
-    mask = (x >= 0.15) & (x <= 0.65)
+    mask1 = window.stim_mask(x1)
+    mask2 = window.stim_mask(x2)
 
     # Right stimulation plot
-    ax.fill_between(x[:len(medians1)], lower_quartiles1, upper_quartiles1,
+    decimate.fill_between(ax, x1, lower_quartiles1, upper_quartiles1,
                     color='darkgrey', alpha=0.3)
-    ax.plot(x[:len(medians1)], medians1, color='black', linewidth=2)
-    ax.fill_between(x[:len(medians1)][mask], lower_quartiles1[mask], upper_quartiles1[mask],
+    decimate.plot(ax, x1, medians1, color='black', linewidth=2)
+    decimate.fill_between(ax, x1[mask1], lower_quartiles1[mask1], upper_quartiles1[mask1],
                     color='lightcoral', alpha=0.3)
-    ax.plot(x[:len(medians1)][mask], medians1[mask],
+    decimate.plot(ax, x1[mask1], medians1[mask1],
             color='red', linewidth=2, label='Right Stim - Inv')
 
     # Left stimulation plot
-    ax.fill_between(x[:len(medians2)], lower_quartiles2, upper_quartiles2,
+    decimate.fill_between(ax, x2, lower_quartiles2, upper_quartiles2,
                     color='darkgrey', alpha=0.3)
-    ax.plot(x[:len(medians2)], medians2,
+    decimate.plot(ax, x2, medians2,
             color='black', linewidth=2)
     
-    ax.fill_between(x[:len(medians2)][mask], lower_quartiles2[mask], upper_quartiles2[mask],
+    decimate.fill_between(ax, x2[mask2], lower_quartiles2[mask2], upper_quartiles2[mask2],
                     color='lightgreen', alpha=0.3)
-    ax.plot(x[:len(medians2)][mask], medians2[mask],
+    decimate.plot(ax, x2[mask2], medians2[mask2],
             color='green', linewidth=2, label='Left Stim - Inv')
 
     # ax.set_title(f'Freq: {frequency} Hz', fontsize=18)
@@ -269,21 +356,9 @@ def antenna_time_plot_single(data_dict, frequency, title, save=False, suffix="")
         fig.savefig(FIG_DIR / fname, dpi=300, bbox_inches="tight")
 
 
-def elytra_time_plot_single(data_dict, frequency, title, save=False, suffix=""):
-    fig, ax = plt.subplots(figsize=(9, 6), dpi=100)
+def elytra_time_plot_single(data_dict, frequency, title, save=False, suffix="", times=None, window=WINDOW):
+    fig, ax = subplots(figsize=(9, 6), dpi=100)
 
-    def process_list(data):
-        data = np.array(data, dtype=object)
-        max_len = max(len(sublist) for sublist in data)
-
-        resampled_data = np.array([
-        resample_1d_list(sublist, max_len) for sublist in data
-            ], dtype=float)
-        means = np.nanmean(resampled_data, axis=0)
-        stds = np.nanstd(resampled_data, axis=0)
-        lower = means - stds     # One std dev below the mean
-        upper = means + stds     # One std dev above the mean
-        return max_len, means, lower, upper
 
     # Use .get() with default empty list if key not found
     list1 = data_dict.get(("Both", frequency), [])
@@ -297,18 +372,16 @@ def elytra_time_plot_single(data_dict, frequency, title, save=False, suffix=""):
         plt.show()
         return
 
-    max_len1, medians1, lower_quartiles1, upper_quartiles1 = process_list(list1)
-
-    x = np.linspace(0, 1.25, max_len1)
-    mask = (x >= 0.1) & (x <= 0.6)
+    x, medians1, lower_quartiles1, upper_quartiles1 = process_list(list1, _key_times(times, ("Both", frequency)), window)
+    mask = window.stim_mask(x)
 
     # Both Elytra Stimulation plot
-    ax.fill_between(x[:len(medians1)], lower_quartiles1, upper_quartiles1,
+    decimate.fill_between(ax, x[:len(medians1)], lower_quartiles1, upper_quartiles1,
                     color='darkgrey', alpha=0.3)
-    ax.plot(x[:len(medians1)], medians1, color='black', linewidth=2)
-    ax.fill_between(x[:len(medians1)][mask], lower_quartiles1[mask], upper_quartiles1[mask],
+    decimate.plot(ax, x[:len(medians1)], medians1, color='black', linewidth=2)
+    decimate.fill_between(ax, x[:len(medians1)][mask], lower_quartiles1[mask], upper_quartiles1[mask],
                     color='lightcoral', alpha=0.3)
-    ax.plot(x[:len(medians1)][mask], medians1[mask],
+    decimate.plot(ax, x[:len(medians1)][mask], medians1[mask],
             color='red', linewidth=2, label='Both Elytra Stim.')
 
     # ax.set_title(f'Freq: {frequency} Hz', fontsize=18)
@@ -336,8 +409,19 @@ def elytra_time_plot_single(data_dict, frequency, title, save=False, suffix=""):
 
 
 
-def antenna_trials_plot(data_dict, frequencies, title, save=False, suffix=""):
-    fig, axes = plt.subplots(2, 3, figsize=(12, 8))
+def antenna_trials_plot(data_dict, frequencies, title, save=False, suffix="", times=None, mode="lines", window=WINDOW):
+    """Every Right (red) and Left (green) trial per frequency. mode="raster" draws
+    each panel as one sorted heatmap of the trials with their means overlaid,
+    which stays fast and readable with hundreds of trials."""
+    if mode == "raster":
+        fig = _raster_trials_plot(data_dict, frequencies, title,
+                                  [("Right", "red", "Right Stimulation"), ("Left", "green", "Left Stimulation")],
+                                  times, window)
+        if save:
+            fig.savefig(FIG_DIR / f"antenna_trials_raster{suffix}.png", dpi=300, bbox_inches="tight")
+        return
+
+    fig, axes = subplots(2, 3, figsize=(12, 8))
     axes_flat = axes.flatten()
 
     for idx, freq in enumerate(frequencies):
@@ -355,16 +439,16 @@ def antenna_trials_plot(data_dict, frequencies, title, save=False, suffix=""):
             continue
 
         # Plot all Right stimulation trials (red)
-        for trial in list1:
+        for i, trial in enumerate(list1):
             trial = np.array(trial)
-            x = np.linspace(0, 1.25, len(trial))
-            ax.plot(x, trial, color='red', alpha=0.5, linewidth=1, label='Right Stimulation' if 'Right Stimulation' not in ax.get_legend_handles_labels()[1] else "")
+            x = _trial_x(trial, times, ("Right", freq), i, window)
+            decimate.plot(ax, x, trial, color='red', alpha=0.5, linewidth=1, label='Right Stimulation' if 'Right Stimulation' not in ax.get_legend_handles_labels()[1] else "")
 
         # Plot all Left stimulation trials (green)
-        for trial in list2:
+        for i, trial in enumerate(list2):
             trial = np.array(trial)
-            x = np.linspace(0, 1.25, len(trial))
-            ax.plot(x, trial, color='green', alpha=0.5, linewidth=1, label='Left Stimulation' if 'Left Stimulation' not in ax.get_legend_handles_labels()[1] else "")
+            x = _trial_x(trial, times, ("Left", freq), i, window)
+            decimate.plot(ax, x, trial, color='green', alpha=0.5, linewidth=1, label='Left Stimulation' if 'Left Stimulation' not in ax.get_legend_handles_labels()[1] else "")
 
         # Formatting subplot
         ax.set_title(f'Freq: {freq} Hz', fontsize=18)
@@ -397,8 +481,16 @@ def antenna_trials_plot(data_dict, frequencies, title, save=False, suffix=""):
 
 
 
-def elytra_trials_plot(data_dict, frequencies, title, save=False, suffix=""):
-    fig, axes = plt.subplots(2, 3, figsize=(12, 8))
+def elytra_trials_plot(data_dict, frequencies, title, save=False, suffix="", times=None, mode="lines", window=WINDOW):
+    """Every Both (blue) trial per frequency, mode="raster" as in antenna_trials_plot."""
+    if mode == "raster":
+        fig = _raster_trials_plot(data_dict, frequencies, title,
+                                  [("Both", "blue", "Both Elytra Stimulation")], times, window)
+        if save:
+            fig.savefig(FIG_DIR / f"elytra_trials_raster{suffix}.png", dpi=300, bbox_inches="tight")
+        return
+
+    fig, axes = subplots(2, 3, figsize=(12, 8))
     axes_flat = axes.flatten()
 
     for idx, freq in enumerate(frequencies):
@@ -415,11 +507,11 @@ def elytra_trials_plot(data_dict, frequencies, title, save=False, suffix=""):
             continue
 
         # Plot all Both Elytra stimulation trials (blue)
-        for trial in list1:
+        for i, trial in enumerate(list1):
             trial = np.array(trial)
-            x = np.linspace(0, 1.25, len(trial))
+            x = _trial_x(trial, times, ("Both", freq), i, window)
             # Only add label to the first line for the legend
-            ax.plot(x, trial, color='blue', alpha=0.5, linewidth=1,
+            decimate.plot(ax, x, trial, color='blue', alpha=0.5, linewidth=1,
                     label='Both Elytra Stimulation' if 'Both Elytra Stimulation' not in ax.get_legend_handles_labels()[1] else "")
 
         # Formatting subplot
@@ -1,132 +1,190 @@
-import pandas as pd 
 import numpy as np 
 from scipy import stats
-import math 
+
+from .config import FLOAT_DTYPE
+from .filters import apply_filter
 
 def exp_weighted_ma(part, alpha):
     """An application of an exponential weighted moving average filter to 
     smooth data - alpha close to 1 means minimal smoothing"""
-    # Initialize empty lists to store x and y coordinates separately
-    partx = []
-    party = []
-    
-    # Separate x and y coordinates from the input list
-    for i in part: 
-        partx.append(i[0])
-        party.append(i[1])
-    
-    # Convert lists to pandas Series for easier manipulation
-    partx = pd.Series(partx)
-    party = pd.Series(party)
-    
-    # Apply exponential weighted moving average to x coordinates
-    # Round to 5 decimal places and convert back to list
-    partx = round(partx.ewm(alpha, adjust=False).mean(), 5)
-    partx = partx.tolist()
-
-    # Apply exponential weighted moving average to y coordinates
-    # Round to 5 decimal places and convert back to list
-    party = round(party.ewm(alpha, adjust=False).mean(), 5)
-    party = party.tolist()
-
-    # Combine smoothed x and y coordinates back into a single list
-    smooth_data = []
-    for i in range(len(partx)):
-        smooth_data.append([partx[i], party[i]])
-
-    # Return the smoothed data
-    return smooth_data
-
-
-def remove_outliers_and_smooth(data, alpha=0.1, z_thresh=2):
+    # Smooth x and y together, round to 5 decimal places
+    smooth_data = np.round(apply_filter(np.asarray(part, dtype=float), {"method": "ewma", "alpha": alpha}), 5)
+
+    # Return the smoothed data as [[x, y], ...]
+    return smooth_data.tolist()
+
+
+def resolve_dtype(dtype=None):
+    """Returns the numpy float dtype to use, defaulting to config.FLOAT_DTYPE."""
+    return np.dtype(FLOAT_DTYPE if dtype is None else dtype)
+
+
+def as_float_array(data, dtype=None):
+    """Converts data (array or nested lists, possibly holding None) to a contiguous
+    float array of the configured dtype, None values become NaN."""
+    return np.ascontiguousarray(np.asarray(data, dtype=resolve_dtype(dtype)))
+
+
+def fill_nans(arr):
+    """Linearly interpolates NaNs along the first axis of a 1D or 2D array, edges
+    are filled with the nearest valid value. Columns without any valid value are
+    left untouched."""
+    cols = arr.reshape(len(arr), -1)
+    for i in range(cols.shape[1]):
+        col = cols[:, i]
+        nans = np.isnan(col)
+        if nans.any() and (~nans).any():
+            col[nans] = np.interp(
+                np.flatnonzero(nans),
+                np.flatnonzero(~nans),
+                col[~nans]
+            )
+    return arr
+
+
+def fill_nans_batch(arr, axis=1):
+    """Vectorised fill_nans for a batch, e.g. an (n_trials, frames, ...) tensor:
+    NaNs along the time axis are linearly interpolated (nearest valid value at
+    the edges) for every trial and channel at once. Modifies arr in place."""
+    moved = np.moveaxis(arr, axis, -1)
+    flat = moved.reshape(-1, moved.shape[-1])
+    n_frames = flat.shape[1]
+    frames = np.arange(n_frames)
+
+    valid = ~np.isnan(flat)
+    # Previous and next valid frame of every frame
+    prev = np.maximum.accumulate(np.where(valid, frames, -1), axis=1)
+    nxt = np.minimum.accumulate(np.where(valid, frames, n_frames)[:, ::-1], axis=1)[:, ::-1]
+    has_valid = valid.any(axis=1, keepdims=True)
+    prev_i = np.where(prev < 0, nxt, prev)
+    next_i = np.where(nxt >= n_frames, prev, nxt)
+    prev_i = np.clip(prev_i, 0, n_frames - 1)
+    next_i = np.clip(next_i, 0, n_frames - 1)
+
+    rows = np.arange(flat.shape[0])[:, None]
+    lo, hi = flat[rows, prev_i], flat[rows, next_i]
+    span = np.where(next_i > prev_i, next_i - prev_i, 1)
+    filled = lo + (hi - lo) * (frames - prev_i) / span
+    flat = np.where(~valid & has_valid, filled, flat)
+
+    moved[...] = flat.reshape(moved.shape)
+    return arr
+
+
+def remove_outliers_and_smooth(data, alpha=0.1, z_thresh=2, dtype=None, filter_spec=None, fps=None):
     """
     Removes outliers from 2D data and applies EWMA smoothing.
-    - data: list of [x, y] points
+    - data: (n, 2) array (or list) of [x, y] points
     - alpha: EWMA smoothing factor (0 < alpha <= 1)
     - z_thresh: z-score threshold for outlier detection
+    - filter_spec: smoothing filter to use instead of the EWMA (see filters.apply_filter),
+      fps is then required for the non-EWMA methods
+    Returns an (n, 2) array.
     """
-    # Convert to numpy array for easier math
-    arr = np.array(data)
-    x, y = arr[:, 0], arr[:, 1]
-    
-    # Outlier detection using z-score
-    z_x = np.abs(stats.zscore(x, nan_policy='omit'))
-    z_y = np.abs(stats.zscore(y, nan_policy='omit'))
-    mask = (z_x < z_thresh) & (z_y < z_thresh)
-    
-    # Remove outliers
-    # x_clean, y_clean = x[mask], y[mask]
-    
-    # Or maybe we can replace outliers with NaN and interpolate 
-    x_clean = x.copy()
-    y_clean = y.copy()
-    x_clean[~mask] = np.nan
-    y_clean[~mask] = np.nan
-    x_clean = pd.Series(x_clean).interpolate().bfill().ffill().values
-    y_clean = pd.Series(y_clean).interpolate().bfill().ffill().values
-    
-    # Apply EWMA smoothing
-    x_smooth = pd.Series(x_clean).ewm(alpha=alpha, adjust=False).mean().values
-    y_smooth = pd.Series(y_clean).ewm(alpha=alpha, adjust=False).mean().values
-    
-    # Combine back to [x, y] pairs
-    smoothed_data = np.column_stack((x_smooth, y_smooth)).tolist()
-    return smoothed_data # mask shows which points were kept
-
-def remove_outliers_and_smooth_1d(data, alpha=0.1, z_thresh=2):
+    # Work on a float copy so the caller's array is left untouched
+    arr = np.array(data, dtype=resolve_dtype(dtype))
+
+    # Outlier detection using z-score, per coordinate
+    z = np.abs(stats.zscore(arr, axis=0, nan_policy='omit'))
+    mask = (z < z_thresh).all(axis=1)
+
+    # Replace outliers with NaN and interpolate
+    arr[~mask] = np.nan
+    fill_nans(arr)
+
+    # Smooth x and y together
+    if filter_spec is None:
+        filter_spec = {"method": "ewma", "alpha": alpha}
+    return apply_filter(arr, filter_spec, fps)
+
+def remove_outliers_and_smooth_1d(data, alpha=0.1, z_thresh=2, dtype=None, filter_spec=None, fps=None):
     """
     Removes outliers from 1D data and applies EWMA smoothing.
-    - data: list of numeric values
+    - data: 1D array (or list) of numeric values
     - alpha: EWMA smoothing factor (0 < alpha <= 1)
     - z_thresh: z-score threshold for outlier detection
+    - filter_spec: smoothing filter to use instead of the EWMA (see filters.apply_filter),
+      fps is then required for the non-EWMA methods
+    Returns a 1D array.
     """
-    arr = np.array(data, dtype=float)  # convert to float for NaN support
+    arr = np.array(data, dtype=resolve_dtype(dtype))  # float copy for NaN support
 
     # Outlier detection using z-score
     z = np.abs(stats.zscore(arr, nan_policy='omit'))
     mask = z < z_thresh
 
     # Replace outliers with NaN and interpolate
-    clean = arr.copy()
-    clean[~mask] = np.nan
-    clean = pd.Series(clean).interpolate().bfill().ffill().values
+    arr[~mask] = np.nan
+    fill_nans(arr)
+
+    # Apply smoothing
+    if filter_spec is None:
+        filter_spec = {"method": "ewma", "alpha": alpha}
+    return apply_filter(arr, filter_spec, fps)
+
+def smooth_keypoints(keypoints, z_thresh=2, dtype=None, filter_spec=None, fps=None, axis=0):
+    """remove_outliers_and_smooth for a keypoint tensor, e.g. one (frames, keypoints, 2)
+    window or a batch of them with axis=1: every keypoint is cleaned and all are
+    smoothed together in one pass.
+
+    A keypoint is dropped in the frames where either coordinate's z-score (over
+    time) reaches z_thresh, then the gaps are interpolated. Returns a new array.
+    """
+    arr = np.array(keypoints, dtype=resolve_dtype(dtype))
+    fill_nans_batch(arr, axis=axis)
+
+    z = np.abs(stats.zscore(arr, axis=axis, nan_policy='omit'))
+    arr[~(z < z_thresh).all(axis=-1)] = np.nan
+    fill_nans_batch(arr, axis=axis)
+
+    if filter_spec is None:
+        filter_spec = {"method": "ewma", "alpha": 0.1}
+    return apply_filter(arr, filter_spec, fps, axis=axis)
+
+
+def clean_poses(poses, z_thresh=2, dtype=None):
+    """angle_interpolate / pos_interpolate and the outlier removal of
+    remove_outliers_and_smooth(_1d) for a batch of [x, y, angle] windows.
+
+    poses is an (n_trials, frames, 3) tensor, angles in radians. Angles are
+    converted to degrees, then every trial is interpolated and cleaned at once:
+    a point is dropped in the frames where x or y reaches z_thresh, an angle
+    where it does, and the gaps are interpolated. Returns a new array.
+    """
+    arr = np.array(poses, dtype=resolve_dtype(dtype))
+    arr[..., 2] = np.degrees(arr[..., 2])
+    fill_nans_batch(arr, axis=1)
+
+    z = np.abs(stats.zscore(arr, axis=1, nan_policy="omit"))
+    outliers = np.zeros(arr.shape, dtype=bool)
+    outliers[..., :2] = ~(z[..., :2] < z_thresh).all(axis=2, keepdims=True)
+    outliers[..., 2] = ~(z[..., 2] < z_thresh)
+    arr[outliers] = np.nan
+    return fill_nans_batch(arr, axis=1)
 
-    # Apply EWMA smoothing
-    smooth = pd.Series(clean).ewm(alpha=alpha, adjust=False).mean().values
 
-    return smooth.tolist()
+def smooth_poses(poses, position_spec, angle_spec, fps=None):
+    """Smooths a clean_poses tensor along time, the positions and the angles of
+    all trials each in one filter call (see filters.apply_filter). Returns a new array."""
+    smoothed = np.empty_like(poses)
+    smoothed[..., :2] = apply_filter(poses[..., :2], position_spec, fps, axis=1)
+    smoothed[..., 2] = apply_filter(poses[..., 2], angle_spec, fps, axis=1)
+    return smoothed
 
-def angle_interpolate(values): 
-    angles_deg = [math.degrees(x) if x is not None else float('nan') for x in values]
-    arr = np.array(angles_deg, dtype = np.float64)
-    nans = np.isnan(arr)
-    if nans.any(): 
-        arr[nans] = np.interp(np.flatnonzero(nans), np.flatnonzero(~nans), arr[~nans])
 
-    return arr.tolist()
+def angle_interpolate(values, dtype=None):
+    """Converts angles (radians, None for dropped frames) to degrees and
+    interpolates the missing values. Returns a 1D array."""
+    arr = np.degrees(as_float_array(values, dtype))
+    return fill_nans(arr)
 
 
-def pos_interpolate(pos):
+def pos_interpolate(pos, dtype=None):
     """
-    pos: list of [x, y] (with values or None)
-    Returns a list of [x, y] with None values interpolated.
+    pos: (n, 2) array (or list) of [x, y] (with values or None/NaN)
+    Returns an (n, 2) array with missing values interpolated.
     """
-    pos_array = np.array([
-        [v if v is not None else np.nan for v in pt]
-        for pt in pos
-    ], dtype=np.float64)  # shape (n, 2)
+    pos_array = np.array(pos, dtype=resolve_dtype(dtype))  # shape (n, 2)
 
     # Interpolate x and y independently
-    for i in range(2):  # For x and y
-        col = pos_array[:, i]
-        nans = np.isnan(col)
-        if nans.any() and (~nans).any():
-            col[nans] = np.interp(
-                np.flatnonzero(nans),
-                np.flatnonzero(~nans),
-                col[~nans]
-            )
-        pos_array[:, i] = col
-
-    # Convert back to list of lists
-    return pos_array.tolist()
\ No newline at end of file
+    return fill_nans(pos_array)
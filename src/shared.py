@@ -0,0 +1,143 @@
+import atexit
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Byte alignment of every array in a segment
+ALIGN = 64
+
+# Segments attached in this process whose arrays may still be in use
+_attached = []
+
+
+class ArrayRef:
+    """Placeholder of an array moved into a shared memory segment."""
+
+    __slots__ = ("offset", "shape", "dtype")
+
+    def __init__(self, offset, shape, dtype):
+        self.offset = offset
+        self.shape = shape
+        self.dtype = dtype
+
+    def __getstate__(self):
+        return self.offset, self.shape, self.dtype
+
+    def __setstate__(self, state):
+        self.offset, self.shape, self.dtype = state
+
+
+def _shareable(value):
+    return isinstance(value, np.ndarray) and value.dtype.kind in "biuf"
+
+
+def _layout(obj, arrays, offset):
+    # Copy of obj with every numeric array replaced by its ArrayRef; the arrays
+    # and their offsets are collected in arrays
+    if _shareable(obj):
+        offset = -(-offset // ALIGN) * ALIGN
+        arrays.append((offset, obj))
+        return ArrayRef(offset, obj.shape, obj.dtype.str), offset + obj.nbytes
+    if isinstance(obj, dict):
+        out = {}
+        for key, value in obj.items():
+            out[key], offset = _layout(value, arrays, offset)
+        return out, offset
+    if isinstance(obj, (list, tuple)):
+        items = []
+        for value in obj:
+            item, offset = _layout(value, arrays, offset)
+            items.append(item)
+        return (items if isinstance(obj, list) else tuple(items)), offset
+    return obj, offset
+
+
+def pack(obj):
+    """Moves every numeric array of a (nested dict / list / tuple) result into one
+    new shared memory segment.
+
+    Returns:
+        tuple: (segment name, skeleton), the skeleton being obj with ArrayRef
+        placeholders; small enough to travel through a queue. The segment
+        belongs to whoever receives the descriptor (see unpack and discard).
+    """
+    arrays = []
+    skeleton, size = _layout(obj, arrays, 0)
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        for offset, array in arrays:
+            np.frombuffer(shm.buf, array.dtype, array.size, offset).reshape(array.shape)[...] = array
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    return shm.name, skeleton
+
+
+def _fill(skeleton, base):
+    if isinstance(skeleton, ArrayRef):
+        dtype = np.dtype(skeleton.dtype)
+        count = int(np.prod(skeleton.shape, dtype=np.int64))
+        return base[skeleton.offset:skeleton.offset + count * dtype.itemsize].view(dtype).reshape(skeleton.shape)
+    if isinstance(skeleton, dict):
+        return {key: _fill(value, base) for key, value in skeleton.items()}
+    if isinstance(skeleton, list):
+        return [_fill(value, base) for value in skeleton]
+    if isinstance(skeleton, tuple):
+        return tuple(_fill(value, base) for value in skeleton)
+    return skeleton
+
+
+def unpack(descriptor):
+    """Rebuilds a packed result with its arrays as views of the segment (no copy).
+
+    The segment's name is removed straight away, so it cannot leak: the memory
+    is freed once the process drops the arrays and release() is called (or the
+    process exits).
+    """
+    name, skeleton = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        # frombuffer (unlike ndarray(buffer=...)) holds the buffer, so the segment
+        # cannot be closed under live arrays
+        result = _fill(skeleton, np.frombuffer(shm.buf, np.uint8))
+    finally:
+        shm.unlink()
+    _attached.append(shm)
+    release()
+    return result
+
+
+def discard(descriptor):
+    """Frees the segment of a descriptor that will not be unpacked."""
+    try:
+        shm = shared_memory.SharedMemory(name=descriptor[0])
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def release():
+    """Unmaps the attached segments none of whose arrays are alive any more.
+
+    Returns:
+        int: Number of segments still in use.
+    """
+    for shm in list(_attached):
+        try:
+            shm.close()
+        except BufferError:
+            continue
+        _attached.remove(shm)
+    return len(_attached)
+
+
+@atexit.register
+def _release_at_exit():
+    # Segments still mapped by live arrays are unmapped by the OS at exit, so
+    # their close (which would fail) is skipped
+    release()
+    for shm in _attached:
+        shm.close = lambda: None
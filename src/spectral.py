@@ -0,0 +1,155 @@
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from scipy import signal
+
+from .alignment import batch_interp
+from .config import SPECTRAL_HARMONICS, WELCH_SEGMENT_S
+from .windows import WINDOW, nominal_fps
+
+# Measures of a run_stat_analysis output analysed, with their position in it
+SPECTRAL_MEASURES = {"lateral_velocity": 0, "forward_velocity": 1, "angular_velocity": 3}
+
+
+@lru_cache(maxsize=64)
+def _plan(n, nperseg, fps):
+    # Segment indices (50 % overlap), Hann taper, its power and the bin
+    # frequencies of a Welch estimate over n frames; read-only as they are shared
+    step = nperseg - nperseg // 2
+    index = np.arange(0, n - nperseg + 1, step)[:, None] + np.arange(nperseg)
+    taper = signal.get_window("hann", nperseg)
+    freqs = np.fft.rfftfreq(nperseg, 1 / fps)
+    for array in (index, taper, freqs):
+        array.setflags(write=False)
+    return index, taper, float(np.sum(taper ** 2)), freqs
+
+
+def welch(matrix, fps, segment=WELCH_SEGMENT_S):
+    """Welch power spectral density of every row of a matrix in one batched rFFT.
+
+    Matches scipy.signal.welch (Hann window, 50 % overlap, constant detrend,
+    density scaling), with the segment plan cached per trial length.
+
+    Args:
+        matrix (np.ndarray): (..., frames) uniformly sampled traces.
+        fps (float): Sampling rate.
+        segment (float): Segment length in seconds, None for a single
+            (Hann tapered) periodogram of the whole trace.
+
+    Returns:
+        tuple: (freqs, psd), psd of shape (..., len(freqs)).
+    """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    n = matrix.shape[-1]
+    nperseg = n if segment is None else min(max(int(round(segment * fps)), 2), n)
+    index, taper, power, freqs = _plan(n, nperseg, float(fps))
+
+    segments = matrix[..., index]
+    segments = segments - segments.mean(axis=-1, keepdims=True)
+    psd = np.abs(np.fft.rfft(segments * taper, axis=-1)) ** 2 / (fps * power)
+    # One-sided: every bin but DC (and Nyquist for even segments) counts twice
+    psd[..., 1:(nperseg + 1) // 2] *= 2
+    return freqs, psd.mean(axis=-2)
+
+
+def spectral_grid(fps, span="stim", window=WINDOW):
+    """Uniform time grid (seconds relative to the stimulation) the spectra are
+    computed on: the stimulation itself ("stim") or the whole window ("trial")."""
+    if span == "stim":
+        start, stop = 0.0, window.stim
+    elif span == "trial":
+        start, stop = -window.pre, window.post
+    else:
+        raise ValueError(f"Unknown spectral span: {span}")
+    return start + np.arange(int(round((stop - start) * fps))) / fps
+
+
+def trial_spectra(result, measures=tuple(SPECTRAL_MEASURES), span="stim", segment=WELCH_SEGMENT_S, window=WINDOW):
+    """Power spectra of every accepted trial of a run_stat_analysis output.
+
+    The trials of all measures and conditions recorded at the same nominal
+    frame rate (windows.nominal_fps) are resampled onto that rate's grid
+    (spectral_grid, from their window timestamps, so dropped frames and small
+    rate differences between files do not shift the spectrum) and transformed
+    together.
+
+    Returns:
+        dict: {nominal fps: {"freqs": (bins,), "psd": (rows, bins), "rows": [(measure,
+        (side, freq), trial index)]}}.
+    """
+    records = result[4].get("trials", {})
+    batches = defaultdict(lambda: ([], [], []))
+    for measure in measures:
+        for key, traces in result[SPECTRAL_MEASURES[measure]].items():
+            for i, (trace, record) in enumerate(zip(traces, records.get(key, ()))):
+                rows, times, values = batches[nominal_fps(record["fps"])]
+                rows.append((measure, key, i))
+                # Derived traces are shorter than their window, see align_trials
+                times.append(np.asarray(record["time"])[len(record["time"]) - len(trace):])
+                values.append(trace)
+
+    spectra = {}
+    for fps, (rows, times, values) in batches.items():
+        matrix = batch_interp(spectral_grid(fps, span, window), times, values)
+        # Samples outside a trial contribute no power
+        fill = np.nanmean(matrix, axis=1, keepdims=True) if np.isnan(matrix).any() else 0
+        matrix = np.where(np.isnan(matrix), np.nan_to_num(fill), matrix)
+        freqs, psd = welch(matrix, fps, segment)
+        spectra[fps] = {"freqs": freqs, "psd": psd, "rows": rows}
+    return spectra
+
+
+def stim_power(result, measures=tuple(SPECTRAL_MEASURES), harmonics=SPECTRAL_HARMONICS, span="stim",
+               segment=WELCH_SEGMENT_S, window=WINDOW):
+    """Power of every accepted trial at its stimulation frequency and harmonics.
+
+    Args:
+        result (tuple): run_stat_analysis output.
+        measures (tuple): Measures of SPECTRAL_MEASURES to analyse.
+        harmonics (int): Number of multiples of the stimulation frequency.
+        span (str): "stim" or "trial", see spectral_grid.
+        segment (float): Welch segment length in seconds (None for one periodogram).
+
+    Returns:
+        pd.DataFrame: One row per trial, measure and harmonic with the side,
+        freq, file and stim_frame of the trial, the target_hz, its power
+        (spectral density of the nearest bin) and rel_power (share of the
+        trial's total power in that bin), fps being the nominal rate the
+        trial was resampled to. Targets above its Nyquist frequency are NaN.
+    """
+    records = result[4].get("trials", {})
+    multiples = np.arange(1, harmonics + 1)
+    frames = []
+    for fps, spectra in trial_spectra(result, measures, span, segment, window).items():
+        freqs, psd, rows = spectra["freqs"], spectra["psd"], spectra["rows"]
+        # (rows, harmonics) targets and their nearest bins, all trials at once
+        targets = np.array([key[1] for _, key, _ in rows], dtype=np.float64)[:, None] * multiples
+        valid = targets <= fps / 2
+        bins = np.minimum(np.rint(targets / freqs[1]).astype(np.int64), len(freqs) - 1)
+        power = np.where(valid, np.take_along_axis(psd, bins, axis=1), np.nan)
+        total = psd.sum(axis=1, keepdims=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rel_power = power / total
+
+        provenance = [records[key][i] for _, key, i in rows]
+        frames.append(pd.DataFrame({
+            "side": np.repeat([key[0] for _, key, _ in rows], harmonics),
+            "freq": np.repeat([key[1] for _, key, _ in rows], harmonics),
+            "measure": np.repeat([measure for measure, _, _ in rows], harmonics),
+            "trial": np.repeat([i for _, _, i in rows], harmonics),
+            "file": np.repeat([record["file"] for record in provenance], harmonics),
+            "stim_frame": np.repeat([record["stim_frame"] for record in provenance], harmonics),
+            "fps": fps,
+            "harmonic": np.tile(multiples, len(rows)),
+            "target_hz": targets.ravel(),
+            "power": power.ravel(),
+            "rel_power": rel_power.ravel(),
+        }))
+
+    columns = ["side", "freq", "measure", "trial", "file", "stim_frame", "fps", "harmonic", "target_hz",
+               "power", "rel_power"]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)[columns]
@@ -1,18 +1,143 @@
+import io
 from collections import defaultdict
 from pathlib import Path
 
-from .io_utils import find_csv_filenames, file_read
-from .preprocessing import angle_interpolate, pos_interpolate, remove_outliers_and_smooth, remove_outliers_and_smooth_1d
-from .kinematics import get_body_angles, get_ang_vel, body_vel
+import numpy as np
+
+from .io_utils import find_csv_filenames, file_read, keypoints_read
+from .preprocessing import clean_poses, smooth_poses, smooth_keypoints
+from .kinematics import (get_body_angles, get_ang_vel, body_vel, trajectory_metrics, keypoint_heading, keypoint_center,
+                         TRAJECTORY_METRICS)
+from .latency import response_timing, TIMING_METRICS, TIMING_TRACES
 from .metrics import turning_fail, trial_is_outlier, elytra_fail, get_post_stim
-from .config import FREQUENCIES
+from .stim_index import load_windows
+from .config import FREQUENCIES, FILTERS
+from .windows import WINDOW
 
 
 def load_files(data_dir: Path):
     return [str(data_dir / fn) for fn in find_csv_filenames(data_dir)]
 
 
-def run_stat_analysis(files):
+def classify_trial(body_angle, in_line_vel, key, max_jump=40, jump_frames=5, min_final_fwd=0, window=WINDOW):
+    """Outcome of one trial: "turning_fail", "outlier", "elytra_fail" or "success",
+    checked in that order."""
+    if turning_fail(body_angle, key, window):
+        return "turning_fail"
+    if trial_is_outlier(body_angle, in_line_vel, key, max_jump, jump_frames):
+        return "outlier"
+    if elytra_fail(in_line_vel, key, min_final_fwd, window):
+        return "elytra_fail"
+    return "success"
+
+
+def iter_trials(files, dtype=None, indexed=False, keypoints=None, sources=None, window=WINDOW):
+    """Streams the pipeline one file at a time, yielding every stimulation window.
+
+    With keypoints (e.g. {"head": 0, "tail": -1, "center": None}) the files hold
+    several keypoints per frame (io_utils.keypoints_read): every window is
+    cleaned and smoothed as one (frames, keypoints, 2) tensor, the heading comes
+    from the head / tail keypoints and the position from the center keypoint
+    (mean of all keypoints if None).
+
+    sources maps files already read into memory (e.g. prefetched by
+    pipeline.run_pipeline) to their raw bytes, which are parsed in place of the
+    file. window (windows.WindowSpec) sets the extracted window and the
+    stimulation span of the fail checks.
+
+    Yields:
+        tuple: (key, outcome, traces, record), outcome as in classify_trial,
+        traces the (lateral velocity, forward velocity, body angle, angular
+        velocity) arrays and record the provenance of the trial (file,
+        stimulation frame, fps, window timestamps relative to the stimulation)
+        with its trajectory metrics (kinematics.trajectory_metrics) and the
+        response timing of its body angle and forward velocity as
+        "angle_latency", "fwd_rise_time", ... (latency.response_timing).
+    """
+    if indexed and keypoints is not None:
+        raise ValueError("The stimulation index only supports [x, y, angle] pose files")
+
+    for file in files:
+        source = io.BytesIO(sources[file]) if sources and file in sources else file
+        if keypoints is not None:
+            parts, stim_deets, stim_occur, fps, time = keypoints_read(source, dtype, return_time=True)
+            stim_dict, frame_dict, time_dict = get_post_stim(parts, stim_deets, stim_occur, fps, return_frames=True,
+                                                             pre=window.pre, post=window.post, time=time)
+        elif indexed:
+            stim_dict, frame_dict, time_dict, fps = load_windows(file, pre=window.pre, post=window.post, dtype=dtype,
+                                                                 return_frames=True, return_time=True)
+        else:
+            parts, stim_deets, stim_occur, fps, time = file_read(source, dtype, return_time=True)
+            stim_dict, frame_dict, time_dict = get_post_stim(parts, stim_deets, stim_occur, fps, return_frames=True,
+                                                             pre=window.pre, post=window.post, time=time)
+
+        windows = [(key, pose_lst, stim_frame, t) for key, value in stim_dict.items()
+                   for pose_lst, stim_frame, t in zip(value, frame_dict[key], time_dict[key])]
+
+        # Clean and smooth the file's windows of each length as one
+        # (n_trials, frames, ...) tensor, filtered along time in one call
+        by_length = defaultdict(list)
+        for i, (_, pose_lst, _, _) in enumerate(windows):
+            by_length[len(pose_lst)].append(i)
+        smoothed = [None] * len(windows)
+        for rows in by_length.values():
+            poses = np.stack([windows[i][1] for i in rows])
+            if keypoints is not None:
+                batch = smooth_keypoints(poses, z_thresh=2.5, dtype=dtype, filter_spec=FILTERS["position"],
+                                         fps=fps, axis=1)
+            else:
+                batch = smooth_poses(clean_poses(poses, z_thresh=2.5, dtype=dtype), FILTERS["position"],
+                                     FILTERS["angle"], fps)
+            for i, trial in zip(rows, batch):
+                smoothed[i] = trial
+
+        trials = []
+        for (key, _, stim_frame, t), points in zip(windows, smoothed):
+            if keypoints is not None:
+                pos = keypoint_center(points, keypoints.get("center"))
+                angles = keypoint_heading(points, keypoints.get("head", 0), keypoints.get("tail", -1))
+            else:
+                pos = np.ascontiguousarray(points[:, :2])
+                angles = np.ascontiguousarray(points[:, 2])
+
+            body_angle = get_body_angles(angles, fps, t, window)
+            ang_vel = get_ang_vel(body_angle, fps, t)
+            in_line_vel, transv_vel = body_vel(pos, angles, fps, time=t, window=window)
+
+            outcome = classify_trial(body_angle, in_line_vel, key, window=window)
+            record = {"file": str(file), "stim_frame": stim_frame, "fps": fps, "time": t}
+            trials.append((key, outcome, (transv_vel, in_line_vel, body_angle, ang_vel), record, pos))
+
+        # Path-shape metrics of all the file's trials in one pass
+        times = [trial[3]["time"] for trial in trials]
+        paths = trajectory_metrics([trial[4] for trial in trials], fps, times)
+        timing = {prefix: response_timing([trial[2][index] for trial in trials], fps, times, window=window)
+                  for prefix, index in TIMING_TRACES.items()}
+        for i, (key, outcome, traces, record, _) in enumerate(trials):
+            for name in TRAJECTORY_METRICS:
+                record[name] = float(paths[name][i])
+            for prefix, metrics in timing.items():
+                for name in TIMING_METRICS:
+                    record[f"{prefix}_{name}"] = float(metrics[name][i])
+            record["curvature"] = paths["curvature"][i]
+            yield key, outcome, traces, record
+
+
+def run_stat_analysis(files, dtype=None, indexed=False, keypoints=None, sources=None, window=WINDOW):
+    """Runs the full pipeline over a list of csv files. Trial traces are kept as
+    contiguous arrays of the given float dtype (defaults to config.FLOAT_DTYPE).
+    If indexed, only the stimulation windows are read through the sidecar
+    stimulation index (see stim_index) instead of parsing whole recordings.
+    keypoints selects multi-keypoint pose files, sources supplies files
+    already read into memory and window sets the trial window, see iter_trials.
+
+    summary["trials"] maps each key to one provenance record (file, stimulation
+    frame, fps, window timestamps relative to the stimulation) per accepted
+    trial, in the same order as the trace lists, with the trial's trajectory
+    metrics (path length, net displacement, tortuosity, turning radius and the
+    curvature profile) and response timing (latency, time to peak, rise time
+    and decay constant of the body angle and forward velocity). Kinematics use the true per-frame intervals from these
+    timestamps."""
     lateral_velocity = {}
     forward_velocity = {}
     body_angles = {}
@@ -25,55 +150,40 @@ def run_stat_analysis(files):
 
     turning_success_freq = defaultdict(list)
     elytra_success_freq = defaultdict(list)
+    trials = defaultdict(list)
 
-    for file in files:
-        parts, stim_deets, stim_occur, fps = file_read(file)
-        stim_dict = get_post_stim(parts, stim_deets, stim_occur, fps)
-
-        for key, value in stim_dict.items():
-            for pose_lst in value:
-                angles = [item[2] for item in pose_lst]
-                angles = angle_interpolate(angles)
-                pos = [[item[0], item[1]] for item in pose_lst]
-                pos = pos_interpolate(pos)
+    for key, outcome, traces, record in iter_trials(files, dtype, indexed, keypoints, sources, window):
+        for dct in (lateral_velocity, forward_velocity, body_angles, angular_velocity):
+            dct.setdefault(key, [])
 
-                pos = remove_outliers_and_smooth(pos, alpha=0.2, z_thresh=2.5)
-                angles = remove_outliers_and_smooth_1d(angles, alpha=0.2, z_thresh=2.5)
+        if outcome == "turning_fail":
+            turning_success_freq[key[1]].append(0)
+            turning_fail_no += 1
+            continue
 
-                body_angle = get_body_angles(angles, fps)
-                ang_vel = get_ang_vel(body_angle, fps)
-                in_line_vel, transv_vel = body_vel(pos, angles, fps)
+        if outcome == "outlier":
+            continue
 
-                for dct in (lateral_velocity, forward_velocity, body_angles, angular_velocity):
-                    dct.setdefault(key, [])
+        if outcome == "elytra_fail":
+            elytra_success_freq[key[1]].append(0)
+            elytra_fail_no += 1
+            continue 
 
-                if turning_fail(body_angle, key):
-                    turning_success_freq[key[1]].append(0)
-                    turning_fail_no += 1
-                    continue
+        transv_vel, in_line_vel, body_angle, ang_vel = traces
+        lateral_velocity[key].append(transv_vel)
+        forward_velocity[key].append(in_line_vel)
+        body_angles[key].append(body_angle)
+        angular_velocity[key].append(ang_vel)
+        trials[key].append(record)
 
-                if trial_is_outlier(body_angle, in_line_vel, key):
-                    continue
+        if key[0] == "Both":
+            elytra_succ_no += 1
+            elytra_success_freq[key[1]].append(1)
 
-                if elytra_fail(in_line_vel, key):
-                    elytra_success_freq[key[1]].append(0)
-                    elytra_fail_no += 1
-                    continue 
 
-
-                lateral_velocity[key].append(transv_vel)
-                forward_velocity[key].append(in_line_vel)
-                body_angles[key].append(body_angle)
-                angular_velocity[key].append(ang_vel)
-
-                if key[0] == "Both":
-                    elytra_succ_no += 1
-                    elytra_success_freq[key[1]].append(1)
-
-
-                elif key[0] in ("Right", "Left"):
-                    turning_succ_no += 1
-                    turning_success_freq[key[1]].append(1)
+        elif key[0] in ("Right", "Left"):
+            turning_succ_no += 1
+            turning_success_freq[key[1]].append(1)
 
     summary = {
         "turning_succ_no": turning_succ_no,
@@ -82,5 +192,43 @@ def run_stat_analysis(files):
         "elytra_fail_no": elytra_fail_no,
         "turning_success_freq": dict(turning_success_freq),
         "elytra_success_freq": dict(elytra_success_freq),
+        "trials": dict(trials),
     }
     return lateral_velocity, forward_velocity, body_angles, angular_velocity, summary
+
+
+def merge_results(results):
+    """Combines several run_stat_analysis outputs (e.g. one per file or per cohort)
+    into a single one, as if all their files had been analysed together."""
+    lateral_velocity = {}
+    forward_velocity = {}
+    body_angles = {}
+    angular_velocity = {}
+    summary = {
+        "turning_succ_no": 0,
+        "turning_fail_no": 0,
+        "elytra_succ_no": 0,
+        "elytra_fail_no": 0,
+        "turning_success_freq": defaultdict(list),
+        "elytra_success_freq": defaultdict(list),
+        "trials": defaultdict(list),
+    }
+
+    for result in results:
+        for merged, dct in zip((lateral_velocity, forward_velocity, body_angles, angular_velocity), result[:4]):
+            for key, value in dct.items():
+                merged.setdefault(key, []).extend(value)
+
+        for name, value in result[4].items():
+            if isinstance(value, dict):
+                # Dicts of lists (per frequency or per key) are concatenated
+                merged = summary.setdefault(name, defaultdict(list))
+                for key, items in value.items():
+                    merged[key].extend(items)
+            else:
+                summary[name] = summary.get(name, 0) + value
+
+    for name, value in summary.items():
+        if isinstance(value, defaultdict):
+            summary[name] = dict(value)
+    return lateral_velocity, forward_velocity, body_angles, angular_velocity, summary
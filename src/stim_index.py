@@ -0,0 +1,185 @@
+import io
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .config import DATA_RAW, DATA_PROCESSED, STIM_PRE_S, STIM_POST_S, STIM_DEBOUNCE_S, STIM_REFRACTORY_S
+from .io_utils import parse_arduino_column, parse_pose_column
+from .onsets import detect_onsets
+from .windows import WindowSpec
+
+INDEX_DIR = DATA_PROCESSED / "stim_index"
+INDEX_SUFFIX = ".stimidx.json"
+INDEX_VERSION = 3
+
+
+def index_path(file, index_dir=INDEX_DIR):
+    """Path of the stimulation index of a csv file: under index_dir, mirroring the
+    file's path below DATA_RAW (or its absolute path for files elsewhere)."""
+    file = Path(file).resolve()
+    try:
+        relative = file.relative_to(DATA_RAW.resolve())
+    except ValueError:
+        relative = file.relative_to(file.anchor)
+    return Path(index_dir) / relative.parent / (relative.name + INDEX_SUFFIX)
+
+
+def build_stim_index(file, pre=STIM_PRE_S, post=STIM_POST_S, debounce=STIM_DEBOUNCE_S, refractory=STIM_REFRACTORY_S):
+    """Scans a csv file once and indexes every stimulation window.
+
+    Records the fps and, per stimulation (onsets.detect_onsets), its onset
+    frame, offset frame, measured duration, side, frequency and the byte
+    offsets [start, end) of the rows of its extraction window (the same window
+    get_post_stim extracts). Windows running off either end of the recording
+    are left out, as in get_post_stim.
+
+    Returns:
+        dict: The index (json serialisable).
+    """
+    with open(file, "rb") as f:
+        data = f.read()
+
+    # Byte offset of the start of every line, plus the end of the file
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))
+    line_starts = np.concatenate(([0], newlines + 1))
+    if line_starts[-1] != len(data):
+        line_starts = np.append(line_starts, len(data))
+    # row_starts[i] is the start of data row i, row_starts[n_frames] the end of the file
+    row_starts = line_starts[1:]
+
+    df = pd.read_csv(io.BytesIO(data), usecols=["time", "arduino_data"])
+    if len(df) != len(row_starts) - 1:
+        raise ValueError(f"{file}: rows span several lines, cannot be indexed")
+
+    fps = float(1 / df["time"].diff().mean())
+    stim_deets, stim_occur = parse_arduino_column(df["arduino_data"])
+    onsets = detect_onsets(stim_occur, stim_deets, fps, df["time"].to_numpy(dtype=np.float64), debounce, refractory)
+
+    frames = WindowSpec(pre=pre, post=post).frames(fps)
+    pre_frames, post_frames = frames.pre, frames.post
+
+    stims = []
+    for stim, offset, duration in zip(onsets["onset"], onsets["offset"], onsets["duration"]):
+        start = stim - pre_frames
+        end = stim + post_frames
+        if start < 0 or end > len(df):
+            continue
+        stims.append({
+            "frame": int(stim),
+            "offset": int(offset),
+            "duration": float(duration),
+            "side": stim_deets[stim][0],
+            "freq": stim_deets[stim][1],
+            "start": int(row_starts[start]),
+            "end": int(row_starts[end]),
+        })
+
+    stat = os.stat(file)
+    return {
+        "version": INDEX_VERSION,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "pre": pre,
+        "post": post,
+        "debounce": debounce,
+        "refractory": refractory,
+        "fps": fps,
+        "n_frames": len(df),
+        "header_end": int(row_starts[0]),
+        "stims": stims,
+    }
+
+
+def load_stim_index(file, pre=STIM_PRE_S, post=STIM_POST_S, rebuild=False):
+    """Returns the sidecar index of a csv file, (re)building and saving it if it
+    is missing, stale (file changed) or was built for a different window or
+    onset detection settings."""
+    path = index_path(file)
+    if path.exists() and not rebuild:
+        with open(path) as f:
+            index = json.load(f)
+        stat = os.stat(file)
+        if (index.get("version") == INDEX_VERSION and index["size"] == stat.st_size
+                and index["mtime"] == stat.st_mtime and index["pre"] == pre and index["post"] == post
+                and index["debounce"] == STIM_DEBOUNCE_S and index["refractory"] == STIM_REFRACTORY_S):
+            return index
+
+    index = build_stim_index(file, pre, post)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(index, f)
+    return index
+
+
+def load_windows(file, side=None, freq=None, pre=STIM_PRE_S, post=STIM_POST_S, dtype=None, return_frames=False,
+                 return_time=False):
+    """Loads only the stimulation windows of a csv file, seeking straight to
+    their rows through the sidecar index instead of parsing the recording.
+
+    Args:
+        file: csv file.
+        side (str): Only load this stimulation side (all if None).
+        freq (int): Only load this frequency (all if None).
+        pre, post (float): Window in seconds before / after each stimulation.
+        dtype: Float dtype of the pose arrays (defaults to config.FLOAT_DTYPE).
+        return_frames (bool): Also return the stimulation frames.
+        return_time (bool): Also return the window timestamps relative to the stimulation.
+
+    Returns:
+        Same as get_post_stim: {(side, freq): [pose arrays]} (and the frames and
+        timestamps dicts), plus the fps of the recording as the last element.
+    """
+    index = load_stim_index(file, pre, post)
+    stims = [stim for stim in index["stims"]
+             if (side is None or stim["side"] == side) and (freq is None or stim["freq"] == freq)]
+
+    stim_dict = {}
+    frame_dict = {}
+    time_dict = {}
+    if stims:
+        # Read the header and each window's rows, then parse them in one go
+        chunks = []
+        with open(file, "rb") as f:
+            chunks.append(f.read(index["header_end"]))
+            for stim in stims:
+                f.seek(stim["start"])
+                chunk = f.read(stim["end"] - stim["start"])
+                # The last row of the file may lack its newline
+                chunks.append(chunk if chunk.endswith(b"\n") else chunk + b"\n")
+
+        df = pd.read_csv(io.BytesIO(b"".join(chunks)), usecols=["time", "pose"])
+        pose = parse_pose_column(df["pose"], dtype)
+        time = df["time"].to_numpy(dtype=np.float64)
+
+        # Every window has the same number of rows
+        pre_frames = WindowSpec(pre=pre, post=post).frames(index["fps"]).pre
+        for stim, pose_sect, time_sect in zip(stims, np.split(pose, len(stims)), np.split(time, len(stims))):
+            key = (stim["side"], stim["freq"])
+            stim_dict.setdefault(key, []).append(pose_sect)
+            frame_dict.setdefault(key, []).append(stim["frame"])
+            time_dict.setdefault(key, []).append(time_sect - time_sect[pre_frames])
+
+    outputs = (stim_dict,)
+    if return_frames:
+        outputs += (frame_dict,)
+    if return_time:
+        outputs += (time_dict,)
+    return outputs + (index["fps"],)
+
+
+def load_cohort_windows(files, side=None, freq=None, pre=STIM_PRE_S, post=STIM_POST_S, dtype=None):
+    """Loads the matching stimulation windows of several files, e.g.
+    load_cohort_windows(cohorts["C9"], "Left", 30).
+
+    Returns:
+        dict: {file: (stim_dict, fps)} for the files with at least one matching window.
+    """
+    windows = {}
+    for file in files:
+        stim_dict, fps = load_windows(file, side, freq, pre, post, dtype)
+        if stim_dict:
+            windows[file] = (stim_dict, fps)
+    return windows
@@ -0,0 +1,224 @@
+import warnings
+from collections import defaultdict
+
+import numpy as np
+
+from .aggregates import CURVE_MEASURES, QUANTILES
+from .alignment import align_trials, time_grid
+from .windows import WINDOW
+from .stats_pipeline import iter_trials
+
+
+class CurveAccumulator:
+    """Running mean, variance and count of trials on a fixed grid (Welford /
+    Chan et al. merge of batches), NaN grid points are skipped per column."""
+
+    def __init__(self, m):
+        self.n = np.zeros(m, dtype=np.int64)
+        self.mean = np.zeros(m)
+        self.m2 = np.zeros(m)
+
+    def update(self, matrix):
+        """Folds a (n_trials, m) batch into the running statistics."""
+        matrix = np.atleast_2d(matrix)
+        valid = ~np.isnan(matrix)
+        n_b = valid.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_b = np.where(valid, matrix, 0).sum(axis=0) / n_b
+            m2_b = np.where(valid, (matrix - mean_b) ** 2, 0).sum(axis=0)
+            n = self.n + n_b
+            delta = mean_b - self.mean
+            mean = self.mean + delta * n_b / n
+            m2 = self.m2 + m2_b + delta ** 2 * self.n * n_b / n
+        has = n_b > 0
+        self.mean[has] = mean[has]
+        self.m2[has] = m2[has]
+        self.n = n
+
+    def std(self):
+        """Population std (np.nanstd), NaN where no trial covers the grid point."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.n > 0, np.sqrt(self.m2 / self.n), np.nan)
+
+
+class P2Quantiles:
+    """Streaming quantile estimates for every grid point with the P² algorithm
+    (Jain & Chlamtac, 1985): five markers per quantile and grid point, updated
+    for all of them at once per trial. The first buffer_size values of a grid
+    point are kept, so the estimates are exact up to there, and seed the markers."""
+
+    def __init__(self, m, quantiles=QUANTILES, buffer_size=64):
+        self.p = np.asarray(quantiles, dtype=np.float64)[:, None]
+        self.size = max(int(buffer_size), 5)
+        self.count = np.zeros(m, dtype=np.int64)
+        self.buffer = np.full((self.size, m), np.nan)
+        # Marker heights, positions and desired positions: (n_quantiles, 5, m)
+        self.step = np.stack([np.zeros_like(self.p), self.p / 2, self.p, (1 + self.p) / 2,
+                              np.ones_like(self.p)], axis=1)
+        self.desired = np.repeat(1 + (self.size - 1) * self.step, m, axis=2)
+        pos = np.round(self.desired[:, :, :1])
+        # Markers need distinct positions
+        pos = np.maximum(pos, np.arange(1, 6)[None, :, None])
+        pos = np.minimum(pos, self.size - np.arange(4, -1, -1)[None, :, None])
+        self.pos = np.repeat(pos, m, axis=2)
+        self.q = np.zeros((len(self.p), 5, m))
+
+    def update(self, matrix):
+        """Folds a (n_trials, m) batch, one trial at a time."""
+        for row in np.atleast_2d(matrix):
+            self._update_row(row)
+
+    def _update_row(self, x):
+        valid = ~np.isnan(x)
+
+        # The first values of a grid point are buffered, then initialise its markers
+        filling = valid & (self.count < self.size)
+        self.buffer[self.count[filling], filling] = x[filling]
+        live = valid & ~filling
+        self.count[valid] += 1
+        ready = filling & (self.count == self.size)
+        if ready.any():
+            ranked = np.sort(self.buffer[:, ready], axis=0)
+            rank = self.pos[:, :, ready].astype(np.int64) - 1
+            self.q[:, :, ready] = ranked[rank, np.arange(ready.sum())]
+        if not live.any():
+            return
+
+        x = x[live]
+        q, pos, desired = self.q[:, :, live], self.pos[:, :, live], self.desired[:, :, live]
+        q[:, 0] = np.minimum(q[:, 0], x)
+        q[:, 4] = np.maximum(q[:, 4], x)
+        # Cell of x between the markers, the markers above it move up
+        k = (q[:, 1:4] <= x).sum(axis=1)
+        pos += np.arange(5)[None, :, None] > k[:, None, :]
+        desired += self.step
+
+        for i in (1, 2, 3):
+            d = desired[:, i] - pos[:, i]
+            move = (((d >= 1) & (pos[:, i + 1] - pos[:, i] > 1))
+                    | ((d <= -1) & (pos[:, i - 1] - pos[:, i] < -1)))
+            if not move.any():
+                continue
+            d = np.sign(d)
+            q_lo, q_i, q_hi = q[:, i - 1], q[:, i], q[:, i + 1]
+            n_lo, n_i, n_hi = pos[:, i - 1], pos[:, i], pos[:, i + 1]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                parabolic = q_i + d / (n_hi - n_lo) * ((n_i - n_lo + d) * (q_hi - q_i) / (n_hi - n_i)
+                                                       + (n_hi - n_i - d) * (q_i - q_lo) / (n_i - n_lo))
+                linear = q_i + d * (np.where(d > 0, q_hi, q_lo) - q_i) / (np.where(d > 0, n_hi, n_lo) - n_i)
+            new = np.where((q_lo < parabolic) & (parabolic < q_hi), parabolic, linear)
+            q[:, i] = np.where(move, new, q_i)
+            pos[:, i] = np.where(move, n_i + d, n_i)
+
+        self.q[:, :, live], self.pos[:, :, live], self.desired[:, :, live] = q, pos, desired
+
+    def result(self):
+        """(n_quantiles, m) estimates, NaN where the grid point saw no value."""
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            exact = np.nanquantile(self.buffer, self.p[:, 0], axis=0)
+        return np.where(self.count > self.size, self.q[:, 2], exact)
+
+
+class StreamingCurve:
+    """Constant memory equivalent of aggregates.curve_aggregates for one key."""
+
+    def __init__(self, grid, quantiles=QUANTILES, buffer_size=64, window=WINDOW):
+        self.grid = grid
+        self.window = window
+        self.quantiles = quantiles
+        self.moments = CurveAccumulator(len(grid))
+        self.sketch = P2Quantiles(len(grid), quantiles, buffer_size)
+
+    def update(self, matrix):
+        self.moments.update(matrix)
+        self.sketch.update(matrix)
+
+    def result(self):
+        curve = {
+            "x": self.grid + self.window.pre,
+            "mean": np.where(self.moments.n > 0, self.moments.mean, np.nan),
+            "std": self.moments.std(),
+            "n": self.moments.n.copy(),
+        }
+        for q, band in zip(self.quantiles, self.sketch.result()):
+            curve[f"q{round(q * 100):02d}"] = band
+        return curve
+
+
+def stream_aggregates(files, grid=None, quantiles=QUANTILES, dtype=None, indexed=False, batch_size=64, window=WINDOW):
+    """Out-of-core counterpart of run_stat_analysis followed by build_aggregates.
+
+    Files are streamed through stats_pipeline.iter_trials and every accepted
+    trial is folded into per-key accumulators on a fixed time grid, so memory
+    does not grow with the number of recordings (at most batch_size trials are
+    buffered per measure and key). Mean, std and count match the in-memory
+    curve_aggregates on the same grid; the quantile bands are exact up to 64
+    trials per grid point and P² estimates beyond (see P2Quantiles).
+
+    Args:
+        files (list): csv files, read one at a time.
+        grid (np.ndarray): Time grid relative to the stimulation, defaults to
+            alignment.time_grid at the frame rate of the first trial.
+        quantiles (tuple): Quantile bands to estimate.
+        dtype: Float dtype of the trial arrays (defaults to config.FLOAT_DTYPE).
+        indexed (bool): Read the windows through the stimulation index.
+        batch_size (int): Trials aligned and folded together.
+        window (WindowSpec): Trial window, see stats_pipeline.iter_trials.
+
+    Returns:
+        tuple: (aggregates, summary). aggregates has the "curves" of
+        build_aggregates (no peaks, their boxplots need every value) and summary
+        the counts of run_stat_analysis, with the per-frequency success lists
+        replaced by {freq: [n_success, n_trials]}.
+    """
+    curves = {measure: {} for measure in CURVE_MEASURES}
+    pending = defaultdict(list)
+    summary = {
+        "turning_succ_no": 0,
+        "turning_fail_no": 0,
+        "elytra_succ_no": 0,
+        "elytra_fail_no": 0,
+        "turning_success_freq": defaultdict(lambda: [0, 0]),
+        "elytra_success_freq": defaultdict(lambda: [0, 0]),
+    }
+
+    def flush(key):
+        traces, times = zip(*pending.pop(key))
+        for measure, measure_traces in zip(CURVE_MEASURES, zip(*traces)):
+            if key not in curves[measure]:
+                curves[measure][key] = StreamingCurve(grid, quantiles, window=window)
+            curves[measure][key].update(align_trials(measure_traces, times, grid)[1])
+
+    for key, outcome, traces, record in iter_trials(files, dtype, indexed, window=window):
+        kind = "elytra" if key[0] == "Both" else "turning"
+        if outcome == "outlier":
+            continue
+        if outcome in ("turning_fail", "elytra_fail"):
+            summary[f"{outcome}_no"] += 1
+            summary[f"{kind}_success_freq"][key[1]][1] += 1
+            continue
+
+        if key[0] in ("Both", "Right", "Left"):
+            summary[f"{kind}_succ_no"] += 1
+            counts = summary[f"{kind}_success_freq"][key[1]]
+            counts[0] += 1
+            counts[1] += 1
+
+        if grid is None:
+            grid = time_grid(record["fps"], window)
+        pending[key].append((traces, record["time"]))
+        if len(pending[key]) >= batch_size:
+            flush(key)
+
+    for key in list(pending):
+        flush(key)
+
+    summary["turning_success_freq"] = dict(summary["turning_success_freq"])
+    summary["elytra_success_freq"] = dict(summary["elytra_success_freq"])
+    aggregates = {
+        "curves": {measure: {key: curve.result() for key, curve in keys.items()}
+                   for measure, keys in curves.items()},
+        "peaks": {},
+    }
+    return aggregates, summary
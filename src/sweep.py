@@ -0,0 +1,159 @@
+import itertools
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from .config import STIM_PRE_S, STIM_POST_S, FILTERS
+from .filters import ewma_multi
+from .io_utils import file_read
+from .kinematics import get_body_angles, body_vel
+from .onsets import detect_onsets
+from .plotting.frequency import get_max_values
+from .preprocessing import clean_poses, resolve_dtype, smooth_poses
+from .stats_pipeline import classify_trial
+from .windows import WindowSpec
+
+# Values of the pipeline, swept one at a time unless a grid overrides them.
+# Without an "alpha" grid the position and angle smoothing of config.FILTERS is used.
+SWEEP_DEFAULTS = {
+    "pre": [STIM_PRE_S],
+    "post": [STIM_POST_S],
+    "z_thresh": [2.5],
+    "max_jump": [40],
+    "min_final_fwd": [0],
+}
+
+
+def load_sweep_windows(files, pre=STIM_PRE_S, post=STIM_POST_S, dtype=None):
+    """Parses every file once and extracts its stimulation windows with the
+    widest window of the sweep, smaller windows are sliced from these.
+
+    Windows are cut at the recording's edges rather than dropped (as
+    get_post_stim does), each keeping the frames available before and after
+    its onset, so a stimulation too close to an edge for the widest window
+    still counts for the windows it fits.
+
+    Returns:
+        list: One dict per trial with key, pose, time, fps and the available
+        "pre" / "post" frames around the onset.
+    """
+    windows = []
+    for file in files:
+        pose, stim_deets, stim_occur, fps, time = file_read(file, dtype, return_time=True)
+        frames = WindowSpec(pre=pre, post=post).frames(fps)
+        for stim in detect_onsets(stim_occur, stim_deets, fps, time)["onset"]:
+            start, end = max(stim - frames.pre, 0), min(stim + frames.post, len(pose))
+            windows.append({
+                "key": (stim_deets[stim][0], stim_deets[stim][1]),
+                "pose": pose[start:end].copy(),
+                "time": time[start:end] - time[stim],
+                "fps": fps,
+                "pre": stim - start,
+                "post": end - stim,
+            })
+    return windows
+
+
+def _slice_windows(windows, pre, post):
+    # Sub-window [-pre, post) of every window it fits in (the same windows as
+    # get_post_stim would extract), grouped by frame rate and length so each
+    # group stacks into one (n_trials, frames, 3) tensor
+    groups = defaultdict(list)
+    for window in windows:
+        frames = WindowSpec(pre=pre, post=post).frames(window["fps"])
+        if frames.pre > window["pre"] or frames.post > window["post"]:
+            continue
+        offset = window["pre"] - frames.pre
+        groups[window["fps"], frames.n].append((window, slice(offset, offset + frames.n)))
+    return groups.items()
+
+
+def _smooth(data, alphas, fps):
+    # [(alpha, smoothed tensor)]: one copy per swept EWMA alpha (position and
+    # angle alike), or the pipeline's config.FILTERS smoothing
+    if alphas is not None:
+        return list(zip(alphas, ewma_multi(data, alphas, axis=1)))
+    smoothed = smooth_poses(data, FILTERS["position"], FILTERS["angle"], fps)
+    specs = (FILTERS["position"], FILTERS["angle"])
+    same_ewma = all(spec["method"] == "ewma" for spec in specs) and specs[0]["alpha"] == specs[1]["alpha"]
+    return [(specs[1]["alpha"] if same_ewma else None, smoothed)]
+
+
+def run_sweep(files, grid=None, dtype=None):
+    """Evaluates the pipeline over a parameter grid, parsing and windowing the
+    data only once.
+
+    Every (pre, post) window is sliced from the widest one, every z_thresh
+    reuses the interpolated windows, all EWMA alphas (position and angle
+    smoothing) are computed together in one filtering pass, and the rejection
+    thresholds only re-classify the resulting trials. Without an alpha grid
+    the windows are smoothed with config.FILTERS, as in run_stat_analysis
+    (the alpha column is then the shared EWMA alpha, or None).
+
+    Args:
+        files (list): csv files.
+        grid (dict): Values to sweep per parameter, missing parameters take
+            SWEEP_DEFAULTS: pre, post (window seconds), z_thresh, alpha (EWMA
+            smoothing of positions and angles), max_jump (trial_is_outlier)
+            and min_final_fwd (elytra_fail).
+        dtype: Float dtype of the trial arrays (defaults to config.FLOAT_DTYPE).
+
+    Returns:
+        pd.DataFrame: One row per grid point and (side, freq) with the trial
+        counts, success rate and mean peak angle / forward velocity.
+    """
+    grid = {**SWEEP_DEFAULTS, **(grid or {})}
+    alphas = grid.get("alpha")
+    dtype = resolve_dtype(dtype)
+    windows = load_sweep_windows(files, max(grid["pre"]), max(grid["post"]), dtype)
+    thresholds = list(itertools.product(grid["max_jump"], grid["min_final_fwd"]))
+
+    # (pre, post, z, alpha, max_jump, min_final_fwd) -> outcome counts and accepted traces
+    outcomes = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    accepted = defaultdict(lambda: ({}, {}))
+
+    for pre, post in itertools.product(grid["pre"], grid["post"]):
+        spec = WindowSpec(pre=pre, post=post)
+        for (fps, _), group in _slice_windows(windows, pre, post):
+            poses = [window["pose"][sl] for window, sl in group]
+            for z_thresh in grid["z_thresh"]:
+                clean = clean_poses(poses, z_thresh, dtype)
+                for alpha, trials in _smooth(clean, alphas, fps):
+                    for (window, sl), trial in zip(group, trials):
+                        key, t = window["key"], window["time"][sl]
+                        angles, pos = trial[:, 2], trial[:, :2]
+                        body_angle = get_body_angles(angles, fps, t, spec)
+                        in_line_vel, _ = body_vel(pos, angles, fps, time=t, window=spec)
+
+                        for max_jump, min_final_fwd in thresholds:
+                            point = (pre, post, z_thresh, alpha, max_jump, min_final_fwd)
+                            outcome = classify_trial(body_angle, in_line_vel, key, max_jump=max_jump,
+                                                     min_final_fwd=min_final_fwd, window=spec)
+                            outcomes[point][key][outcome] += 1
+                            if outcome == "success":
+                                angles_dict, fwd_dict = accepted[point]
+                                angles_dict.setdefault(key, []).append(body_angle)
+                                fwd_dict.setdefault(key, []).append(in_line_vel)
+
+    rows = []
+    names = ("pre", "post", "z_thresh", "alpha", "max_jump", "min_final_fwd")
+    for point, keys in outcomes.items():
+        angles_dict, fwd_dict = accepted[point]
+        _, fwd_max, angles_max, _ = get_max_values({}, fwd_dict, angles_dict, {},
+                                                   window=WindowSpec(pre=point[0], post=point[1]))
+        for key, counts in sorted(keys.items()):
+            n_fail = counts["turning_fail"] + counts["elytra_fail"]
+            n_success = counts["success"]
+            rows.append({
+                **dict(zip(names, point)),
+                "side": key[0],
+                "freq": key[1],
+                "n_trials": sum(counts.values()),
+                "n_outliers": counts["outlier"],
+                "n_success": n_success,
+                "success_rate": n_success / (n_success + n_fail) if n_success + n_fail else np.nan,
+                "angle_peak_mean": np.mean(angles_max[key]) if key in angles_max else np.nan,
+                "fwd_peak_mean": np.mean(fwd_max[key]) if key in fwd_max else np.nan,
+            })
+    return pd.DataFrame(rows)
@@ -0,0 +1,80 @@
+from collections import namedtuple
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+from .config import FPS_DECIMALS, STIM_PRE_S, STIM_S, STIM_POST_S
+
+# Frame indices of a window: pre / post frames extracted around the onset, the
+# onset (= pre) and the [stim_start, stim_stop) span of the stimulation, of a
+# window of n frames
+Frames = namedtuple("Frames", ["pre", "post", "onset", "stim_start", "stim_stop", "n"])
+
+
+def nominal_fps(fps, decimals=FPS_DECIMALS):
+    """Nominal frame rate of a recording from its measured one (config.FPS_DECIMALS)."""
+    return float(round(float(fps), decimals))
+
+
+@dataclass(frozen=True)
+class WindowSpec:
+    """Trial window around a stimulation onset, in seconds: pre before the onset,
+    stim the stimulation itself (the "during stimulation" span of the fail
+    checks, peaks and plots) and post after the onset, stim included.
+
+    Times on the plot axis run from 0 (window start) to duration, the onset
+    being at pre; timestamps relative to the stimulation run from -pre to post.
+    """
+
+    pre: float = STIM_PRE_S
+    stim: float = STIM_S
+    post: float = STIM_POST_S
+
+    @property
+    def duration(self):
+        return self.pre + self.post
+
+    def frames(self, fps):
+        """Frames table of the window extracted at fps (see get_post_stim), from
+        the nominal rate of the recording (nominal_fps)."""
+        return _fps_frames(self, nominal_fps(fps))
+
+    def trial(self, n):
+        """Frames table of a trial of n frames spanning the whole window (for
+        trials without timestamps)."""
+        return _trial_frames(self, int(n))
+
+    def stim_slice(self, n):
+        """Slice of the stimulation span of a trial of n frames."""
+        table = self.trial(n)
+        return slice(table.stim_start, table.stim_stop)
+
+    def stim_mask(self, x):
+        """Mask of the stimulation span on the plot time axis x."""
+        x = np.asarray(x)
+        return (x >= self.pre) & (x <= self.pre + self.stim)
+
+    def relative_mask(self, t):
+        """Mask of the stimulation span for timestamps relative to the onset."""
+        t = np.asarray(t)
+        return (t >= 0) & (t <= self.stim)
+
+
+@lru_cache(maxsize=64)
+def _fps_frames(spec, fps):
+    pre, post = int(fps * spec.pre), int(fps * spec.post)
+    return Frames(pre, post, pre, pre, min(pre + int(fps * spec.stim), pre + post), pre + post)
+
+
+@lru_cache(maxsize=256)
+def _trial_frames(spec, n):
+    # Positions scale with the trial's length: n frames span spec.duration
+    def at(seconds):
+        return min(int(round(seconds * n / spec.duration)), n)
+    onset = at(spec.pre)
+    return Frames(onset, n - onset, onset, onset, at(spec.pre + spec.stim), n)
+
+
+# The window of the whole pipeline (config.STIM_PRE_S / STIM_S / STIM_POST_S)
+WINDOW = WindowSpec()